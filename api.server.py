@@ -1,7 +1,7 @@
-from fastapi import FastAPI, HTTPException, Depends, Header, Query
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
-from supabase import create_client, Client
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse, PlainTextResponse
+import asyncio
 import os
 from dotenv import load_dotenv
 import logging
@@ -10,8 +10,19 @@ import uuid
 import time
 from datetime import datetime, timedelta
 import hashlib
+import hmac
 import json
 
+from db import create_db_client
+from category_counters import CategoryCounters
+from stats_snapshot import StatsSnapshot
+from export import EXPORT_TABLES, export_stream, export_filename, export_media_type
+from db_utils import or_filter
+from pagination import PROJECTS_ORDER, decode_cursor, fetch_projects_page
+from loop_watchdog import LoopWatchdog
+from log_setup import setup_logging, bind_log_context, reset_log_context
+from sampling_profiler import SamplingProfiler, ProfilerBusy
+
 # Загрузка переменных окружения
 load_dotenv()
 
@@ -26,21 +37,34 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Инициализация Supabase
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Инициализация базы и настройки
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", 0))
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Supabase или встроенный SQLite (DB_BACKEND=sqlite)
+supabase = create_db_client()
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования (очередь + поток записи, JSON в LOG_FILE)
+setup_logging("api")
 logger = logging.getLogger(__name__)
 
 # Константы
 RATING_MAP = {1: -5, 2: -2, 3: 0, 4: 2, 5: 5}
 SESSION_DURATION_DAYS = 30
+CATEGORY_COUNTERS_TTL = int(os.getenv("CATEGORY_COUNTERS_TTL", 60))
+STATS_SNAPSHOT_TTL = int(os.getenv("STATS_SNAPSHOT_TTL", 5))
+
+# Счетчики категорий; проекты добавляет бот, поэтому раз в CATEGORY_COUNTERS_TTL секунд перечитываем в фоне
+category_counters = CategoryCounters(ttl=CATEGORY_COUNTERS_TTL)
+stats_snapshot = StatsSnapshot(ttl=STATS_SNAPSHOT_TTL)
+
+# Сторож event loop (0 — выключен)
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", 100))
+loop_watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD_MS / 1000) if LOOP_LAG_THRESHOLD_MS > 0 else None
+
+# Профилировщик по запросу (/api/admin/profile)
+profiler = SamplingProfiler()
 
 # Вспомогательные функции
 def create_session_token(user_id: int) -> str:
@@ -63,9 +87,33 @@ def get_user_id_from_token(session_token: str) -> Optional[int]:
             if datetime.utcnow() < expires_at:
                 return result.data['user_id']
     except Exception as e:
-        logger.error(f"Error getting user from token: {e}")
+        logger.error("Error getting user from token: %s", e)
     return None
 
+def verify_admin_token(x_admin_token: str = Header(...)):
+    """Проверка токена администратора для служебных эндпоинтов"""
+    if not ADMIN_API_TOKEN or not hmac.compare_digest(x_admin_token, ADMIN_API_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+@app.middleware("http")
+async def bind_request_id(request: Request, call_next):
+    """request_id во всех логах запроса и в заголовке ответа"""
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:16]
+    token = bind_log_context(request_id=request_id)
+    try:
+        response = await call_next(request)
+    finally:
+        reset_log_context(token)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.on_event("startup")
+async def load_counters():
+    await asyncio.to_thread(category_counters.try_load, supabase)
+    asyncio.create_task(category_counters.run_refresher(supabase))
+    if loop_watchdog:
+        loop_watchdog.start()
+
 # API endpoints
 @app.get("/")
 async def root():
@@ -76,29 +124,47 @@ async def get_projects(
     category: Optional[str] = None,
     limit: int = Query(20, ge=1, le=100),
     offset: int = Query(0, ge=0),
+    cursor: Optional[str] = None,
     sort_by: str = Query("score", regex="^(score|name|created_at)$")
 ):
-    """Получить список проектов"""
+    """Получить список проектов
+
+    Для сортировки по рейтингу используется курсор (next_cursor в ответе):
+    глубокие страницы стоят столько же, сколько первая, и не «плывут» при голосовании.
+    offset оставлен для обратной совместимости.
+    """
+    if cursor:
+        if sort_by != "score":
+            raise HTTPException(status_code=400, detail="cursor is supported only for sort_by=score")
+        try:
+            decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    
     try:
         query = supabase.table("projects").select("*")
         
         if category:
             query = query.eq("category", category)
         
-        if sort_by == "score":
-            query = query.order("score", desc=True)
-        elif sort_by == "name":
-            query = query.order("name")
-        elif sort_by == "created_at":
-            query = query.order("created_at", desc=True)
-        
-        query = query.range(offset, offset + limit - 1)
-        
-        result = query.execute()
+        next_cursor = None
+        if sort_by == "score" and (cursor or not offset):
+            data, next_cursor = fetch_projects_page(query, cursor, limit)
+        else:
+            if sort_by == "score":
+                query = query.order(PROJECTS_ORDER)
+            elif sort_by == "name":
+                query = query.order("name")
+            elif sort_by == "created_at":
+                query = query.order("created_at", desc=True)
+            
+            query = query.range(offset, offset + limit - 1)
+            
+            data = query.execute().data
         
         # Получаем фото для каждого проекта
         projects_with_photos = []
-        for project in result.data:
+        for project in data:
             # Получаем фото проекта
             photo_result = supabase.table("project_photos")\
                 .select("photo_file_id")\
@@ -110,24 +176,23 @@ async def get_projects(
             project['photo'] = photo_result.data[0]['photo_file_id'] if photo_result.data else None
             projects_with_photos.append(project)
         
-        # Получаем общее количество
-        count_query = supabase.table("projects").select("*", count="exact")
+        # Общее количество берем из счетчиков категорий (последний снимок)
         if category:
-            count_query = count_query.eq("category", category)
-        
-        count_result = count_query.execute()
-        total_count = count_result.count if hasattr(count_result, 'count') else 0
+            total_count = category_counters.count(category)
+        else:
+            total_count = sum(item['count'] for item in category_counters.all())
         
         return {
             "success": True,
             "data": projects_with_photos,
             "total": total_count,
             "limit": limit,
-            "offset": offset
+            "offset": offset,
+            "next_cursor": next_cursor
         }
         
     except Exception as e:
-        logger.error(f"Error getting projects: {e}")
+        logger.error("Error getting projects: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/projects/{project_id}")
@@ -188,7 +253,7 @@ async def get_project(project_id: int):
         return {"success": True, "data": project}
         
     except Exception as e:
-        logger.error(f"Error getting project {project_id}: {e}")
+        logger.error("Error getting project %s: %s", project_id, e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/api/auth/start")
@@ -225,7 +290,7 @@ async def start_auth(user_id: int):
         }
         
     except Exception as e:
-        logger.error(f"Error starting auth for user {user_id}: {e}")
+        logger.error("Error starting auth for user %s: %s", user_id, e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/user/profile")
@@ -260,7 +325,7 @@ async def get_user_profile(session_token: str = Header(...)):
         return {"success": True, "data": user_data}
         
     except Exception as e:
-        logger.error(f"Error getting profile for user {user_id}: {e}")
+        logger.error("Error getting profile for user %s: %s", user_id, e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/api/projects/{project_id}/review")
@@ -343,6 +408,7 @@ async def submit_review(
             .update({"score": new_score})\
             .eq("id", project_id)\
             .execute()
+        category_counters.apply_score_change(project['category'], new_score - old_score)
         
         # Добавляем в историю
         supabase.table("rating_history")\
@@ -367,7 +433,7 @@ async def submit_review(
         }
         
     except Exception as e:
-        logger.error(f"Error submitting review: {e}")
+        logger.error("Error submitting review: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.post("/api/projects/{project_id}/like")
@@ -432,6 +498,7 @@ async def toggle_like(
             .update({"score": new_score})\
             .eq("id", project_id)\
             .execute()
+        category_counters.apply_score_change(project['category'], new_score - old_score)
         
         # Добавляем в историю
         supabase.table("rating_history")\
@@ -455,71 +522,48 @@ async def toggle_like(
         }
         
     except Exception as e:
-        logger.error(f"Error toggling like: {e}")
+        logger.error("Error toggling like: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/categories")
 async def get_categories():
     """Получить список категорий с количеством проектов"""
     try:
-        result = supabase.table("projects")\
-            .select("category, count", count="exact")\
-            .group("category")\
-            .execute()
+        if not category_counters.ensure_loaded():
+            raise RuntimeError("category counters are not loaded")
         
         categories = []
-        if result.data:
-            for item in result.data:
-                categories.append({
-                    "name": item['category'],
-                    "count": item['count']
-                })
+        for item in category_counters.all():
+            categories.append({
+                "name": item['category'],
+                "count": item['count'],
+                "score_sum": item['score_sum'],
+                "avg_score": item['avg_score']
+            })
         
         return {"success": True, "data": categories}
         
     except Exception as e:
-        logger.error(f"Error getting categories: {e}")
+        logger.error("Error getting categories: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/stats")
 async def get_stats():
     """Получить общую статистику"""
     try:
-        # Общее количество проектов
-        projects_result = supabase.table("projects")\
-            .select("*", count="exact")\
-            .execute()
-        
-        # Количество отзывов
-        reviews_result = supabase.table("user_logs")\
-            .select("*", count="exact")\
-            .eq("action_type", "review")\
-            .execute()
-        
-        # Количество лайков
-        likes_result = supabase.table("user_logs")\
-            .select("*", count="exact")\
-            .eq("action_type", "like")\
-            .execute()
-        
-        # Топ проектов
-        top_projects_result = supabase.table("projects")\
-            .select("*")\
-            .order("score", desc=True)\
-            .limit(5)\
-            .execute()
+        snapshot = stats_snapshot.get(supabase)
         
         stats = {
-            "total_projects": projects_result.count if hasattr(projects_result, 'count') else 0,
-            "total_reviews": reviews_result.count if hasattr(reviews_result, 'count') else 0,
-            "total_likes": likes_result.count if hasattr(likes_result, 'count') else 0,
-            "top_projects": top_projects_result.data if top_projects_result.data else []
+            "total_projects": snapshot['total_projects'],
+            "total_reviews": snapshot['total_reviews'],
+            "total_likes": snapshot['total_likes'],
+            "top_projects": snapshot['top_projects']
         }
         
         return {"success": True, "data": stats}
         
     except Exception as e:
-        logger.error(f"Error getting stats: {e}")
+        logger.error("Error getting stats: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/api/search")
@@ -529,19 +573,64 @@ async def search_projects(
 ):
     """Поиск проектов"""
     try:
-        result = supabase.table("projects")\
-            .select("*")\
-            .or_(f"name.ilike.%{q}%,description.ilike.%{q}%")\
-            .order("score", desc=True)\
-            .limit(limit)\
-            .execute()
+        query = or_filter(
+            supabase.table("projects").select("*"),
+            f"name.ilike.%{q}%,description.ilike.%{q}%"
+        )
+        result = query.order("score", desc=True).limit(limit).execute()
         
         return {"success": True, "data": result.data if result.data else []}
         
     except Exception as e:
-        logger.error(f"Error searching projects: {e}")
+        logger.error("Error searching projects: %s", e)
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/api/admin/export/{table}", dependencies=[Depends(verify_admin_token)])
+async def export_table(
+    table: str,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+    gzip: bool = False
+):
+    """Потоковая выгрузка таблицы в NDJSON или CSV"""
+    if table not in EXPORT_TABLES:
+        raise HTTPException(status_code=404, detail="Unknown table")
+    
+    filename = export_filename(table, fmt, gzip)
+    return StreamingResponse(
+        export_stream(supabase, table, fmt, gzip),
+        media_type=export_media_type(fmt, gzip),
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.get("/api/admin/looplag", dependencies=[Depends(verify_admin_token)])
+async def loop_lag(top: int = Query(10, ge=1, le=100), reset: bool = False):
+    """Задержка event loop API и места блокирующих вызовов"""
+    if not loop_watchdog:
+        raise HTTPException(status_code=404, detail="Loop watchdog disabled")
+    report = loop_watchdog.snapshot(top)
+    if reset:
+        loop_watchdog.reset()
+    return {"success": True, "data": report}
+
+@app.get("/api/admin/profile", dependencies=[Depends(verify_admin_token)])
+async def profile(
+    seconds: int = Query(10, ge=1, le=120),
+    fmt: str = Query("collapsed", alias="format", pattern="^(collapsed|summary)$")
+):
+    """Сэмплирующий профиль процесса API: collapsed-стеки для flame graph или сводка"""
+    try:
+        result = await profiler.profile(seconds)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="Profiling already in progress")
+    
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    if fmt == "summary":
+        return PlainTextResponse(result.summary())
+    return PlainTextResponse(
+        result.collapsed(),
+        headers={"Content-Disposition": f'attachment; filename="api-profile-{stamp}.collapsed.txt"'}
+    )
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
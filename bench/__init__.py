@@ -0,0 +1,4 @@
+"""Офлайн-бенчмарки бота: заглушки Bot API и PostgREST, сценарии и отчеты
+
+Запуск: python -m bench.run --help
+"""
@@ -0,0 +1,134 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+# Синтетические данные для бенчмарков; генераторы строк, чтобы большие
+# объемы можно было лить в хранилище потоком, не держа их в памяти
+
+RATING_MAP = {1: -5, 2: -2, 3: 0, 4: 2, 5: 5}
+
+# Пользователи с данными в истории; пользователи сценариев берутся выше этого диапазона
+SEED_USER_BASE = 5_000_000
+
+
+def iter_projects(categories: list, count: int, rnd: random.Random):
+    for project_id in range(1, count + 1):
+        yield {
+            "id": project_id,
+            "name": f"Проект {project_id}",
+            "category": categories[(project_id - 1) % len(categories)],
+            "description": f"Описание проекта {project_id}. " * rnd.randint(1, 12),
+            "score": 0,
+            "created_at": (datetime.now(timezone.utc) - timedelta(days=rnd.randint(30, 400))).isoformat(timespec="microseconds")
+        }
+
+
+def iter_project_photos(projects: int, rnd: random.Random, share: float = 0.5):
+    for project_id in range(1, projects + 1):
+        if rnd.random() < share:
+            yield {
+                "project_id": project_id,
+                "photo_file_id": f"bench_photo_{project_id}",
+                "updated_by": 1,
+                "updated_at": datetime.now(timezone.utc).isoformat(timespec="microseconds")
+            }
+
+
+def iter_activity(projects: int, users: int, history: int, days: int, rnd: random.Random):
+    """Отзывы, лайки и соответствующие им записи rating_history
+
+    Возвращает пары (таблица, строка); id задаются явно, чтобы ссылки
+    related_review_id совпадали в любом хранилище.
+    """
+    now = datetime.now(timezone.utc)
+    scores = [0] * (projects + 1)
+    # Битовая карта (пользователь, проект, действие) вместо множества кортежей — для миллионов строк
+    seen = bytearray((users * projects * 2) // 8 + 1)
+    log_id = 0
+
+    for history_id in range(1, history + 1):
+        project_id = rnd.randint(1, projects)
+        user_id = SEED_USER_BASE + rnd.randint(1, users)
+        created_at = (now - timedelta(seconds=rnd.randint(0, days * 86400))).isoformat(timespec="microseconds")
+        is_review = rnd.random() < 0.6
+
+        related = None
+        bit = ((user_id - SEED_USER_BASE - 1) * projects + project_id - 1) * 2 + (0 if is_review else 1)
+        if not seen[bit >> 3] & (1 << (bit & 7)):
+            seen[bit >> 3] |= 1 << (bit & 7)
+            log_id += 1
+            related = log_id
+            rate = rnd.randint(1, 5)
+            yield "user_logs", {
+                "id": log_id,
+                "user_id": user_id,
+                "project_id": project_id,
+                "action_type": "review" if is_review else "like",
+                "review_text": f"Отзыв пользователя {user_id}" if is_review else None,
+                "rating_val": rate if is_review else None,
+                "created_at": created_at
+            }
+            change = RATING_MAP[rate] if is_review else 1
+            reason = f"Новый отзыв: {rate}/5" if is_review else "Лайк от пользователя"
+        else:
+            # Повтор действия — изменение ранее оставленного отзыва
+            is_review = True
+            change = rnd.choice((-2, 0, 2))
+            reason = "Изменение отзыва"
+
+        before = scores[project_id]
+        scores[project_id] += change
+        yield "rating_history", {
+            "id": history_id,
+            "project_id": project_id,
+            "user_id": user_id,
+            "username": f"user{user_id}",
+            "change_type": "user_review" if is_review else "like",
+            "score_before": before,
+            "score_after": scores[project_id],
+            "change_amount": change,
+            "reason": reason,
+            "is_admin_action": False,
+            "related_review_id": related,
+            "created_at": created_at
+        }
+
+    for project_id in range(1, projects + 1):
+        yield "project_scores", {"id": project_id, "score": scores[project_id]}
+
+
+def iter_user_stats(users: int, rnd: random.Random):
+    for offset in range(1, users + 1):
+        yield {
+            "user_id": SEED_USER_BASE + offset,
+            "referral_count": rnd.randint(0, 3),
+            "reviews_count": rnd.randint(0, 20),
+            "likes_count": rnd.randint(0, 20)
+        }
+
+
+def generate_dataset(categories: list, projects: int = 60, users: int = 2000, history: int = 20000,
+                     days: int = 60, seed: int = 1) -> dict:
+    """Набор таблиц целиком в памяти (для заглушки PostgREST)"""
+    rnd = random.Random(seed)
+    tables = {
+        "projects": list(iter_projects(categories, projects, rnd)),
+        "project_photos": list(iter_project_photos(projects, rnd)),
+        "user_logs": [],
+        "rating_history": [],
+        "user_stats": list(iter_user_stats(users, rnd)),
+        "banned_users": [{"id": 1, "user_id": SEED_USER_BASE, "reason": "bench", "banned_by": 1}],
+        "referrals": [],
+        "referral_logs": [],
+        "user_directory": []
+    }
+
+    scores = {}
+    for table, row in iter_activity(projects, users, history, days, rnd):
+        if table == "project_scores":
+            scores[row["id"]] = row["score"]
+        else:
+            tables[table].append(row)
+
+    for project in tables["projects"]:
+        project["score"] = scores.get(project["id"], 0)
+    return tables
@@ -0,0 +1,387 @@
+import itertools
+import json
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from aiohttp import web
+
+from bench.servers import Latency
+from postgrest_filters import Condition, coerce, is_time_column, normalize_timestamp, parse_params, utc_now
+
+# Первичные ключи таблиц без суррогатного id (по ним же работает upsert)
+TABLE_KEYS = {
+    "project_photos": "project_id",
+    "user_stats": "user_id",
+    "user_directory": "user_id",
+    "site_sessions": "user_id"
+}
+
+# Колонки с хеш-индексом: фильтр eq по ним не перебирает всю таблицу
+INDEXED_COLUMNS = {
+    "projects": ("category", "name"),
+    "user_logs": ("user_id", "project_id"),
+    "rating_history": ("project_id", "user_id"),
+    "referral_logs": ("inviter_id", "referred_user_id"),
+    "referrals": ("user_id", "code"),
+    "banned_users": ("user_id",),
+    "user_directory": ("username_lower",),
+    "site_sessions": ("session_token",)
+}
+
+# Колонки времени с отсортированным индексом: фильтры gt/gte/lt/lte по ним
+# берут срез, а не перебирают всю таблицу (как btree-индексы в sql/*.sql)
+SORTED_COLUMNS = {
+    "user_logs": ("created_at",),
+    "rating_history": ("created_at",),
+    "referral_logs": ("activated_at",)
+}
+
+RANGE_OPERATORS = ("gt", "gte", "lt", "lte")
+
+
+class Conflict(Exception):
+    pass
+
+
+def now_iso() -> str:
+    """now() в том же виде, что и у SQLite-бэкенда: UTC с микросекундами"""
+    return utc_now()
+
+
+class MemoryStore:
+    """Таблицы в памяти: строки по первичному ключу плюс хеш-индексы и индексы по времени"""
+
+    def __init__(self):
+        self.tables = {}
+        self._indexes = {}
+        self._sorted = {}
+        self._ids = {}
+
+    def key(self, table: str) -> str:
+        return TABLE_KEYS.get(table, "id")
+
+    def rows(self, table: str) -> dict:
+        if table not in self.tables:
+            self.tables[table] = {}
+            self._indexes[table] = {column: {} for column in INDEXED_COLUMNS.get(table, ())}
+            # Параллельные списки: значения по возрастанию и ключи строк
+            self._sorted[table] = {column: ([], []) for column in SORTED_COLUMNS.get(table, ())}
+            self._ids[table] = itertools.count(1)
+        return self.tables[table]
+
+    def load(self, table: str, rows):
+        """Массовая загрузка (сид-данные), без проверки конфликтов"""
+        for row in rows:
+            self._store(table, {column: _stored_value(column, value) for column, value in row.items()})
+
+    def find(self, table: str, filters: list) -> list:
+        rows = self.rows(table)
+        keys = self._candidates(table, filters)
+        candidates = rows.values() if keys is None else (rows[k] for k in keys if k in rows)
+        return [row for row in candidates if all(f.matches(row) for f in filters)]
+
+    def insert(self, table: str, row: dict, resolution: str = None, on_conflict: str = None):
+        row = {column: _stored_value(column, value) for column, value in row.items()}
+        key = self.key(table)
+        columns = [c.strip() for c in on_conflict.split(",")] if on_conflict else [key]
+
+        existing = self._find_conflict(table, row, columns)
+        if existing is not None:
+            if resolution == "merge-duplicates":
+                self._update_row(table, existing, row)
+                return existing
+            if resolution == "ignore-duplicates":
+                return None
+            raise Conflict(f"duplicate key value violates unique constraint ({', '.join(columns)})")
+
+        row.setdefault("created_at", now_iso())
+        return self._store(table, row)
+
+    def update(self, table: str, filters: list, values: dict) -> list:
+        values = {column: _stored_value(column, value) for column, value in values.items()}
+        rows = self.find(table, filters)
+        for row in rows:
+            self._update_row(table, row, values)
+        return rows
+
+    def delete(self, table: str, filters: list) -> list:
+        rows = self.find(table, filters)
+        key = self.key(table)
+        for row in rows:
+            self._unindex(table, row)
+            del self.tables[table][row[key]]
+        return rows
+
+    def _store(self, table: str, row: dict) -> dict:
+        rows = self.rows(table)
+        key = self.key(table)
+        if key == "id":
+            if row.get("id") is None:
+                row["id"] = next(self._ids[table])
+                while row["id"] in rows:
+                    row["id"] = next(self._ids[table])
+        rows[row[key]] = row
+        self._index(table, row)
+        return row
+
+    def _update_row(self, table: str, row: dict, values: dict):
+        key = self.key(table)
+        self._unindex(table, row)
+        row.update({column: value for column, value in values.items() if column != key})
+        self._index(table, row)
+
+    def _find_conflict(self, table: str, row: dict, columns: list):
+        if any(row.get(column) is None for column in columns):
+            return None
+        key = self.key(table)
+        if columns == [key]:
+            return self.rows(table).get(row[key])
+        filters = [Condition(column, "eq", str(row[column])) for column in columns]
+        found = self.find(table, filters)
+        return found[0] if found else None
+
+    def _candidates(self, table: str, filters: list):
+        """Ключи строк по самому узкому из подходящих индексов (None — полный перебор)"""
+        best = None
+        for f in filters:
+            if not isinstance(f, Condition) or f.negate:
+                continue
+            if f.op == "eq":
+                keys = self._eq_candidates(table, f)
+            elif f.op in RANGE_OPERATORS:
+                keys = self._range_candidates(table, f)
+            else:
+                continue
+            if keys is not None and (best is None or len(keys) < len(best)):
+                best = keys
+        return best
+
+    def _eq_candidates(self, table: str, f: Condition):
+        if f.column == self.key(table):
+            rows = self.tables[table]
+            sample = next(iter(rows), None)
+            return [coerce(f.value, sample)] if sample is not None else []
+        index = self._indexes[table].get(f.column)
+        if index is None:
+            return None
+        sample = next(iter(index), None)
+        if sample is None:
+            return []
+        return list(index.get(coerce(f.value, sample), ()))
+
+    def _range_candidates(self, table: str, f: Condition):
+        index = self._sorted[table].get(f.column)
+        if index is None:
+            return None
+        values, keys = index
+        if not values:
+            return []
+        value = coerce(f.value, values[0])
+        try:
+            if f.op == "gt":
+                return keys[bisect_right(values, value):]
+            if f.op == "gte":
+                return keys[bisect_left(values, value):]
+            if f.op == "lt":
+                return keys[:bisect_left(values, value)]
+            return keys[:bisect_right(values, value)]
+        except TypeError:
+            return None
+
+    def _index(self, table: str, row: dict):
+        key = row[self.key(table)]
+        for column, index in self._indexes[table].items():
+            value = row.get(column)
+            if value is not None:
+                index.setdefault(value, {})[key] = None
+        for column, (values, keys) in self._sorted[table].items():
+            value = row.get(column)
+            if value is not None:
+                position = bisect_right(values, value)
+                values.insert(position, value)
+                keys.insert(position, key)
+
+    def _unindex(self, table: str, row: dict):
+        key = row[self.key(table)]
+        for column, index in self._indexes[table].items():
+            bucket = index.get(row.get(column))
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del index[row.get(column)]
+        for column, (values, keys) in self._sorted[table].items():
+            value = row.get(column)
+            if value is None:
+                continue
+            for position in range(bisect_left(values, value), bisect_right(values, value)):
+                if keys[position] == key:
+                    del values[position]
+                    del keys[position]
+                    break
+
+
+class FakePostgrest:
+    """Заглушка PostgREST поверх MemoryStore с задержкой и счетчиками запросов
+
+    Серверных функций нет: /rpc отвечает PGRST202, и бот работает через
+    локальные замены (как на базе без примененных sql/*.sql).
+    """
+
+    def __init__(self, store: MemoryStore = None, latency: Latency = None):
+        self.store = store or MemoryStore()
+        self.latency = latency or Latency()
+        self.calls = Counter()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/rest/v1/rpc/{name}", self.handle_rpc)
+        app.router.add_route("*", "/rest/v1/{table}", self.handle_table)
+        return app
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    async def handle_rpc(self, request: web.Request) -> web.Response:
+        name = request.match_info["name"]
+        self.calls[f"RPC {name}"] += 1
+        await self.latency.wait()
+        return _error(404, "PGRST202", f"Could not find the function public.{name} in the schema cache")
+
+    async def handle_table(self, request: web.Request) -> web.Response:
+        table = request.match_info["table"]
+        method = request.method
+        self.calls[f"{method} {table}"] += 1
+
+        body = await request.json() if request.can_read_body else None
+        await self.latency.wait()
+
+        prefer = _prefer(request.headers.get("Prefer", ""))
+        try:
+            filters = parse_params(request.query.items())
+            if method in ("GET", "HEAD"):
+                return self._select(request, table, filters, prefer)
+            if method == "POST":
+                rows = body if isinstance(body, list) else [body]
+                created = [
+                    self.store.insert(table, row, prefer.get("resolution"), request.query.get("on_conflict"))
+                    for row in rows
+                ]
+                return self._respond(request, [row for row in created if row is not None], prefer, status=201)
+            if method == "PATCH":
+                return self._respond(request, self.store.update(table, filters, body or {}), prefer)
+            if method == "DELETE":
+                return self._respond(request, self.store.delete(table, filters), prefer)
+        except Conflict as e:
+            return _error(409, "23505", str(e))
+        except (ValueError, KeyError) as e:
+            return _error(400, "PGRST100", str(e))
+        return _error(405, "PGRST105", f"Метод {method} не поддерживается")
+
+    def _select(self, request: web.Request, table: str, filters: list, prefer: dict) -> web.Response:
+        rows = self.store.find(table, filters)
+        total = len(rows)
+
+        order = request.query.get("order")
+        if order:
+            rows = _sort(rows, order)
+
+        offset, limit = _page(request)
+        rows = rows[offset:offset + limit] if limit is not None else rows[offset:]
+
+        data = _project(rows, request.query.get("select", "*"))
+        headers = {"Content-Range": _content_range(offset, len(data), total if "count" in prefer else None)}
+
+        if "vnd.pgrst.object" in request.headers.get("Accept", ""):
+            if len(data) != 1:
+                return _error(406, "PGRST116", f"JSON object requested, multiple (or no) rows returned ({len(data)})")
+            return _json(data[0], headers=headers)
+        return _json(data, headers=headers)
+
+    def _respond(self, request: web.Request, rows: list, prefer: dict, status: int = 200) -> web.Response:
+        if prefer.get("return") == "minimal":
+            return web.Response(status=204 if status == 200 else status)
+        data = _project(rows, request.query.get("select", "*"))
+        if "vnd.pgrst.object" in request.headers.get("Accept", "") and len(data) == 1:
+            return _json(data[0], status=status)
+        return _json(data, status=status)
+
+
+def _stored_value(column: str, value):
+    """now() и время в едином виде UTC, чтобы строки сравнивались как время"""
+    if value == "now()":
+        return now_iso()
+    return normalize_timestamp(value) if is_time_column(column) else value
+
+
+def _prefer(header: str) -> dict:
+    prefer = {}
+    for item in header.split(","):
+        name, _, value = item.strip().partition("=")
+        if name:
+            prefer[name] = value
+    return prefer
+
+
+def _page(request: web.Request):
+    offset = int(request.query.get("offset", 0))
+    limit = request.query.get("limit")
+    limit = int(limit) if limit is not None else None
+
+    range_header = request.headers.get("Range")
+    if range_header and "-" in range_header:
+        start, _, end = range_header.partition("-")
+        offset = int(start)
+        if end:
+            limit = int(end) - offset + 1
+    return offset, limit
+
+
+def _sort(rows: list, order: str) -> list:
+    rows = list(rows)
+    for item in reversed([part.strip() for part in order.split(",") if part.strip()]):
+        column, *modifiers = item.split(".")
+        desc = "desc" in modifiers
+        nulls_first = "nullsfirst" in modifiers or (desc and "nullslast" not in modifiers)
+        # При обратной сортировке флаг NULL инвертируется вместе со значениями
+        null_rank = (not nulls_first) != desc
+
+        def sort_key(row, column=column, null_rank=null_rank):
+            value = row.get(column)
+            return (null_rank, 0) if value is None else (not null_rank, value)
+
+        rows.sort(key=sort_key, reverse=desc)
+    return rows
+
+
+def _project(rows: list, select: str) -> list:
+    columns = [column.strip() for column in select.split(",") if column.strip()]
+    if not columns or "*" in columns:
+        return [dict(row) for row in rows]
+
+    fields = []
+    for column in columns:
+        if "(" in column:
+            continue  # вложенные ресурсы заглушка не поддерживает
+        alias, _, source = column.partition(":")
+        fields.append((alias, source or alias))
+    return [{alias: row.get(source) for alias, source in fields} for row in rows]
+
+
+def _content_range(offset: int, size: int, total) -> str:
+    total = "*" if total is None else total
+    if not size:
+        return f"*/{total}"
+    return f"{offset}-{offset + size - 1}/{total}"
+
+
+def _json(data, status: int = 200, headers: dict = None) -> web.Response:
+    return web.Response(
+        text=json.dumps(data, ensure_ascii=False, default=str),
+        status=status,
+        headers=headers,
+        content_type="application/json"
+    )
+
+
+def _error(status: int, code: str, message: str) -> web.Response:
+    return _json({"code": code, "message": message, "details": None, "hint": None}, status=status)
@@ -0,0 +1,142 @@
+import itertools
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import web
+
+from bench.servers import Latency
+
+
+class FakeTelegram:
+    """Заглушка Bot API: правдоподобные ответы, счетчики вызовов, задержка
+
+    Запоминает callback_data кнопок, отправленных в каждый чат, чтобы
+    сценарии могли «нажимать» кнопки из ответов бота (например, «Показать еще»).
+    """
+
+    def __init__(self, latency: Latency = None, admin_ids=(), bot_id: int = 123456, bot_username: str = "bench_rating_bot"):
+        self.latency = latency or Latency()
+        self.admin_ids = set(admin_ids)
+        self.me = {"id": bot_id, "is_bot": True, "first_name": "Rating Bench", "username": bot_username}
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+        self._buttons = defaultdict(lambda: deque(maxlen=50))
+        self._lock = threading.Lock()
+
+    def app(self) -> web.Application:
+        app = web.Application(client_max_size=50 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+    def last_callback_data(self, chat_id: int, prefix: str):
+        """Последняя callback_data с префиксом среди кнопок, отправленных в чат"""
+        with self._lock:
+            for data in reversed(self._buttons[chat_id]):
+                if data.startswith(prefix):
+                    return data
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        await self.latency.wait()
+
+        builder = getattr(self, f"_{method}", None)
+        result = builder(params) if builder else True
+        self._remember_buttons(params)
+        return web.json_response({"ok": True, "result": result})
+
+    def _remember_buttons(self, params: dict):
+        markup = params.get("reply_markup")
+        if not markup or "chat_id" not in params:
+            return
+        if isinstance(markup, str):
+            try:
+                markup = json.loads(markup)
+            except ValueError:
+                return
+        rows = markup.get("inline_keyboard") or []
+        chat_id = _int(params["chat_id"])
+        with self._lock:
+            for row in rows:
+                for button in row:
+                    if button.get("callback_data"):
+                        self._buttons[chat_id].append(button["callback_data"])
+
+    # --- ОБЪЕКТЫ ---
+    @staticmethod
+    def _chat(chat_id: int) -> dict:
+        if chat_id > 0:
+            return {"id": chat_id, "type": "private", "first_name": f"User{chat_id}", "username": f"user{chat_id}"}
+        return {"id": chat_id, "type": "supergroup", "title": "Bench admins", "is_forum": True}
+
+    def _message(self, params: dict, **fields) -> dict:
+        chat_id = _int(params.get("chat_id", 0))
+        message_id = _int(params.get("message_id") or next(self._message_ids))
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": self.me
+        }
+        message.update({key: value for key, value in fields.items() if value is not None})
+        return message
+
+    @staticmethod
+    def _photo(file_id) -> list:
+        file_id = file_id if isinstance(file_id, str) else "bench_photo"
+        return [{"file_id": file_id, "file_unique_id": file_id[-16:], "width": 320, "height": 320}]
+
+    # --- МЕТОДЫ BOT API ---
+    def _getMe(self, params):
+        return self.me
+
+    def _getChat(self, params):
+        return self._chat(_int(params["chat_id"]))
+
+    def _getChatMember(self, params):
+        user_id = _int(params["user_id"])
+        user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+        if user_id in self.admin_ids:
+            return {"status": "member", "user": user}
+        return {"status": "left", "user": user}
+
+    def _sendMessage(self, params):
+        return self._message(params, text=params.get("text"))
+
+    def _editMessageText(self, params):
+        return self._message(params, text=params.get("text"))
+
+    def _sendPhoto(self, params):
+        return self._message(params, caption=params.get("caption"), photo=self._photo(params.get("photo")))
+
+    def _editMessageCaption(self, params):
+        return self._message(params, caption=params.get("caption"), photo=self._photo(None))
+
+    def _editMessageReplyMarkup(self, params):
+        return self._message(params, text="")
+
+    def _sendDocument(self, params):
+        return self._message(
+            params,
+            caption=params.get("caption"),
+            document={"file_id": "bench_document", "file_unique_id": "bench_document"}
+        )
+
+
+def _int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
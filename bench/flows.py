@@ -0,0 +1,159 @@
+import itertools
+import time
+
+from aiogram.types import Update
+
+REVIEW_TEXT = "Отличный проект: быстро отвечают, все понятно и по делу"
+
+
+class UpdateFactory:
+    """Апдейты Telegram от имени симулируемых пользователей (уже привязанные к bot)"""
+
+    def __init__(self, bot, start_id: int = 1):
+        self.bot = bot
+        self._update_ids = itertools.count(start_id)
+        self._message_ids = itertools.count(1)
+
+    @staticmethod
+    def user(user_id: int) -> dict:
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"User{user_id}",
+            "username": f"user{user_id}",
+            "language_code": "ru"
+        }
+
+    @staticmethod
+    def chat(user_id: int) -> dict:
+        return {"id": user_id, "type": "private", "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    @staticmethod
+    def group(chat_id: int) -> dict:
+        return {"id": chat_id, "type": "supergroup", "title": "Bench admins", "is_forum": True}
+
+    def message(self, user_id: int, text: str, media: str = None, chat_id: int = None) -> Update:
+        """Текстовое сообщение или фото/документ с подписью text (chat_id — группа)"""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self.chat(user_id) if chat_id is None else self.group(chat_id),
+            "from": self.user(user_id)
+        }
+        if media == "photo":
+            message["photo"] = [{"file_id": "bench_photo", "file_unique_id": "bench_photo", "width": 320, "height": 320}]
+        elif media == "document":
+            message["document"] = {"file_id": "bench_document", "file_unique_id": "bench_document", "file_name": "bench.csv"}
+        if media and text:
+            message["caption"] = text
+        elif not media:
+            message["text"] = text
+        if text and text.startswith("/") and not media:
+            command = text.split()[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return self._update(message=message)
+
+    def callback(self, user_id: int, data: str, photo: bool = False) -> Update:
+        """Нажатие inline-кнопки под сообщением бота (с фото или текстовым)"""
+        message = {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": self.chat(user_id),
+            "from": {"id": self.bot.id, "is_bot": True, "first_name": "Rating Bench"}
+        }
+        if photo:
+            message["photo"] = [{"file_id": "bench_photo", "file_unique_id": "bench_photo", "width": 320, "height": 320}]
+            message["caption"] = "Карточка проекта"
+        else:
+            message["text"] = "Карточка проекта"
+
+        update_id = next(self._update_ids)
+        return Update.model_validate({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self.user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": message
+            }
+        }, context={"bot": self.bot})
+
+    def _update(self, **payload) -> Update:
+        return Update.model_validate({"update_id": next(self._update_ids), **payload}, context={"bot": self.bot})
+
+
+class FlowContext:
+    """Все, что нужно сценарию: диспетчер, фабрика апдейтов и сид-данные"""
+
+    def __init__(self, dp, bot, telegram, projects: list, categories: dict, photos: set):
+        self.dp = dp
+        self.bot = bot
+        self.telegram = telegram
+        self.factory = UpdateFactory(bot)
+        self.projects = projects
+        self.categories = {key: name for key, name in categories.items() if any(p["category"] == key for p in projects)}
+        self.photos = photos
+
+    async def send(self, update: Update):
+        await self.dp.feed_update(self.bot, update)
+
+    async def text(self, user_id: int, text: str):
+        await self.send(self.factory.message(user_id, text))
+
+    async def press(self, user_id: int, data: str, photo: bool = False):
+        await self.send(self.factory.callback(user_id, data, photo))
+
+    def project_for(self, user_id: int) -> dict:
+        return self.projects[user_id % len(self.projects)]
+
+    def category_for(self, user_id: int) -> str:
+        keys = list(self.categories)
+        return keys[user_id % len(keys)]
+
+
+# --- СЦЕНАРИИ ---
+async def category_browse(ctx: FlowContext, user_id: int):
+    """Открыть категорию из меню и нажать «Показать еще»"""
+    category = ctx.category_for(user_id)
+    await ctx.text(user_id, ctx.categories[category])
+    more = ctx.telegram.last_callback_data(user_id, f"more_{category}_")
+    if more:
+        await ctx.press(user_id, more)
+
+
+async def open_panel(ctx: FlowContext, user_id: int):
+    project = ctx.project_for(user_id)
+    await ctx.press(user_id, f"panel_{project['id']}", photo=project["id"] in ctx.photos)
+
+
+async def review_submit(ctx: FlowContext, user_id: int):
+    """Оценить → текст отзыва → звезды"""
+    project = ctx.project_for(user_id)
+    photo = project["id"] in ctx.photos
+    await ctx.press(user_id, f"rev_{project['id']}", photo=photo)
+    await ctx.text(user_id, REVIEW_TEXT)
+    await ctx.press(user_id, "st_5")
+
+
+async def like(ctx: FlowContext, user_id: int):
+    project = ctx.project_for(user_id)
+    await ctx.press(user_id, f"like_{project['id']}", photo=project["id"] in ctx.photos)
+
+
+async def weekly_top(ctx: FlowContext, user_id: int):
+    await ctx.text(user_id, "Топ недели")
+
+
+async def my_progress(ctx: FlowContext, user_id: int):
+    await ctx.text(user_id, "Мой прогресс")
+
+
+FLOWS = {
+    "category_browse": category_browse,
+    "open_panel": open_panel,
+    "review_submit": review_submit,
+    "like": like,
+    "weekly_top": weekly_top,
+    "my_progress": my_progress
+}
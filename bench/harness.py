@@ -0,0 +1,116 @@
+import asyncio
+import importlib
+import itertools
+import os
+from collections import Counter
+
+from bench.dataset import SEED_USER_BASE, generate_dataset
+from db_utils import iter_rows
+from bench.fake_postgrest import FakePostgrest, MemoryStore
+from bench.fake_telegram import FakeTelegram
+from bench.flows import FlowContext
+from bench.seed import seed_sqlite
+from bench.servers import Latency, ServerThread
+
+BENCH_TOKEN = "123456:BENCH-local-token"
+BENCH_ADMIN_CHAT_ID = -1001234567890
+# supabase-py проверяет, что ключ похож на JWT; подпись заглушка не проверяет
+BENCH_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoiYW5vbiJ9.bench"
+
+# Пользователи сценариев: каждый прогон — новый пользователь без истории
+FLOW_USER_BASE = SEED_USER_BASE + 1_000_000
+
+
+class BenchHarness:
+    """Заглушки Bot API и PostgREST, сид-данные и бот из main.py, направленный на них
+
+    main.py читает адреса из окружения при импорте, поэтому он импортируется
+    только после запуска заглушек. С sqlite_path вместо заглушки PostgREST
+    используется встроенная база SQLite (пустая база заполняется сид-данными).
+    """
+
+    def __init__(self, tg_latency: Latency = None, db_latency: Latency = None, dataset: dict = None,
+                 sqlite_path: str = None):
+        self.telegram = FakeTelegram(tg_latency)
+        self.sqlite_path = sqlite_path
+        self.postgrest = None if sqlite_path else FakePostgrest(MemoryStore(), db_latency)
+        self.dataset = dataset or {}
+        self.bot_module = None
+        self.ctx = None
+        self._servers = []
+        self._users = itertools.count(FLOW_USER_BASE)
+
+    async def start(self) -> FlowContext:
+        env = {
+            "BOT_TOKEN": BENCH_TOKEN,
+            "REFERRAL_SECRET": "bench-referral-secret",
+            "ADMIN_CHAT_ID": str(BENCH_ADMIN_CHAT_ID),
+            "TELEGRAM_API_URL": self._serve(self.telegram.app())
+        }
+        if self.sqlite_path:
+            env.update({"DB_BACKEND": "sqlite", "SQLITE_PATH": self.sqlite_path})
+        else:
+            env.update({
+                "DB_BACKEND": "supabase",
+                "SUPABASE_URL": self._serve(self.postgrest.app()),
+                "SUPABASE_KEY": BENCH_SUPABASE_KEY
+            })
+        os.environ.update(env)
+        self.bot_module = importlib.import_module("main")
+
+        db = self.bot_module.supabase
+        categories = list(self.bot_module.CATEGORIES)
+        if self.postgrest:
+            for table, rows in generate_dataset(categories, **self.dataset).items():
+                self.postgrest.store.load(table, rows)
+        elif not db.table("projects").select("id", count="exact", head=True).execute().count:
+            seed_sqlite(db, categories, **self.dataset)
+
+        self.bot_module.setup_dispatcher()
+        await self.bot_module.on_startup()
+
+        self.ctx = FlowContext(
+            self.bot_module.dp,
+            self.bot_module.bot,
+            self.telegram,
+            list(iter_rows(db, "projects", "id, category")),
+            self.bot_module.CATEGORIES,
+            {row["project_id"] for row in iter_rows(db, "project_photos", "project_id", key="project_id")}
+        )
+        return self.ctx
+
+    def next_user(self) -> int:
+        return next(self._users)
+
+    async def quiesce(self):
+        """Дождаться фоновых записей бота, чтобы они не попали в замер следующего сценария"""
+        await self.bot_module.user_directory.flush()
+        task = self.bot_module.log_worker_task
+        if task is not None and not task.done():
+            await self.bot_module.log_queue.join()
+
+    def db_calls(self) -> Counter:
+        return self.postgrest.calls if self.postgrest else self.bot_module.supabase.calls
+
+    def snapshot(self) -> tuple:
+        return Counter(self.telegram.calls), Counter(self.db_calls())
+
+    async def close(self):
+        if self.bot_module and self.bot_module.update_recorder:
+            await self.bot_module.update_recorder.flush()
+        if self.bot_module and self.bot_module.tracer.enabled:
+            await self.bot_module.tracer.exporter.flush()
+        current = asyncio.current_task()
+        tasks = [task for task in asyncio.all_tasks() if task is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self.bot_module:
+            await self.bot_module.bot.session.close()
+        for server in self._servers:
+            server.stop()
+
+    def _serve(self, app) -> str:
+        server = ServerThread(app)
+        self._servers.append(server)
+        return server.start()
@@ -0,0 +1,363 @@
+import argparse
+import asyncio
+import bisect
+import itertools
+import logging
+import random
+import time
+from collections import defaultdict
+
+from bench.flows import REVIEW_TEXT
+from bench.harness import BenchHarness
+from bench.metrics import LoopLagProbe, format_table, percentile
+from bench.servers import Latency
+from log_setup import setup_logging
+
+# Доли действий по умолчанию (примерно как в логах бота: в основном просмотр)
+DEFAULT_MIX = {
+    "category": 18,
+    "more": 8,
+    "panel": 25,
+    "viewrev": 8,
+    "history": 6,
+    "like": 10,
+    "review": 5,
+    "top_week": 6,
+    "top_month": 3,
+    "progress": 6,
+    "referral": 5
+}
+
+COLUMNS = [
+    ("step", "нагрузка"),
+    ("sent", "апдейтов"),
+    ("errors", "ошибок"),
+    ("dropped", "отброшено"),
+    ("throughput", "апдейтов/с"),
+    ("p50_ms", "p50, мс"),
+    ("p99_ms", "p99, мс"),
+    ("lag_p99_ms", "лаг loop p99, мс"),
+    ("lag_max_ms", "лаг loop max, мс")
+]
+
+
+class LoadGenerator:
+    """Поток апдейтов от множества пользователей в dp.feed_update с замером задержек"""
+
+    def __init__(self, harness: BenchHarness, users: int, mix: dict, seed: int = 1, max_inflight: int = 2000):
+        self.harness = harness
+        self.ctx = harness.ctx
+        self.users = [harness.next_user() for _ in range(users)]
+        self.rnd = random.Random(seed)
+        self.max_inflight = max_inflight
+        self.actions = [(name, ACTIONS[name]) for name in mix]
+        self._mix_weights = list(itertools.accumulate(mix[name] for name in mix))
+        # Популярность проектов по закону Ципфа: первые проекты открывают чаще
+        self._project_weights = list(itertools.accumulate(1 / rank for rank in range(1, len(self.ctx.projects) + 1)))
+        self._busy = set()
+        self.reset()
+
+    def reset(self):
+        self.latencies = defaultdict(list)
+        self.sent = 0
+        self.errors = 0
+        self.dropped = 0
+        self.inflight = 0
+
+    def pick_action(self):
+        point = self.rnd.random() * self._mix_weights[-1]
+        return self.actions[bisect.bisect(self._mix_weights, point)]
+
+    def pick_project(self) -> dict:
+        point = self.rnd.random() * self._project_weights[-1]
+        return self.ctx.projects[bisect.bisect(self._project_weights, point)]
+
+    def pick_user(self):
+        """Свободный пользователь (у одного пользователя апдейты идут по очереди)"""
+        for _ in range(10):
+            user_id = self.rnd.choice(self.users)
+            if user_id not in self._busy:
+                return user_id
+        return None
+
+    async def feed(self, kind: str, update):
+        self.sent += 1
+        started = time.perf_counter()
+        try:
+            await self.ctx.send(update)
+        except Exception as e:
+            self.errors += 1
+            logging.error("Апдейт %s упал: %s", kind, e)
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    async def text(self, kind: str, user_id: int, text: str):
+        await self.feed(kind, self.ctx.factory.message(user_id, text))
+
+    async def press(self, kind: str, user_id: int, data: str, photo: bool = False):
+        await self.feed(kind, self.ctx.factory.callback(user_id, data, photo))
+
+    async def session(self, user_id: int = None):
+        """Одно действие пользователя (может состоять из нескольких апдейтов)
+
+        Без user_id берется случайный свободный пользователь; если свободных нет
+        или достигнут предел одновременных действий, действие отбрасывается.
+        """
+        if user_id is None:
+            user_id = self.pick_user()
+            if user_id is None or self.inflight >= self.max_inflight:
+                self.dropped += 1
+                return
+        _, action = self.pick_action()
+        self._busy.add(user_id)
+        self.inflight += 1
+        try:
+            await action(self, user_id)
+        finally:
+            self.inflight -= 1
+            self._busy.discard(user_id)
+
+    def all_latencies(self) -> list:
+        return [value for values in self.latencies.values() for value in values]
+
+
+# --- ДЕЙСТВИЯ ---
+async def act_category(gen: LoadGenerator, user_id: int):
+    category = gen.rnd.choice(list(gen.ctx.categories))
+    await gen.text("category", user_id, gen.ctx.categories[category])
+
+
+async def act_more(gen: LoadGenerator, user_id: int):
+    more = gen.ctx.telegram.last_callback_data(user_id, "more_")
+    if more:
+        await gen.press("more", user_id, more)
+    else:
+        await act_category(gen, user_id)
+
+
+async def act_panel(gen: LoadGenerator, user_id: int):
+    project = gen.pick_project()
+    await gen.press("panel", user_id, f"panel_{project['id']}", project["id"] in gen.ctx.photos)
+
+
+async def act_viewrev(gen: LoadGenerator, user_id: int):
+    project = gen.pick_project()
+    await gen.press("viewrev", user_id, f"viewrev_{project['id']}", project["id"] in gen.ctx.photos)
+
+
+async def act_history(gen: LoadGenerator, user_id: int):
+    project = gen.pick_project()
+    await gen.press("history", user_id, f"history_{project['id']}", project["id"] in gen.ctx.photos)
+
+
+async def act_like(gen: LoadGenerator, user_id: int):
+    project = gen.pick_project()
+    await gen.press("like", user_id, f"like_{project['id']}", project["id"] in gen.ctx.photos)
+
+
+async def act_review(gen: LoadGenerator, user_id: int):
+    project = gen.pick_project()
+    await gen.press("rev", user_id, f"rev_{project['id']}", project["id"] in gen.ctx.photos)
+    await gen.text("review_text", user_id, REVIEW_TEXT)
+    await gen.press("st", user_id, f"st_{gen.rnd.randint(1, 5)}")
+
+
+async def act_top_week(gen: LoadGenerator, user_id: int):
+    await gen.text("top_week", user_id, "Топ недели")
+
+
+async def act_top_month(gen: LoadGenerator, user_id: int):
+    await gen.text("top_month", user_id, "Топ месяца")
+
+
+async def act_progress(gen: LoadGenerator, user_id: int):
+    await gen.text("progress", user_id, "Мой прогресс")
+
+
+async def act_referral(gen: LoadGenerator, user_id: int):
+    await gen.text("referral", user_id, "Реферальная система")
+
+
+ACTIONS = {
+    "category": act_category,
+    "more": act_more,
+    "panel": act_panel,
+    "viewrev": act_viewrev,
+    "history": act_history,
+    "like": act_like,
+    "review": act_review,
+    "top_week": act_top_week,
+    "top_month": act_top_month,
+    "progress": act_progress,
+    "referral": act_referral
+}
+
+
+# --- РЕЖИМЫ НАГРУЗКИ ---
+async def run_closed(gen: LoadGenerator, concurrency: int, duration: float, think: float):
+    """Замкнутая нагрузка: concurrency пользователей действуют друг за другом без пауз (или с think)"""
+    deadline = time.perf_counter() + duration
+
+    async def virtual_user(user_id):
+        while time.perf_counter() < deadline:
+            await gen.session(user_id)
+            if think:
+                await asyncio.sleep(gen.rnd.expovariate(1 / think))
+
+    users = gen.rnd.sample(gen.users, min(concurrency, len(gen.users)))
+    await asyncio.gather(*(virtual_user(user_id) for user_id in users))
+
+
+async def run_open(gen: LoadGenerator, rate: float, duration: float):
+    """Открытая нагрузка: действия приходят пуассоновским потоком с частотой rate/с"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + duration
+    tasks = set()
+    next_at = loop.time()
+
+    while next_at < deadline:
+        delay = next_at - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(gen.session())
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        next_at += gen.rnd.expovariate(rate)
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def run_step(gen: LoadGenerator, label: str, runner) -> dict:
+    await gen.harness.quiesce()
+    gen.reset()
+    probe = LoopLagProbe()
+    probe.start()
+
+    started = time.perf_counter()
+    await runner
+    elapsed = time.perf_counter() - started
+    lag = await probe.stop()
+
+    latencies = gen.all_latencies()
+    return {
+        "step": label,
+        "sent": gen.sent,
+        "errors": gen.errors,
+        "dropped": gen.dropped,
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "lag_p99_ms": round(percentile(lag, 99) * 1000, 1),
+        "lag_max_ms": round(max(lag, default=0) * 1000, 1),
+        "kinds": {
+            kind: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 1),
+                "p99_ms": round(percentile(values, 99) * 1000, 1)
+            }
+            for kind, values in sorted(gen.latencies.items())
+        }
+    }
+
+
+def parse_mix(raw: str) -> dict:
+    if not raw:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for item in raw.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if name not in ACTIONS:
+            raise SystemExit(f"Неизвестное действие: {name}. Доступны: {', '.join(ACTIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.load",
+        description="Нагрузочный тест: апдейты тысяч пользователей в dp.feed_update "
+                    "с реальным роутером и AccessMiddleware"
+    )
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--concurrency", default="10,50,100,200",
+                      help="шаги замкнутой нагрузки: одновременных пользователей через запятую")
+    mode.add_argument("--rates", help="шаги открытой нагрузки: действий в секунду через запятую")
+    parser.add_argument("--duration", type=float, default=10, help="длительность шага, с")
+    parser.add_argument("--think-ms", type=float, default=0, help="пауза пользователя между действиями (замкнутая)")
+    parser.add_argument("--users", type=int, default=5000, help="симулируемых пользователей")
+    parser.add_argument("--mix", help="доли действий: panel=25,like=10,... (по умолчанию типичный микс)")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="порог p99; после превышения шаги прекращаются")
+    parser.add_argument("--no-stop", action="store_true", help="выполнить все шаги, даже после превышения порога")
+    parser.add_argument("--max-inflight", type=int, default=2000, help="предел одновременных действий (открытая)")
+    parser.add_argument("--tg-latency", type=float, default=30, help="задержка Bot API, мс")
+    parser.add_argument("--db-latency", type=float, default=10, help="задержка PostgREST, мс")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--sqlite", metavar="PATH", help="встроенная база SQLite вместо заглушки PostgREST")
+    parser.add_argument("--projects", type=int, default=60)
+    parser.add_argument("--history", type=int, default=20000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--breakdown", action="store_true", help="задержки по типам апдейтов")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+async def run(args) -> list:
+    harness = BenchHarness(
+        tg_latency=Latency(args.tg_latency, args.jitter),
+        db_latency=Latency(args.db_latency, args.jitter),
+        dataset={"projects": args.projects, "users": max(args.users // 2, 1), "history": args.history, "seed": args.seed},
+        sqlite_path=args.sqlite
+    )
+    results = []
+    try:
+        await harness.start()
+        gen = LoadGenerator(harness, args.users, parse_mix(args.mix), args.seed, args.max_inflight)
+
+        if args.rates:
+            steps = [(f"{rate}/с", run_open(gen, float(rate), args.duration)) for rate in args.rates.split(",")]
+        else:
+            steps = [
+                (f"{count} польз.", run_closed(gen, int(count), args.duration, args.think_ms / 1000))
+                for count in args.concurrency.split(",")
+            ]
+
+        for label, runner in steps:
+            result = await run_step(gen, label, runner)
+            results.append(result)
+            print(f"{label}: {result['throughput']} апдейтов/с, p99 {result['p99_ms']} мс, "
+                  f"лаг loop p99 {result['lag_p99_ms']} мс", flush=True)
+            if result["p99_ms"] > args.slo_ms and not args.no_stop:
+                for _, pending in steps[len(results):]:
+                    pending.close()
+                break
+    finally:
+        await harness.close()
+    return results
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging("bench", level=args.log_level, json_console=False)
+
+    results = asyncio.run(run(args))
+    print()
+    print(format_table(results, COLUMNS))
+
+    within_slo = [result for result in results if result["p99_ms"] <= args.slo_ms]
+    if within_slo:
+        best = max(within_slo, key=lambda result: result["throughput"])
+        print(f"\nНасыщение: {best['throughput']} апдейтов/с при p99 {best['p99_ms']} мс "
+              f"(шаг {best['step']}, порог p99 {args.slo_ms:g} мс)")
+    else:
+        print(f"\nНи один шаг не уложился в порог p99 {args.slo_ms:g} мс")
+
+    if args.breakdown:
+        for result in results:
+            print(f"\n{result['step']}:")
+            rows = [{"kind": kind, **stats} for kind, stats in result["kinds"].items()]
+            print(format_table(rows, [("kind", "апдейт"), ("count", "кол-во"), ("p50_ms", "p50, мс"), ("p99_ms", "p99, мс")]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import asyncio
+
+# Перцентиль и замер задержки loop — те же, что у сторожа бота
+from loop_watchdog import measure_lag, percentile
+
+
+def summarize(latencies: list, elapsed: float) -> dict:
+    """Пропускная способность и задержки по списку длительностей (секунды)"""
+    count = len(latencies)
+    return {
+        "count": count,
+        "throughput": round(count / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0
+    }
+
+
+def format_table(rows: list, columns: list) -> str:
+    """Простая текстовая таблица: columns — список (ключ, заголовок)"""
+    header = [title for _, title in columns]
+    body = [[str(row.get(key, "")) for key, _ in columns] for row in rows]
+    widths = [max(len(cell) for cell in column) for column in zip(header, *body)]
+
+    def line(cells):
+        return "  ".join(cell.rjust(width) if i else cell.ljust(width) for i, (cell, width) in enumerate(zip(cells, widths)))
+
+    return "\n".join([line(header), line(["-" * width for width in widths])] + [line(cells) for cells in body])
+
+
+class LoopLagProbe:
+    """Задержка event loop: насколько позже заказанного просыпается sleep(interval)"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> list:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        return self.samples
+
+    async def _run(self):
+        await measure_lag(self.interval, lambda lag, now: self.samples.append(lag))
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import defaultdict
+
+from bench.harness import BENCH_ADMIN_CHAT_ID, BenchHarness
+from bench.metrics import LoopLagProbe, format_table, percentile
+from bench.servers import Latency
+from log_setup import setup_logging
+from update_recorder import read_records
+
+# callback_data вида <префикс>_<id проекта>: id из записи переводятся в проекты стенда
+PROJECT_PREFIXES = {"panel", "rev", "like", "viewrev", "history", "myreview", "back"}
+
+COLUMNS = [
+    ("route", "апдейт"),
+    ("count", "кол-во"),
+    ("errors", "ошибок"),
+    ("rec_p50_ms", "запись p50, мс"),
+    ("rec_p99_ms", "запись p99, мс"),
+    ("p50_ms", "стенд p50, мс"),
+    ("p99_ms", "стенд p99, мс")
+]
+
+
+def route_of(record: dict) -> str:
+    """Ключ для сводки: префикс callback_data, команда, кнопка меню или тип сообщения"""
+    if "d" in record:
+        return (record["d"] or "").split("_")[0] + "_"
+    text = record.get("x") or ""
+    if record.get("m"):
+        return record["m"]
+    if text.startswith("/"):
+        return text.split()[0]
+    if text and text.strip("x "):
+        return text
+    return "текст"
+
+
+class Replayer:
+    """Подает записанные апдейты в dp.feed_update с исходными интервалами (или быстрее)
+
+    Апдейты одного пользователя идут строго по очереди — иначе при ускорении
+    сломались бы сценарии с FSM (отзыв: rev_ → текст → st_).
+    """
+
+    def __init__(self, harness: BenchHarness, records: list, speed: float, seed: int = 1):
+        self.harness = harness
+        self.ctx = harness.ctx
+        self.records = records
+        self.speed = speed
+        self.latencies = defaultdict(list)
+        self.recorded = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.skipped = 0
+        projects = [project["id"] for project in self.ctx.projects]
+        random.Random(seed).shuffle(projects)
+        self._projects = projects
+        self._project_map = {}
+
+    def project_id(self, recorded_id: str) -> int:
+        if recorded_id not in self._project_map:
+            self._project_map[recorded_id] = self._projects[len(self._project_map) % len(self._projects)]
+        return self._project_map[recorded_id]
+
+    def build(self, record: dict):
+        factory = self.ctx.factory
+        user_id = record.get("u")
+        if user_id is None:
+            return None
+        if record["k"] == "callback_query":
+            data = record.get("d") or ""
+            prefix, _, rest = data.partition("_")
+            if prefix in PROJECT_PREFIXES and rest.isdigit():
+                data = f"{prefix}_{self.project_id(rest)}"
+            return factory.callback(user_id, data, photo=bool(record.get("p")))
+        if record["k"] == "message":
+            media = record.get("m")
+            if media not in (None, "photo", "document"):
+                return None
+            chat_id = BENCH_ADMIN_CHAT_ID if record.get("ch", 0) < 0 else None
+            return factory.message(user_id, record.get("x") or "", media, chat_id)
+        return None
+
+    async def feed(self, record: dict, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)
+        update = self.build(record)
+        if update is None:
+            self.skipped += 1
+            return
+        route = route_of(record)
+        started = time.perf_counter()
+        try:
+            await self.ctx.send(update)
+        except Exception as e:
+            self.errors[route] += 1
+            logging.error("Апдейт %s упал: %s", route, e)
+        self.latencies[route].append(time.perf_counter() - started)
+        if "ms" in record:
+            self.recorded[route].append(record["ms"] / 1000)
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # Участники админ-группы в записи — админы и на стенде
+        self.harness.telegram.admin_ids.update(
+            record["u"] for record in self.records if record.get("ch", 0) < 0 and "u" in record
+        )
+        last = {}
+        tasks = []
+        origin = self.records[0]["t"] if self.records else 0
+        started = loop.time()
+        for record in self.records:
+            if self.speed > 0:
+                delay = started + (record["t"] - origin) / self.speed - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            task = asyncio.create_task(self.feed(record, last.get(record.get("u"))))
+            last[record.get("u")] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+
+
+def summarize_routes(replayer: Replayer) -> list:
+    def row(route, values, recorded, errors):
+        return {
+            "route": route,
+            "count": len(values),
+            "errors": errors,
+            "rec_p50_ms": round(percentile(recorded, 50) * 1000, 1) if recorded else "",
+            "rec_p99_ms": round(percentile(recorded, 99) * 1000, 1) if recorded else "",
+            "p50_ms": round(percentile(values, 50) * 1000, 1),
+            "p99_ms": round(percentile(values, 99) * 1000, 1)
+        }
+
+    routes = sorted(replayer.latencies, key=lambda route: -len(replayer.latencies[route]))
+    rows = [row(route, replayer.latencies[route], replayer.recorded[route], replayer.errors[route]) for route in routes]
+    rows.append(row(
+        "всего",
+        [value for values in replayer.latencies.values() for value in values],
+        [value for values in replayer.recorded.values() for value in values],
+        sum(replayer.errors.values())
+    ))
+    return rows
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.replay",
+        description="Воспроизведение записанных апдейтов (RECORD_UPDATES_DIR) на заглушках"
+    )
+    parser.add_argument("paths", nargs="+", help="файлы или каталоги записи")
+    parser.add_argument("--speed", type=float, default=1, help="ускорение (1 — как в записи, 0 — без пауз)")
+    parser.add_argument("--limit", type=int, help="воспроизвести только первые N апдейтов")
+    parser.add_argument("--tg-latency", type=float, default=30, help="задержка Bot API, мс")
+    parser.add_argument("--db-latency", type=float, default=10, help="задержка PostgREST, мс")
+    parser.add_argument("--jitter", type=float, default=0.2, help="разброс задержек (доля)")
+    parser.add_argument("--sqlite", metavar="PATH", help="встроенная база SQLite вместо заглушки PostgREST")
+    parser.add_argument("--projects", type=int, default=60)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--history", type=int, default=20000, help="строк rating_history")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+async def run(args, records: list) -> dict:
+    harness = BenchHarness(
+        tg_latency=Latency(args.tg_latency, args.jitter),
+        db_latency=Latency(args.db_latency, args.jitter),
+        dataset={"projects": args.projects, "users": args.users, "history": args.history, "seed": args.seed},
+        sqlite_path=args.sqlite
+    )
+    try:
+        await harness.start()
+        replayer = Replayer(harness, records, args.speed, args.seed)
+        tg_before, db_before = harness.snapshot()
+        probe = LoopLagProbe()
+        probe.start()
+        started = time.perf_counter()
+        await replayer.run()
+        elapsed = time.perf_counter() - started
+        lag = await probe.stop()
+        await harness.quiesce()
+        tg_after, db_after = harness.snapshot()
+    finally:
+        await harness.close()
+
+    fed = sum(len(values) for values in replayer.latencies.values())
+    return {
+        "routes": summarize_routes(replayer),
+        "fed": fed,
+        "skipped": replayer.skipped,
+        "elapsed": round(elapsed, 2),
+        "throughput": round(fed / elapsed, 1) if elapsed else 0.0,
+        "lag_p99_ms": round(percentile(lag, 99) * 1000, 1),
+        "lag_max_ms": round(max(lag, default=0) * 1000, 1),
+        "tg_calls": round(sum((tg_after - tg_before).values()) / max(fed, 1), 2),
+        "db_calls": round(sum((db_after - db_before).values()) / max(fed, 1), 2)
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging("bench", level=args.log_level, json_console=False)
+
+    records = read_records(args.paths)
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit("В записи нет апдейтов")
+    span = records[-1]["t"] - records[0]["t"]
+
+    result = asyncio.run(run(args, records))
+    print(f"Записано {len(records)} апдейтов за {span:.1f} с, ускорение {args.speed:g}, "
+          f"воспроизведено {result['fed']} за {result['elapsed']} с ({result['throughput']} апдейтов/с), "
+          f"пропущено {result['skipped']}\n")
+    print(format_table(result["routes"], COLUMNS))
+    print(f"\nBot API/апдейт {result['tg_calls']}, БД/апдейт {result['db_calls']}, "
+          f"лаг loop p99 {result['lag_p99_ms']} мс, max {result['lag_max_ms']} мс")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "result": result}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+
+from bench.flows import FLOWS
+from bench.harness import BenchHarness
+from bench.metrics import format_table, summarize
+from bench.servers import Latency
+from log_setup import setup_logging
+
+COLUMNS = [
+    ("flow", "сценарий"),
+    ("count", "прогонов"),
+    ("errors", "ошибок"),
+    ("throughput", "прогонов/с"),
+    ("p50_ms", "p50, мс"),
+    ("p99_ms", "p99, мс"),
+    ("tg_calls", "Bot API/прогон"),
+    ("db_calls", "БД/прогон")
+]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.run",
+        description="Сценарии бота через Dispatcher на заглушках Bot API и PostgREST"
+    )
+    parser.add_argument("--flows", default=",".join(FLOWS), help="сценарии через запятую")
+    parser.add_argument("--iterations", type=int, default=50, help="замеряемых прогонов на сценарий")
+    parser.add_argument("--warmup", type=int, default=3, help="прогонов без замера")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременных пользователей")
+    parser.add_argument("--tg-latency", type=float, default=30, help="задержка Bot API, мс")
+    parser.add_argument("--db-latency", type=float, default=10, help="задержка PostgREST, мс")
+    parser.add_argument("--jitter", type=float, default=0.2, help="разброс задержек (доля)")
+    parser.add_argument("--sqlite", metavar="PATH", help="встроенная база SQLite вместо заглушки PostgREST "
+                        "(пустая база заполняется; --db-latency не действует)")
+    parser.add_argument("--projects", type=int, default=60)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--history", type=int, default=20000, help="строк rating_history")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--breakdown", action="store_true", help="показать вызовы по методам")
+    parser.add_argument("--audit", action="store_true", help="аудит запросов по обработчикам (повторы, N+1)")
+    parser.add_argument("--json", help="сохранить результаты в JSON-файл")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+async def run_flow(harness: BenchHarness, name: str, iterations: int, concurrency: int, warmup: int) -> dict:
+    flow = FLOWS[name]
+    ctx = harness.ctx
+
+    for _ in range(warmup):
+        await flow(ctx, harness.next_user())
+    await harness.quiesce()
+
+    auditor = harness.bot_module.query_auditor
+    if auditor:
+        auditor.reset()
+    tg_before, db_before = harness.snapshot()
+    latencies = []
+    errors = 0
+    remaining = iterations
+
+    async def worker():
+        nonlocal errors, remaining
+        while remaining > 0:
+            remaining -= 1
+            user_id = harness.next_user()
+            started = time.perf_counter()
+            try:
+                await flow(ctx, user_id)
+            except Exception as e:
+                errors += 1
+                logging.error("Сценарий %s упал: %s", name, e)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(max(concurrency, 1))))
+    elapsed = time.perf_counter() - started
+    await harness.quiesce()
+
+    tg_after, db_after = harness.snapshot()
+    tg_calls = tg_after - tg_before
+    db_calls = db_after - db_before
+
+    result = {"flow": name, "errors": errors, **summarize(latencies, elapsed)}
+    result["tg_calls"] = round(sum(tg_calls.values()) / iterations, 1)
+    result["db_calls"] = round(sum(db_calls.values()) / iterations, 1)
+    result["tg_methods"] = {key: round(value / iterations, 2) for key, value in tg_calls.most_common()}
+    result["db_methods"] = {key: round(value / iterations, 2) for key, value in db_calls.most_common()}
+    if auditor:
+        result["audit"] = auditor.snapshot()
+    return result
+
+
+async def run(args) -> list:
+    flows = [name.strip() for name in args.flows.split(",") if name.strip()]
+    unknown = [name for name in flows if name not in FLOWS]
+    if unknown:
+        raise SystemExit(f"Неизвестные сценарии: {', '.join(unknown)}. Доступны: {', '.join(FLOWS)}")
+
+    if args.audit:
+        os.environ["QUERY_AUDIT_SAMPLE"] = "1"
+    harness = BenchHarness(
+        tg_latency=Latency(args.tg_latency, args.jitter),
+        db_latency=Latency(args.db_latency, args.jitter),
+        dataset={"projects": args.projects, "users": args.users, "history": args.history, "seed": args.seed},
+        sqlite_path=args.sqlite
+    )
+    try:
+        await harness.start()
+        return [
+            await run_flow(harness, name, args.iterations, args.concurrency, args.warmup)
+            for name in flows
+        ]
+    finally:
+        await harness.close()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging("bench", level=args.log_level, json_console=False)
+
+    results = asyncio.run(run(args))
+
+    database = f"SQLite {args.sqlite}" if args.sqlite else f"PostgREST {args.db_latency} мс"
+    print(f"Bot API {args.tg_latency} мс, {database}, "
+          f"параллельно {args.concurrency}, прогонов {args.iterations}\n")
+    print(format_table(results, COLUMNS))
+
+    if args.breakdown:
+        for result in results:
+            print(f"\n{result['flow']}:")
+            for key, value in {**result["tg_methods"], **result["db_methods"]}.items():
+                print(f"  {key}: {value}")
+
+    if args.audit:
+        for result in results:
+            print(f"\n{result['flow']} — запросы по обработчикам:")
+            for row in result["audit"]:
+                print(f"  {row['handler']}: {row['round_trips']} на апдейт (max {row['max_round_trips']}), "
+                      f"повторов {row['duplicates']}, {row['db_ms']} мс")
+                for finding in row["findings"]:
+                    print(f"    {finding['kind']}: {finding['query']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import importlib
+import os
+import random
+import time
+
+from bench.dataset import iter_activity, iter_project_photos, iter_projects, iter_user_stats
+
+
+def seed_sqlite(client, categories: list, projects: int = 300, users: int = 200000, history: int = 1000000,
+                days: int = 90, seed: int = 1, batch_size: int = 20000) -> dict:
+    """Залить синтетические данные во встроенную базу SQLite потоком, пачками"""
+    rnd = random.Random(seed)
+    counts = {
+        "projects": client.bulk_insert("projects", iter_projects(categories, projects, rnd), batch_size),
+        "project_photos": client.bulk_insert("project_photos", iter_project_photos(projects, rnd), batch_size),
+        "user_stats": client.bulk_insert("user_stats", iter_user_stats(users, rnd), batch_size),
+        "user_logs": 0,
+        "rating_history": 0
+    }
+
+    buffers = {"user_logs": [], "rating_history": []}
+    scores = []
+    for table, row in iter_activity(projects, users, history, days, rnd):
+        if table == "project_scores":
+            scores.append(row)
+            continue
+        buffers[table].append(row)
+        if len(buffers[table]) >= batch_size:
+            counts[table] += client.bulk_insert(table, buffers[table], batch_size)
+            buffers[table] = []
+    for table, rows in buffers.items():
+        if rows:
+            counts[table] += client.bulk_insert(table, rows, batch_size)
+
+    for row in scores:
+        client.table("projects").update({"score": row["score"]}).eq("id", row["id"]).execute()
+    client.query("analyze")
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m bench.seed",
+        description="Создать базу SQLite (DB_BACKEND=sqlite) с синтетическими данными"
+    )
+    parser.add_argument("--path", default="rating_bench.sqlite3")
+    parser.add_argument("--projects", type=int, default=300)
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--history", type=int, default=1000000, help="строк rating_history")
+    parser.add_argument("--days", type=int, default=90, help="глубина истории в днях")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--fresh", action="store_true", help="удалить существующую базу")
+    args = parser.parse_args(argv)
+
+    if args.fresh:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(args.path + suffix):
+                os.remove(args.path + suffix)
+
+    # Категории и клиент базы берутся из main.py (импорт без запуска бота)
+    os.environ["DB_BACKEND"] = "sqlite"
+    os.environ["SQLITE_PATH"] = args.path
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCH-local-token")
+    bot_module = importlib.import_module("main")
+    client = bot_module.supabase
+
+    if client.table("projects").select("id", count="exact", head=True).execute().count:
+        raise SystemExit(f"В {args.path} уже есть данные; используйте --fresh")
+
+    started = time.perf_counter()
+    counts = seed_sqlite(
+        client, list(bot_module.CATEGORIES), args.projects, args.users, args.history, args.days, args.seed
+    )
+    elapsed = time.perf_counter() - started
+
+    for table, count in counts.items():
+        print(f"{table}: {count}")
+    print(f"Готово за {elapsed:.1f} с: {args.path}")
+
+
+if __name__ == "__main__":
+    main()
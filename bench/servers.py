@@ -0,0 +1,81 @@
+import asyncio
+import random
+import threading
+
+from aiohttp import web
+
+
+class Latency:
+    """Искусственная задержка ответа заглушки (мс, с разбросом в долях)"""
+
+    def __init__(self, ms: float = 0, jitter: float = 0):
+        self.ms = ms
+        self.jitter = jitter
+
+    def sample(self) -> float:
+        if self.ms <= 0:
+            return 0
+        spread = self.ms * self.jitter
+        return max(self.ms + random.uniform(-spread, spread), 0) / 1000
+
+    async def wait(self):
+        delay = self.sample()
+        if delay:
+            await asyncio.sleep(delay)
+
+
+class ServerThread:
+    """aiohttp-приложение в отдельном потоке со своим event loop
+
+    Клиент Supabase синхронный и блокирует event loop бота на время запроса,
+    поэтому заглушки не могут работать в том же loop.
+    """
+
+    def __init__(self, app: web.Application, host: str = "127.0.0.1", port: int = 0):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.loop = None
+        self._runner = None
+        self._thread = None
+        self._ready = threading.Event()
+        self._error = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._run, name="bench-server", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+        return self.url
+
+    def stop(self):
+        if self.loop and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self.loop).result(timeout=10)
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        if self._thread:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        self.loop.run_forever()
+        self.loop.close()
+
+    async def _serve(self):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = self._runner.addresses[0][1]
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+import time
+
+from db_utils import iter_rows
+
+
+class CategoryCounters:
+    """Счетчики проектов по категориям: количество и агрегаты рейтинга"""
+
+    def __init__(self, ttl: float = None, page_size: int = 1000):
+        # ttl — как часто run_refresher перечитывает таблицу в фоне;
+        # None — счетчики загружаются один раз и дальше поддерживаются вручную
+        self.ttl = ttl
+        self.page_size = page_size
+        self.loaded_at = None
+        self._counters = {}
+
+    def load(self, client):
+        """Загрузить счетчики одним проходом по таблице projects"""
+        counters = {}
+        for row in iter_rows(client, "projects", "id, category, score", page_size=self.page_size):
+            item = counters.setdefault(row['category'], {"count": 0, "score_sum": 0})
+            item["count"] += 1
+            item["score_sum"] += row['score'] or 0
+
+        self._counters = counters
+        self.loaded_at = time.monotonic()
+
+    def try_load(self, client) -> bool:
+        """Загрузить счетчики; при ошибке остается прежний снимок"""
+        try:
+            self.load(client)
+            return True
+        except Exception as e:
+            logging.error("Ошибка загрузки счетчиков категорий: %s", e)
+            return False
+
+    def ensure_loaded(self) -> bool:
+        """Есть ли снимок счетчиков; запросы читают последний снимок и в базу не ходят"""
+        return self.loaded_at is not None
+
+    async def run_refresher(self, client):
+        """Перечитывать счетчики раз в ttl секунд в потоке, не блокируя loop
+
+        Рейтинг меняют и другие процессы (бот и API), их изменения попадают
+        в счетчики при следующем перечитывании.
+        """
+        if not self.ttl:
+            return
+        while True:
+            await asyncio.sleep(self.ttl)
+            await asyncio.to_thread(self.try_load, client)
+
+    def get(self, category: str) -> dict:
+        item = self._counters.get(category, {"count": 0, "score_sum": 0})
+        return self._format(category, item)
+
+    def all(self) -> list:
+        return [self._format(category, item) for category, item in self._counters.items()]
+
+    def count(self, category: str) -> int:
+        return self._counters.get(category, {}).get("count", 0)
+
+    def add_project(self, category: str, score: int = 0):
+        item = self._counters.setdefault(category, {"count": 0, "score_sum": 0})
+        item["count"] += 1
+        item["score_sum"] += score or 0
+
+    def remove_project(self, category: str, score: int = 0):
+        item = self._counters.get(category)
+        if not item:
+            return
+        item["count"] = max(item["count"] - 1, 0)
+        item["score_sum"] -= score or 0
+        if item["count"] == 0:
+            del self._counters[category]
+
+    def apply_score_change(self, category: str, delta: int):
+        item = self._counters.get(category)
+        if item:
+            item["score_sum"] += delta or 0
+
+    def __len__(self):
+        return len(self._counters)
+
+    @staticmethod
+    def _format(category: str, item: dict) -> dict:
+        count = item["count"]
+        return {
+            "category": category,
+            "count": count,
+            "score_sum": item["score_sum"],
+            "avg_score": round(item["score_sum"] / count, 2) if count else 0
+        }
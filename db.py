@@ -0,0 +1,20 @@
+import os
+
+from supabase import create_client
+
+from sqlite_backend import SQLiteClient
+
+
+def create_db_client():
+    """Клиент базы по настройкам: Supabase (по умолчанию) или встроенный SQLite
+
+    DB_BACKEND=sqlite и SQLITE_PATH — локальная база для разработки и нагрузочных
+    тестов (см. sql/sqlite_schema.sql); серверные функции в ней заменяются
+    локальными реализациями, как на базе без примененных sql/*.sql.
+    """
+    backend = os.getenv("DB_BACKEND", "supabase").lower()
+    if backend == "sqlite":
+        return SQLiteClient(os.getenv("SQLITE_PATH", "rating_bot.sqlite3"))
+    if backend != "supabase":
+        raise ValueError(f"Неизвестный DB_BACKEND: {backend}")
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
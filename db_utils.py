@@ -0,0 +1,68 @@
+import logging
+
+# Серверные функции, которых нет в базе (чтобы не повторять заведомо неудачный запрос)
+_missing_rpcs = set()
+
+
+def _is_missing_function(error: Exception) -> bool:
+    code = str(getattr(error, "code", "") or "")
+    return code in ("PGRST202", "42883", "404") or "Could not find the function" in str(error)
+
+
+def call_rpc(client, name: str, params: dict, fallback, fallback_on_error: bool = False):
+    """Вызвать серверную функцию, а если ее нет в базе — локальную замену
+
+    Изменяющие функции выполняются в транзакции, поэтому при прочих ошибках
+    локальная замена не вызывается (иначе изменения могут примениться дважды),
+    если явно не указано fallback_on_error=True.
+    """
+    if name not in _missing_rpcs:
+        try:
+            return client.rpc(name, params).execute().data
+        except Exception as e:
+            if _is_missing_function(e):
+                _missing_rpcs.add(name)
+                logging.warning("Функция %s не найдена в базе, используется локальная замена", name)
+            elif fallback_on_error:
+                logging.error("Ошибка вызова %s: %s", name, e)
+            else:
+                raise
+    return fallback()
+
+
+def or_filter(query, filters: str):
+    """Условие or=(...): в postgrest-py до 0.13 нет метода or_, параметр добавляется напрямую"""
+    if hasattr(query, "or_"):
+        return query.or_(filters)
+    query.params = query.params.add("or", f"({filters})")
+    return query
+
+
+def iter_rows(client, table: str, columns: str = "*", key: str = "id", page_size: int = 1000, where=None):
+    """Постранично обойти таблицу по ключу (keyset), не используя OFFSET"""
+    last_key = None
+    while True:
+        query = client.table(table).select(columns)
+        if where:
+            query = where(query)
+        if last_key is not None:
+            query = query.gt(key, last_key)
+        rows = query.order(key).limit(page_size).execute().data or []
+
+        yield from rows
+
+        if len(rows) < page_size:
+            return
+        last_key = rows[-1][key]
+
+
+def count_rows(client, table: str, where=None, column: str = "*") -> int:
+    """Только количество строк (count=exact) без выгрузки самих строк"""
+    try:
+        query = client.table(table).select(column, count="exact", head=True)
+    except TypeError:
+        # postgrest-py без параметра head: ответ ограничиваем одной строкой
+        query = client.table(table).select(column, count="exact").limit(1)
+    if where:
+        query = where(query)
+    return query.execute().count or 0
@@ -0,0 +1,80 @@
+import csv
+import io
+import json
+import zlib
+
+from db_utils import iter_rows
+
+# Таблицы, доступные для выгрузки
+EXPORT_TABLES = ("projects", "user_logs", "rating_history")
+EXPORT_FORMATS = ("ndjson", "csv")
+EXPORT_PAGE_SIZE = 1000
+
+
+def ndjson_chunks(rows):
+    for row in rows:
+        yield (json.dumps(row, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+
+
+def csv_chunks(rows, rows_per_chunk: int = 500):
+    """CSV построчно; заголовок берется из первой строки"""
+    buffer = io.StringIO()
+    writer = None
+    pending = 0
+
+    for row in rows:
+        if writer is None:
+            writer = csv.DictWriter(buffer, fieldnames=list(row.keys()), extrasaction="ignore")
+            writer.writeheader()
+        writer.writerow(row)
+        pending += 1
+
+        if pending >= rows_per_chunk:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_stream(client, table: str, fmt: str = "ndjson", compress: bool = False):
+    """Генератор байтов выгрузки таблицы; память не зависит от размера таблицы"""
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+
+    rows = iter_rows(client, table, page_size=EXPORT_PAGE_SIZE)
+    chunks = ndjson_chunks(rows) if fmt == "ndjson" else csv_chunks(rows)
+    return gzip_chunks(chunks) if compress else chunks
+
+
+def export_filename(table: str, fmt: str = "ndjson", compress: bool = False) -> str:
+    return f"{table}.{fmt}{'.gz' if compress else ''}"
+
+
+def export_media_type(fmt: str = "ndjson", compress: bool = False) -> str:
+    if compress:
+        return "application/gzip"
+    return "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+
+
+def write_export(client, path: str, table: str, fmt: str = "ndjson", compress: bool = False) -> int:
+    """Записать выгрузку в файл, вернуть размер в байтах"""
+    size = 0
+    with open(path, "wb") as f:
+        for chunk in export_stream(client, table, fmt, compress):
+            f.write(chunk)
+            size += len(chunk)
+    return size
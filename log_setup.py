@@ -0,0 +1,218 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from aiogram import BaseMiddleware
+
+from tracing import current_trace_id
+
+# Поля контекста (update_id, user_id, request_id...) для всех записей текущей задачи
+_log_context = contextvars.ContextVar("log_context", default={})
+
+_listener = None
+_queue_handler = None
+
+
+def bind_log_context(**fields):
+    """Добавить поля к записям лога в текущем контексте; вернуть токен для reset_log_context"""
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+def reset_log_context(token):
+    _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Переносит контекст задачи в запись (в потоке записи contextvars уже другие)"""
+
+    def filter(self, record):
+        context = _log_context.get()
+        trace_id = current_trace_id()
+        if trace_id:
+            context = {**context, "trace_id": trace_id}
+        record.context = context
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Одинаковые предупреждения и ошибки: не больше burst за window секунд
+
+    Во время сбоя базы каждый обработчик пишет одну и ту же «Ошибку …» —
+    лишние повторы отбрасываются, а число отброшенных попадает в поле
+    suppressed следующей пропущенной записи с тем же текстом.
+    """
+
+    def __init__(self, burst: int = 5, window: float = 60, level: int = logging.WARNING, max_keys: int = 5000):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self.max_keys = max_keys
+        self._seen = {}
+        # Пишут в лог и loop, и потоки (to_thread, сторож loop)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno < self.level or self.burst <= 0:
+            return True
+        now = time.monotonic()
+        key = (record.name, record.levelno, record.getMessage())
+        with self._lock:
+            entry = self._seen.get(key)
+            if entry is None or now - entry[0] >= self.window:
+                if len(self._seen) >= self.max_keys:
+                    self._seen = {k: v for k, v in self._seen.items() if now - v[0] < self.window}
+                suppressed = entry[2] if entry else 0
+                self._seen[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            entry[1] += 1
+            if entry[1] <= self.burst:
+                return True
+            entry[2] += 1
+            return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler для loop: только кладет в очередь, при переполнении — отбрасывает"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Текст и трассировку исключения готовим здесь: args и exc_info могут не пережить поток
+        record = logging.makeLogRecord(record.__dict__)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись лога одной строкой JSON"""
+
+    def __init__(self, service: str):
+        super().__init__()
+        self.service = service
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "service": self.service,
+            "msg": record.getMessage()
+        }
+        entry.update(getattr(record, "context", None) or {})
+        if getattr(record, "suppressed", None):
+            entry["suppressed"] = record.suppressed
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class ContextTextFormatter(logging.Formatter):
+    """Обычный текстовый формат для консоли, с контекстом и числом отброшенных повторов"""
+
+    def formatMessage(self, record):
+        text = super().formatMessage(record)
+        context = getattr(record, "context", None)
+        if context:
+            text += " [" + " ".join(f"{key}={value}" for key, value in context.items()) + "]"
+        if getattr(record, "suppressed", None):
+            text += f" (еще {record.suppressed} таких же пропущено)"
+        return text
+
+
+def setup_logging(service: str, level=None, log_file: str = None, json_console: bool = None,
+                  max_bytes: int = None, backup_count: int = None, rate_limit: int = None):
+    """Логи через очередь: loop только кладет запись, пишет поток QueueListener
+
+    Настройки по умолчанию — из окружения: LOG_LEVEL, LOG_FILE (JSON с ротацией
+    по LOG_MAX_MB и LOG_FILES), LOG_JSON (в консоль тоже JSON; LOG_JSON=0 —
+    текстом), LOG_RATE_LIMIT (одинаковых предупреждений/ошибок в минуту,
+    0 — без ограничения).
+    Повторный вызов заменяет прежнюю настройку.
+    """
+    global _listener, _queue_handler
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    log_file = log_file or os.getenv("LOG_FILE")
+    if json_console is None:
+        json_console = os.getenv("LOG_JSON", "1") == "1"
+    max_bytes = max_bytes or int(os.getenv("LOG_MAX_MB", 20)) * 1024 * 1024
+    backup_count = backup_count if backup_count is not None else int(os.getenv("LOG_FILES", 5))
+    rate_limit = rate_limit if rate_limit is not None else int(os.getenv("LOG_RATE_LIMIT", 5))
+
+    shutdown_logging()
+
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(
+        JsonFormatter(service) if json_console
+        else ContextTextFormatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    handlers = [console]
+    if log_file:
+        os.makedirs(os.path.dirname(os.path.abspath(log_file)), exist_ok=True)
+        file_handler = logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter(service))
+        handlers.append(file_handler)
+
+    _queue_handler = DroppingQueueHandler(queue.Queue(maxsize=10000))
+    _queue_handler.addFilter(RateLimitFilter(burst=rate_limit))
+    _queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+
+    _listener = logging.handlers.QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return _listener
+
+
+def shutdown_logging():
+    """Дописать очередь и остановить поток записи (вызывается и при выходе)"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Привязывает update_id и user_id ко всем записям лога при обработке апдейта"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        token = bind_log_context(update_id=event.update_id, user_id=user.id if user else None)
+        try:
+            return await handler(event, data)
+        finally:
+            reset_log_context(token)
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,186 @@
+import asyncio
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# Код проекта — файлы рядом с этим модулем (кроме установленных пакетов)
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values: list, q: float) -> float:
+    """Перцентиль методом ближайшего ранга (q от 0 до 100)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(max(math.ceil(q / 100 * len(ordered)), 1), len(ordered)) - 1]
+
+
+async def measure_lag(interval: float, on_beat):
+    """Задержка loop: насколько позже заказанного просыпается sleep(interval)
+
+    После каждого пробуждения вызывает on_beat(задержка, время по monotonic);
+    работает, пока задачу не отменят.
+    """
+    while True:
+        expected = time.monotonic() + interval
+        await asyncio.sleep(interval)
+        now = time.monotonic()
+        on_beat(max(now - expected, 0), now)
+
+
+def _is_project_file(filename: str) -> bool:
+    return filename.startswith(PROJECT_ROOT) and "site-packages" not in filename and filename != __file__
+
+
+def blocking_site(frame) -> tuple:
+    """Место блокировки по стеку потока loop: (ключ, стек строками)
+
+    Ключ — самая глубокая функция проекта и то, что она вызвала:
+    «show_projects_batch -> execute». Блокирует обычно библиотечный вызов
+    (postgrest, open), а исправлять надо место в нашем коде.
+    """
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+
+    stack = [f"{os.path.basename(f.f_code.co_filename)}:{f.f_lineno} {f.f_code.co_name}" for f in frames]
+    owner = None
+    for i, f in enumerate(frames):
+        if _is_project_file(f.f_code.co_filename):
+            owner = i
+    if owner is None:
+        return frames[-1].f_code.co_name if frames else "?", stack
+
+    code = frames[owner].f_code
+    key = f"{code.co_name} ({os.path.basename(code.co_filename)}:{frames[owner].f_lineno})"
+    if owner + 1 < len(frames):
+        key += f" -> {frames[owner + 1].f_code.co_name}"
+    return key, stack
+
+
+class LoopWatchdog:
+    """Сторож event loop: меряет задержку планирования и ловит блокирующий код
+
+    Корутина в loop каждые interval секунд отмечается и записывает, насколько
+    позже заказанного проснулась. Поток-помощник следит за отметками: если loop
+    молчит дольше threshold, он снимает стек потока loop (sys._current_frames)
+    и каждые interval, пока блокировка длится, добавляет ее время месту вызова.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, window: int = 2000, max_sites: int = 200):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_sites = max_sites
+        self.lags = deque(maxlen=window)
+        self.sites = {}
+        self.stalls = 0
+        self.longest_stall = 0.0
+        self.started_at = None
+        self._beat = None
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+        # sites меняет поток-помощник, а читают обработчики в loop
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Запустить из работающего loop (повторный вызов ничего не делает)"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self.started_at = time.time()
+        self._stop.clear()
+        self._task = asyncio.create_task(measure_lag(self.interval, self._on_beat))
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._thread:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    def reset(self):
+        self.lags.clear()
+        with self._lock:
+            self.sites = {}
+            self.stalls = 0
+        self.longest_stall = 0.0
+        self.started_at = time.time()
+
+    def _on_beat(self, lag: float, now: float):
+        self.lags.append(lag)
+        self.longest_stall = max(self.longest_stall, lag)
+        self._beat = now
+
+    def _watch(self):
+        stalled_beat = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue < self.threshold:
+                continue
+            if stalled_beat != beat:
+                # Новая блокировка: все время с пропущенной отметки — на текущее место
+                stalled_beat = beat
+                with self._lock:
+                    self.stalls += 1
+                self._sample(overdue)
+            else:
+                self._sample(self.interval)
+
+    def _sample(self, blocked: float):
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        key, stack = blocking_site(frame)
+        del frame
+        with self._lock:
+            site = self.sites.get(key)
+            if site is None:
+                if len(self.sites) >= self.max_sites:
+                    key = "(прочие)"
+                    site = self.sites.setdefault(key, {"samples": 0, "blocked": 0.0, "stack": [], "last_seen": 0.0})
+                else:
+                    site = self.sites[key] = {"samples": 0, "blocked": 0.0, "stack": stack, "last_seen": 0.0}
+            site["samples"] += 1
+            site["blocked"] += blocked
+            site["last_seen"] = time.time()
+
+    def snapshot(self, top: int = 10) -> dict:
+        """Метрики: задержка loop по окну, блокировки и главные места блокировок"""
+        lags = list(self.lags)
+        with self._lock:
+            sites = sorted(((key, dict(site)) for key, site in self.sites.items()), key=lambda item: -item[1]["blocked"])
+        return {
+            "running": self._task is not None,
+            "since": self.started_at,
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "lag_p50_ms": round(percentile(lags, 50) * 1000, 1),
+            "lag_p99_ms": round(percentile(lags, 99) * 1000, 1),
+            "lag_max_ms": round(max(lags, default=0) * 1000, 1),
+            "stalls": self.stalls,
+            "longest_stall_ms": round(self.longest_stall * 1000, 1),
+            "blocked_ms": round(sum(site["blocked"] for _, site in sites) * 1000, 1),
+            "sites": [
+                {
+                    "site": key,
+                    "samples": site["samples"],
+                    "blocked_ms": round(site["blocked"] * 1000, 1),
+                    "last_seen": site["last_seen"],
+                    "stack": site["stack"][-12:]
+                }
+                for key, site in sites[:top]
+            ]
+        }
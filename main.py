@@ -5,16 +5,42 @@ from aiogram import Bot, Dispatcher, Router, F, BaseMiddleware
 from aiogram.filters import Command, CommandStart
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
-    ReplyKeyboardMarkup, KeyboardButton, FSInputFile
+    ReplyKeyboardMarkup, KeyboardButton, FSInputFile, BufferedInputFile
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from supabase import create_client, Client
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from html import escape
-import uuid
+import tempfile
+
+from db import create_db_client
+from category_counters import CategoryCounters
+from stats_snapshot import StatsSnapshot
+from export import EXPORT_TABLES, EXPORT_FORMATS, write_export, export_filename
+from pagination import decode_cursor, decode_time_cursor, fetch_projects_page, fetch_newest_page
+from db_utils import call_rpc, count_rows
+from referral_codes import CODE_LENGTH, ReferralCodes
+from cache import TTLCache
+from user_profiles import UserDirectory, UserProfileCache, UserProfileMiddleware
+from user_activity import user_activity_summary
+from update_recorder import UpdateRecorder, UpdateRecorderMiddleware
+from loop_watchdog import LoopWatchdog
+from query_audit import AuditedClient, QueryAuditor, QueryAuditMiddleware, QueryAuditHandlerMiddleware
+from log_setup import setup_logging, LogContextMiddleware
+from sampling_profiler import SamplingProfiler, ProfilerBusy
+from memory_monitor import MemoryMonitor, prune_fsm
+from tracing import (
+    Tracer, OTLPFileExporter, TracingMiddleware, TracingHandlerMiddleware, TracingRequestMiddleware
+)
+from project_ops import (
+    delete_projects_cascade, find_projects_by_exact_names,
+    parse_import_document, validate_import_rows, import_projects, PartialImportError, apply_score_batch,
+    project_stats
+)
 
 # --- НАСТРОЙКИ ТОПИКОВ ---
 TOPIC_LOGS_ALL = 46
@@ -32,16 +58,87 @@ TOPICS_BY_CATEGORY = {
 # --- ИНИЦИАЛИЗАЦИЯ ---
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 ADMIN_GROUP_ID = int(os.getenv("ADMIN_CHAT_ID", 0))
+# Свой сервер Bot API (локальный telegram-bot-api или заглушка из bench/)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+# Ключ для вычисления реферальных кодов (обязателен); при смене ключа меняются все выданные коды
+REFERRAL_SECRET = os.getenv("REFERRAL_SECRET")
+
+# Supabase или встроенный SQLite (DB_BACKEND=sqlite)
+supabase = create_db_client()
+
+# Аудит запросов (повторы и запросы на каждую строку) для доли апдейтов QUERY_AUDIT_SAMPLE
+QUERY_AUDIT_SAMPLE = float(os.getenv("QUERY_AUDIT_SAMPLE", 0))
+query_auditor = QueryAuditor(sample=QUERY_AUDIT_SAMPLE) if QUERY_AUDIT_SAMPLE > 0 else None
+
+# Профилировщик по команде /profile (один запуск за раз)
+PROFILE_MAX_SECONDS = 120
+profiler = SamplingProfiler()
+
+# Трассировка апдейтов в TRACES_DIR (OTLP/JSON); TRACE_MIN_MS — писать только медленные
+TRACES_DIR = os.getenv("TRACES_DIR")
+tracer = Tracer(
+    OTLPFileExporter(
+        os.path.join(TRACES_DIR, "traces.jsonl"),
+        max_bytes=int(os.getenv("TRACES_MAX_MB", 20)) * 1024 * 1024,
+        backup_count=int(os.getenv("TRACES_FILES", 5))
+    ) if TRACES_DIR else None,
+    sample=float(os.getenv("TRACE_SAMPLE", 1)),
+    min_duration_ms=float(os.getenv("TRACE_MIN_MS", 0))
+)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-bot = Bot(token=BOT_TOKEN)
+query_observers = [observer for observer in (query_auditor, tracer) if observer and observer.enabled]
+if query_observers:
+    supabase = AuditedClient(supabase, query_observers)
+if TELEGRAM_API_URL:
+    bot = Bot(token=BOT_TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)))
+else:
+    bot = Bot(token=BOT_TOKEN)
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
 router = Router()
 
+# Счетчики проектов по категориям; рейтинг меняет и API, поэтому раз в
+# CATEGORY_COUNTERS_TTL секунд они перечитываются в фоне (запросы читают последний снимок)
+category_counters = CategoryCounters(ttl=int(os.getenv("CATEGORY_COUNTERS_TTL", 60)))
+
+# Снимок общей статистики для /list (кешируется на несколько секунд)
+stats_snapshot = StatsSnapshot(ttl=int(os.getenv("STATS_SNAPSHOT_TTL", 5)))
+
+# Реферальные коды (вычисляются из user_id, старые коды — через карту совместимости);
+# без REFERRAL_SECRET бот не запустится — проверка в on_startup
+referral_codes = ReferralCodes(REFERRAL_SECRET) if REFERRAL_SECRET else None
+
+# Сводка рефералов по пригласившему: количество и последние 5 активаций
+referral_summaries = TTLCache(maxsize=10000, ttl=600)
+
+# Профили пользователей из входящих апдейтов (для имен в логах и статистике)
+user_profiles = UserProfileCache()
+
+# Справочник пользователей (сохраняется в user_directory пачками)
+user_directory = UserDirectory(supabase, user_profiles)
+
+# Username бота, запрашивается один раз при запуске
+bot_username = None
+
+# Запись апдейтов для воспроизведения (bench/replay.py); включается RECORD_UPDATES_DIR
+RECORD_UPDATES_DIR = os.getenv("RECORD_UPDATES_DIR")
+update_recorder = None
+
+# Сторож event loop: задержка планирования и места блокирующих вызовов (0 — выключен)
+LOOP_LAG_THRESHOLD_MS = int(os.getenv("LOOP_LAG_THRESHOLD_MS", 100))
+loop_watchdog = LoopWatchdog(threshold=LOOP_LAG_THRESHOLD_MS / 1000) if LOOP_LAG_THRESHOLD_MS > 0 else None
+
+# Контроль памяти: проверка раз в MEMORY_CHECK_INTERVAL секунд (0 — только по /memreport),
+# оповещение в топик логов при росте сверх бюджета. MEMORY_TRACE_FRAMES > 0 включает tracemalloc —
+# он замедляет каждую аллокацию, поэтому только на время поиска утечки
+MEMORY_CHECK_INTERVAL = int(os.getenv("MEMORY_CHECK_INTERVAL", 600))
+MEMORY_BUDGET_MB = float(os.getenv("MEMORY_BUDGET_MB", 100))
+MEMORY_ENTRIES_BUDGET = int(os.getenv("MEMORY_ENTRIES_BUDGET", 50000))
+MEMORY_TASKS_BUDGET = int(os.getenv("MEMORY_TASKS_BUDGET", 1000))
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", 0))
+memory_monitor = None
+
 # Добавь новую категорию:
 CATEGORIES = {
     "support_bots": "Боты поддержки",
@@ -68,6 +165,9 @@ class EditProjectState(StatesGroup):
 class SearchState(StatesGroup):
     waiting_for_query = State()
 
+class ImportState(StatesGroup):
+    waiting_for_document = State()
+
 # --- СИСТЕМА РЕФЕРАЛОВ ---
 class ReferralState(StatesGroup):
     waiting_for_referral_code = State()
@@ -78,12 +178,16 @@ async def is_user_admin(user_id: int) -> bool:
         member = await bot.get_chat_member(chat_id=ADMIN_GROUP_ID, user_id=user_id)
         return member.status in ["creator", "administrator", "member"]
     except Exception as e:
-        logging.error(f"Ошибка проверки админки: {e}")
+        logging.error("Ошибка проверки админки: %s", e)
         return False
 
 # --- MIDDLEWARE (БАН) ---
 class AccessMiddleware(BaseMiddleware):
     async def __call__(self, handler, event, data):
+        with tracer.span("AccessMiddleware"):
+            return await self.check(handler, event, data)
+
+    async def check(self, handler, event, data):
         user = data.get("event_from_user")
         
         if not user or user.is_bot:
@@ -114,7 +218,7 @@ class AccessMiddleware(BaseMiddleware):
                 return
         
         except Exception as e:
-            logging.error(f"Ошибка проверки бана: {e}")
+            logging.error("Ошибка проверки бана: %s", e)
         
         return await handler(event, data)
 
@@ -183,12 +287,12 @@ def rating_kb():
     buttons.append([InlineKeyboardButton(text="Назад к тексту", callback_data="back_to_text")])
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
-def pagination_kb(category_key, offset, has_next=True):
-    buttons = []
-    if has_next:
-        callback_data = f"more_{category_key}_{offset}"
-        buttons.append([InlineKeyboardButton(text="Показать еще", callback_data=callback_data)])
-    return InlineKeyboardMarkup(inline_keyboard=buttons)
+def pagination_kb(category_key, shown, cursor):
+    # more_{категория}_{показано}_{курсор}; курсор не содержит '_' и укладывается в 64 байта
+    callback_data = f"more_{category_key}_{shown}_{cursor}"
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Показать еще", callback_data=callback_data)]
+    ])
 
 def referral_kb():
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -199,154 +303,223 @@ def referral_kb():
 
 # --- ФУНКЦИЯ ОТПРАВКИ ЛОГОВ ---
 async def send_log_to_topics(admin_text: str, category: str = None):
-    try:
-        if TOPIC_LOGS_ALL:
-            await bot.send_message(
-                ADMIN_GROUP_ID,
-                admin_text,
-                message_thread_id=TOPIC_LOGS_ALL,
-                parse_mode="HTML"
-            )
-        
-        if category:
-            cat_topic = TOPICS_BY_CATEGORY.get(category)
-            if cat_topic:
+    with tracer.span("send_log_to_topics", category=category or ""):
+        try:
+            if TOPIC_LOGS_ALL:
                 await bot.send_message(
                     ADMIN_GROUP_ID,
                     admin_text,
-                    message_thread_id=cat_topic,
+                    message_thread_id=TOPIC_LOGS_ALL,
                     parse_mode="HTML"
                 )
         
-        elif not TOPIC_LOGS_ALL and ADMIN_GROUP_ID:
-            await bot.send_message(ADMIN_GROUP_ID, admin_text, parse_mode="HTML")
+            if category:
+                cat_topic = TOPICS_BY_CATEGORY.get(category)
+                if cat_topic:
+                    await bot.send_message(
+                        ADMIN_GROUP_ID,
+                        admin_text,
+                        message_thread_id=cat_topic,
+                        parse_mode="HTML"
+                    )
+        
+            elif not TOPIC_LOGS_ALL and ADMIN_GROUP_ID:
+                await bot.send_message(ADMIN_GROUP_ID, admin_text, parse_mode="HTML")
             
-    except Exception as e:
-        logging.error(f"Ошибка отправки лога: {e}")
+        except Exception as e:
+            logging.error("Ошибка отправки лога: %s", e)
+
+# --- ФОНОВАЯ ОТПРАВКА ЛОГОВ ---
+log_queue = asyncio.Queue()
+log_worker_task = None
+
+def dispatch_log(admin_text: str = None, category: str = None, build=None):
+    """Поставить лог в очередь, не дожидаясь отправки
+
+    build — корутинная функция, формирующая текст лога уже в фоне
+    (например, с запросами имен пользователей к Telegram).
+    """
+    global log_worker_task
+    # Трасса апдейта продолжается в воркере: отправка лога видна в ней отдельным спаном
+    log_queue.put_nowait((admin_text, category, build, tracer.current()))
+    
+    if log_worker_task is None or log_worker_task.done():
+        log_worker_task = asyncio.create_task(log_dispatcher_worker())
+
+async def log_dispatcher_worker():
+    while True:
+        admin_text, category, build, span = await log_queue.get()
+        try:
+            with tracer.activate(span):
+                if build:
+                    admin_text = await build()
+                if admin_text:
+                    await send_log_to_topics(admin_text, category)
+        except Exception as e:
+            logging.error("Ошибка фоновой отправки лога: %s", e)
+        finally:
+            log_queue.task_done()
 
 # --- РЕФЕРАЛЬНАЯ СИСТЕМА ---
 async def generate_referral_code(user_id: int) -> str:
-    """Генерация уникального реферального кода"""
-    code = str(uuid.uuid4())[:8].upper()
+    """Сохранить случайный код для пользователя, которому не подходит вычисляемый"""
+    code = referral_codes.new_legacy_code()
     
-    # Проверяем уникальность
-    result = supabase.table("referrals")\
-        .select("code")\
-        .eq("code", code)\
-        .execute()
+    supabase.table("referrals").insert({
+        "user_id": user_id,
+        "code": code,
+        "created_at": "now()"
+    }).execute()
     
-    if not result.data:
-        # Сохраняем код
-        supabase.table("referrals").insert({
-            "user_id": user_id,
-            "code": code,
-            "created_at": "now()"
-        }).execute()
-        return code
-    else:
-        # Если код существует, генерируем новый
-        return await generate_referral_code(user_id)
+    referral_codes.add_legacy(code, user_id)
+    return code
 
 async def get_user_referral_code(user_id: int) -> str:
     """Получить реферальный код пользователя"""
-    result = supabase.table("referrals")\
-        .select("code")\
-        .eq("user_id", user_id)\
+    code = referral_codes.code_for(user_id)
+    if code:
+        return code
+    return await generate_referral_code(user_id)
+
+REFERRAL_ERRORS = {
+    "already_activated": "Вы уже активировали реферальный код ранее",
+    "self_referral": "Нельзя использовать собственный реферальный код",
+    "invalid_code": "Неверный реферальный код"
+}
+
+def activate_referral_local(inviter_id: int, referred_id: int, referral_code: str) -> dict:
+    """Локальная замена функции activate_referral (без транзакции)"""
+    existing = supabase.table("referral_logs")\
+        .select("referred_user_id")\
+        .eq("referred_user_id", referred_id)\
         .execute()
     
-    if result.data:
-        return result.data[0]['code']
-    else:
-        return await generate_referral_code(user_id)
-
-async def process_referral(inviter_id: int, referred_id: int, referral_code: str):
-    """Обработка реферала"""
-    try:
-        # Проверяем, не активировал ли уже пользователь реферал
-        existing = supabase.table("referral_logs")\
-            .select("*")\
-            .eq("referred_user_id", referred_id)\
-            .execute()
-        
-        if existing.data:
-            return False, "Вы уже активировали реферальный код ранее"
-        
-        # Проверяем, не является ли пользователь самим собой
-        if inviter_id == referred_id:
-            return False, "Нельзя использовать собственный реферальный код"
-        
-        # Находим пользователя по коду
-        code_result = supabase.table("referrals")\
-            .select("user_id")\
-            .eq("code", referral_code)\
+    if existing.data:
+        return {"ok": False, "error": "already_activated"}
+    
+    if inviter_id == referred_id:
+        return {"ok": False, "error": "self_referral"}
+    
+    stats = supabase.table("user_stats")\
+        .select("user_id, referral_count")\
+        .in_("user_id", [inviter_id, referred_id])\
+        .execute().data or []
+    counts = {row['user_id']: row['referral_count'] for row in stats}
+    
+    # Код с верной контрольной суммой может быть подобран: пригласивший должен быть известен боту
+    if inviter_id not in counts and not referral_codes.is_legacy(referral_code) \
+            and inviter_id not in user_directory.lookup_many([inviter_id]):
+        return {"ok": False, "error": "invalid_code"}
+    
+    supabase.table("referral_logs").insert({
+        "inviter_id": inviter_id,
+        "referred_user_id": referred_id,
+        "referral_code": referral_code,
+        "activated_at": "now()"
+    }).execute()
+    
+    if inviter_id in counts:
+        referral_count = counts[inviter_id] + 1
+        supabase.table("user_stats")\
+            .update({"referral_count": referral_count})\
+            .eq("user_id", inviter_id)\
             .execute()
-        
-        if not code_result.data:
-            return False, "Неверный реферальный код"
-        
-        inviter_id_from_code = code_result.data[0]['user_id']
-        
-        # Логируем активацию
-        supabase.table("referral_logs").insert({
-            "inviter_id": inviter_id_from_code,
-            "referred_user_id": referred_id,
-            "referral_code": referral_code,
-            "activated_at": "now()"
+    else:
+        referral_count = 1
+        supabase.table("user_stats").insert({
+            "user_id": inviter_id,
+            "referral_count": 1,
+            "reviews_count": 0,
+            "likes_count": 0
         }).execute()
-        
-        # Обновляем статистику пригласившего
-        inviter_stats = supabase.table("user_stats")\
-            .select("*")\
-            .eq("user_id", inviter_id_from_code)\
-            .execute()
-        
-        if inviter_stats.data:
-            # Увеличиваем счетчик рефералов
-            supabase.table("user_stats")\
-                .update({"referral_count": inviter_stats.data[0]['referral_count'] + 1})\
-                .eq("user_id", inviter_id_from_code)\
-                .execute()
-        else:
-            # Создаем запись статистики
-            supabase.table("user_stats").insert({
-                "user_id": inviter_id_from_code,
-                "referral_count": 1,
-                "reviews_count": 0,
-                "likes_count": 0
-            }).execute()
-        
-        # Создаем запись для приглашенного
-        referred_stats = supabase.table("user_stats")\
-            .select("*")\
-            .eq("user_id", referred_id)\
+    
+    if referred_id not in counts:
+        supabase.table("user_stats").insert({
+            "user_id": referred_id,
+            "referral_count": 0,
+            "reviews_count": 0,
+            "likes_count": 0
+        }).execute()
+    
+    return {
+        "ok": True,
+        "inviter_id": inviter_id,
+        "referred_id": referred_id,
+        "referral_code": referral_code,
+        "referral_count": referral_count
+    }
+
+async def build_referral_log(inviter_id: int, referred_id: int, referral_code: str, activated_at: datetime) -> str:
+    """Текст лога о новом реферале (имена запрашиваются уже в фоне)"""
+    profiles = await user_directory.resolve(bot, [inviter_id, referred_id])
+    names = {
+        user_id: user_directory.display_name(profiles.get(user_id), user_id)
+        for user_id in (inviter_id, referred_id)
+    }
+    
+    return (
+        f"НОВЫЙ РЕФЕРАЛ!\n\n"
+        f"Пригласил: @{names[inviter_id]} (ID: {inviter_id})\n"
+        f"Приглашенный: @{names[referred_id]} (ID: {referred_id})\n"
+        f"Код: <code>{referral_code}</code>\n"
+        f"Дата: {activated_at.strftime('%d.%m.%Y %H:%M')}"
+    )
+
+async def get_bot_username() -> str:
+    global bot_username
+    if bot_username is None:
+        bot_username = (await bot.me()).username
+    return bot_username
+
+def get_referral_summary(inviter_id: int) -> dict:
+    """Количество рефералов и последние 5 активаций (один ограниченный запрос)"""
+    summary = referral_summaries.get(inviter_id)
+    if summary is None:
+        result = supabase.table("referral_logs")\
+            .select("referred_user_id, activated_at", count="exact")\
+            .eq("inviter_id", inviter_id)\
+            .order("activated_at", desc=True)\
+            .limit(5)\
             .execute()
         
-        if not referred_stats.data:
-            supabase.table("user_stats").insert({
-                "user_id": referred_id,
-                "referral_count": 0,
-                "reviews_count": 0,
-                "likes_count": 0
-            }).execute()
+        summary = {
+            "count": result.count or 0,
+            "recent": result.data or []
+        }
+        referral_summaries.set(inviter_id, summary)
+    return summary
+
+async def process_referral(inviter_id: int, referred_id: int, referral_code: str):
+    """Обработка реферала: проверка и запись активации одной операцией"""
+    try:
+        # Владелец кода вычисляется из самого кода, без запроса к базе
+        referral_code = referral_codes.normalize(referral_code)
+        inviter_id = referral_codes.decode(referral_code)
+        if not inviter_id:
+            return False, REFERRAL_ERRORS["invalid_code"]
+        
+        result = call_rpc(
+            supabase,
+            "activate_referral",
+            {"p_inviter_id": inviter_id, "p_referred_id": referred_id, "p_code": referral_code},
+            fallback=lambda: activate_referral_local(inviter_id, referred_id, referral_code)
+        )
         
-        # Отправляем уведомление в логи
-        inviter_info = await bot.get_chat(inviter_id_from_code)
-        referred_info = await bot.get_chat(referred_id)
+        if not result.get('ok'):
+            return False, REFERRAL_ERRORS.get(result.get('error'), "Ошибка при активации кода")
         
-        log_text = (
-            f"НОВЫЙ РЕФЕРАЛ!\n\n"
-            f"Пригласил: @{inviter_info.username or inviter_info.id} (ID: {inviter_id_from_code})\n"
-            f"Приглашенный: @{referred_info.username or referred_info.id} (ID: {referred_id})\n"
-            f"Код: <code>{referral_code}</code>\n"
-            f"Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}"
-        )
+        referral_summaries.pop(result['inviter_id'])
         
-        await send_log_to_topics(log_text)
+        # Имена пользователей для лога запрашиваются в фоне
+        activated_at = datetime.now()
+        dispatch_log(build=lambda: build_referral_log(
+            result['inviter_id'], referred_id, referral_code, activated_at
+        ))
         
         return True, "Реферальный код успешно активирован!"
         
     except Exception as e:
-        logging.error(f"Ошибка обработки реферала: {e}")
+        logging.error("Ошибка обработки реферала: %s", e)
         return False, "Ошибка при активации кода"
 
 async def get_user_stats(user_id: int):
@@ -421,7 +594,7 @@ async def get_weekly_top(limit: int = 10):
         return top_projects
         
     except Exception as e:
-        logging.error(f"Ошибка получения топа недели: {e}")
+        logging.error("Ошибка получения топа недели: %s", e)
         return []
 
 # --- СИСТЕМА МЕСЯЧНОГО РЕЙТИНГА ---
@@ -467,7 +640,7 @@ async def get_monthly_top(limit: int = 10):
         return top_projects
         
     except Exception as e:
-        logging.error(f"Ошибка получения топа месяца: {e}")
+        logging.error("Ошибка получения топа месяца: %s", e)
         return []
 
 async def get_weekly_leaders(limit: int = 10):
@@ -504,10 +677,17 @@ async def get_weekly_leaders(limit: int = 10):
         # Сортируем по влиянию
         leaders = sorted(impact_by_user.values(), key=lambda x: x['impact'], reverse=True)[:limit]
         
+        # Актуальные username из справочника вместо скопированных в историю
+        profiles = user_directory.lookup_many([leader['user_id'] for leader in leaders])
+        for leader in leaders:
+            profile = profiles.get(leader['user_id'])
+            if profile and profile.get('username'):
+                leader['username'] = profile['username']
+        
         return leaders
         
     except Exception as e:
-        logging.error(f"Ошибка получения лидеров недели: {e}")
+        logging.error("Ошибка получения лидеров недели: %s", e)
         return []
 
 async def get_monthly_leaders(limit: int = 10):
@@ -544,10 +724,17 @@ async def get_monthly_leaders(limit: int = 10):
         # Сортируем по влиянию
         leaders = sorted(impact_by_user.values(), key=lambda x: x['impact'], reverse=True)[:limit]
         
+        # Актуальные username из справочника вместо скопированных в историю
+        profiles = user_directory.lookup_many([leader['user_id'] for leader in leaders])
+        for leader in leaders:
+            profile = profiles.get(leader['user_id'])
+            if profile and profile.get('username'):
+                leader['username'] = profile['username']
+        
         return leaders
         
     except Exception as e:
-        logging.error(f"Ошибка получения лидеров месяца: {e}")
+        logging.error("Ошибка получения лидеров месяца: %s", e)
         return []
 
 # --- ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
@@ -558,11 +745,11 @@ async def safe_edit_message(call: CallbackQuery, text: str, reply_markup=None, p
         if "message is not modified" in str(e):
             await call.answer()
         else:
-            logging.error(f"Ошибка редактирования сообщения: {e}")
+            logging.error("Ошибка редактирования сообщения: %s", e)
             try:
                 await call.message.answer(text, reply_markup=reply_markup, parse_mode=parse_mode)
             except Exception as e2:
-                logging.error(f"Ошибка отправки сообщения: {e2}")
+                logging.error("Ошибка отправки сообщения: %s", e2)
                 await call.answer()
 
 async def safe_edit_media(call: CallbackQuery, caption: str, reply_markup=None, parse_mode="HTML"):
@@ -572,11 +759,11 @@ async def safe_edit_media(call: CallbackQuery, caption: str, reply_markup=None,
         if "message is not modified" in str(e):
             await call.answer()
         else:
-            logging.error(f"Ошибка редактирования медиа: {e}")
+            logging.error("Ошибка редактирования медиа: %s", e)
             try:
                 await call.message.answer(caption, reply_markup=reply_markup, parse_mode=parse_mode)
             except Exception as e2:
-                logging.error(f"Ошибка отправки сообщения: {e2}")
+                logging.error("Ошибка отправки сообщения: %s", e2)
                 await call.answer()
 
 async def get_project_photo(project_id: int):
@@ -585,7 +772,7 @@ async def get_project_photo(project_id: int):
         if result.data:
             return result.data[0].get('photo_file_id', '')
     except Exception as e:
-        logging.error(f"Ошибка получения фото: {e}")
+        logging.error("Ошибка получения фото: %s", e)
     return None
 
 async def save_project_photo(project_id: int, photo_file_id: str, admin_id: int):
@@ -598,7 +785,7 @@ async def save_project_photo(project_id: int, photo_file_id: str, admin_id: int)
         }).execute()
         return True
     except Exception as e:
-        logging.error(f"Ошибка сохранения фото: {e}")
+        logging.error("Ошибка сохранения фото: %s", e)
         return False
 
 async def find_project_by_name(name: str):
@@ -607,7 +794,7 @@ async def find_project_by_name(name: str):
         if result.data:
             return result.data[0]
     except Exception as e:
-        logging.error(f"Ошибка поиска проекта: {e}")
+        logging.error("Ошибка поиска проекта: %s", e)
     return None
 
 async def find_project_by_id(project_id: int):
@@ -616,25 +803,19 @@ async def find_project_by_id(project_id: int):
         if result.data:
             return result.data[0]
     except Exception as e:
-        logging.error(f"Ошибка поиска проекта по ID: {e}")
+        logging.error("Ошибка поиска проекта по ID: %s", e)
     return None
 
-async def show_projects_batch(category_key, offset, message_or_call, is_first_batch=False):
+async def show_projects_batch(category_key, cursor, shown, message_or_call, is_first_batch=False):
     projects_per_batch = 5
     
-    data = supabase.table("projects")\
-        .select("*")\
-        .eq("category", category_key)\
-        .order("score", desc=True)\
-        .range(offset, offset + projects_per_batch - 1)\
-        .execute().data
-    
-    count_result = supabase.table("projects")\
-        .select("*", count="exact")\
-        .eq("category", category_key)\
-        .execute()
+    data, next_cursor = fetch_projects_page(
+        supabase.table("projects").select("*").eq("category", category_key),
+        cursor,
+        projects_per_batch
+    )
     
-    total_projects = count_result.count if hasattr(count_result, 'count') else 0
+    total_projects = category_counters.count(category_key)
     
     if not data:
         if is_first_batch:
@@ -699,34 +880,24 @@ async def show_projects_batch(category_key, offset, message_or_call, is_first_ba
             else:
                 await message_or_call.answer(card, reply_markup=project_card_kb(p['id']), parse_mode="HTML")
     
-    has_next = offset + projects_per_batch < total_projects
+    new_shown = shown + len(data)
     
-    if is_first_batch and has_next:
-        kb = pagination_kb(category_key, offset + projects_per_batch, has_next)
-        if isinstance(message_or_call, CallbackQuery):
-            await message_or_call.message.answer("Показано: {}-{} из {} проектов".format(
-                offset + 1, min(offset + projects_per_batch, total_projects), total_projects
-            ), reply_markup=kb, parse_mode="HTML")
-        else:
-            await message_or_call.answer("Показано: {}-{} из {} проектов".format(
-                offset + 1, min(offset + projects_per_batch, total_projects), total_projects
-            ), reply_markup=kb, parse_mode="HTML")
-    elif isinstance(message_or_call, CallbackQuery) and not is_first_batch:
-        new_offset = offset + projects_per_batch
-        new_has_next = new_offset < total_projects
-        
+    if isinstance(message_or_call, CallbackQuery) and not is_first_batch:
+        # Убираем старую кнопку «Показать еще»
         try:
             await message_or_call.message.delete()
         except:
             pass
-            
-        if new_has_next:
-            kb = pagination_kb(category_key, new_offset, new_has_next)
-            await message_or_call.message.answer("Показано: {}-{} из {} проектов".format(
-                offset + projects_per_batch + 1, min(new_offset + projects_per_batch, total_projects), total_projects
-            ), reply_markup=kb, parse_mode="HTML")
-        else:
-            await message_or_call.message.answer("Показаны все проекты\nВсего проектов: {}".format(total_projects), parse_mode="HTML")
+    
+    target = message_or_call.message if isinstance(message_or_call, CallbackQuery) else message_or_call
+    
+    if next_cursor:
+        kb = pagination_kb(category_key, new_shown, next_cursor)
+        await target.answer("Показано: {}-{} из {} проектов".format(
+            shown + 1, new_shown, max(total_projects, new_shown)
+        ), reply_markup=kb, parse_mode="HTML")
+    elif not is_first_batch:
+        await target.answer("Показаны все проекты\nВсего проектов: {}".format(new_shown), parse_mode="HTML")
 
 # --- ОБРАБОТЧИКИ ДЛЯ КНОПОК ГЛАВНОГО МЕНЮ ---
 @router.message(F.text == "Поиск проекта")
@@ -954,7 +1125,7 @@ async def cmd_start(message: Message, state: FSMContext):
             referral_code = arg[4:]  # Убираем "ref_"
     
     # Обработка реферального кода
-    if referral_code and len(referral_code) == 8:
+    if referral_code and len(referral_code) == CODE_LENGTH:
         success, result_message = await process_referral(
             inviter_id=0,
             referred_id=message.from_user.id,
@@ -1096,6 +1267,7 @@ async def rev_end(call: CallbackQuery, state: FSMContext):
         await update_user_stats(call.from_user.id, "reviews_count")
 
     supabase.table("projects").update({"score": new_score}).eq("id", p_id).execute()
+    category_counters.apply_score_change(p['category'], rating_change)
     
     supabase.table("rating_history").insert({
         "project_id": p_id,
@@ -1162,6 +1334,7 @@ async def handle_like(call: CallbackQuery):
     new_score = old_score + 1
     
     supabase.table("projects").update({"score": new_score}).eq("id", p_id).execute()
+    category_counters.apply_score_change(project['category'], 1)
     
     supabase.table("user_logs").insert({
         "user_id": call.from_user.id,
@@ -1192,9 +1365,12 @@ async def handle_like(call: CallbackQuery):
 async def get_referral_link(call: CallbackQuery):
     """Получить реферальную ссылку"""
     user_id = call.from_user.id
+    # Код принимается, только если у пригласившего есть запись в user_directory,
+    # поэтому профиль сохраняется сразу, а не с очередной пачкой
+    await user_directory.save(call.from_user)
     code = await get_user_referral_code(user_id)
     
-    referral_link = f"https://t.me/{(await bot.me()).username}?start=ref_{code}"
+    referral_link = f"https://t.me/{await get_bot_username()}?start=ref_{code}"
     
     text = (
         f"<b>ВАША РЕФЕРАЛЬНАЯ ССЫЛКА</b>\n\n"
@@ -1204,19 +1380,12 @@ async def get_referral_link(call: CallbackQuery):
         f"<b>Статистика:</b>\n"
     )
     
-    stats = await get_user_stats(user_id)
-    text += f"• Приглашено друзей: <b>{stats['referral_count']}</b>\n"
-    
-    # Получаем список рефералов
-    referrals_result = supabase.table("referral_logs")\
-        .select("referred_user_id, activated_at")\
-        .eq("inviter_id", user_id)\
-        .order("activated_at", desc=True)\
-        .execute()
+    summary = get_referral_summary(user_id)
+    text += f"• Приглашено друзей: <b>{summary['count']}</b>\n"
     
-    if referrals_result.data:
+    if summary['recent']:
         text += f"\n<b>ПОСЛЕДНИЕ РЕФЕРАЛЫ:</b>\n"
-        for i, ref in enumerate(referrals_result.data[:5], 1):
+        for i, ref in enumerate(summary['recent'], 1):
             date = ref['activated_at'][:10] if ref['activated_at'] else "Неизвестно"
             text += f"{i}. ID: <code>{ref['referred_user_id']}</code> — {date}\n"
     
@@ -1250,7 +1419,7 @@ async def process_referral_code(message: Message, state: FSMContext):
     """Обработка введенного реферального кода"""
     referral_code = message.text.strip().upper()
     
-    if len(referral_code) != 8:
+    if len(referral_code) != CODE_LENGTH:
         await message.answer(
             "<b>Неверный формат кода!</b>\n\n"
             "Реферальный код должен состоять из 8 символов.\n"
@@ -1283,16 +1452,46 @@ async def process_referral_code(message: Message, state: FSMContext):
     
     await state.clear()
 
+REFERRALS_PAGE_SIZE = 10
+
+def my_referrals_kb(page: int, next_cursor: str = None):
+    nav = []
+    if page > 1:
+        nav.append(InlineKeyboardButton(text="В начало", callback_data="my_referrals"))
+    if next_cursor:
+        # myref_{страница}_{курсор}
+        nav.append(InlineKeyboardButton(text="Далее", callback_data=f"myref_{page + 1}_{next_cursor}"))
+    
+    buttons = [nav] if nav else []
+    buttons.append([InlineKeyboardButton(text="Получить реф. ссылку", callback_data="get_referral")])
+    buttons.append([InlineKeyboardButton(text="Назад", callback_data="back_to_referral_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=buttons)
+
 @router.callback_query(F.data == "my_referrals")
+@router.callback_query(F.data.startswith("myref_"))
 async def show_my_referrals(call: CallbackQuery):
-    """Показать моих рефералов"""
+    """Показать моих рефералов (постранично)"""
     user_id = call.from_user.id
+    page, cursor = 1, None
     
-    referrals_result = supabase.table("referral_logs")\
-        .select("referred_user_id, activated_at")\
-        .eq("inviter_id", user_id)\
-        .order("activated_at", desc=True)\
-        .execute()
+    if call.data.startswith("myref_"):
+        try:
+            page_str, cursor = call.data[len("myref_"):].split("_", 1)
+            page = int(page_str)
+            decode_time_cursor(cursor)
+        except ValueError:
+            await call.answer("Ошибка: неверный формат данных", show_alert=True)
+            return
+    
+    referrals, next_cursor = fetch_newest_page(
+        supabase.table("referral_logs")
+            .select("referred_user_id, activated_at")
+            .eq("inviter_id", user_id),
+        "activated_at",
+        "referred_user_id",
+        cursor,
+        REFERRALS_PAGE_SIZE
+    )
     
     stats = await get_user_stats(user_id)
     
@@ -1300,22 +1499,19 @@ async def show_my_referrals(call: CallbackQuery):
     text += f"Всего приглашено: <b>{stats['referral_count']}</b>\n"
     text += "-" * 20 + "\n\n"
     
-    if referrals_result.data:
-        text += f"<b>СПИСОК РЕФЕРАЛОВ:</b>\n"
-        for i, ref in enumerate(referrals_result.data, 1):
+    if referrals:
+        first = (page - 1) * REFERRALS_PAGE_SIZE + 1
+        text += f"<b>СПИСОК РЕФЕРАЛОВ</b> (страница {page}):\n"
+        for i, ref in enumerate(referrals, first):
             date = ref['activated_at'][:10] if ref['activated_at'] else "Неизвестно"
             text += f"{i}. ID: <code>{ref['referred_user_id']}</code> — {date}\n"
-        
-        if len(referrals_result.data) > 10:
-            text += f"\n<i>Показано {len(referrals_result.data)} из {stats['referral_count']} рефералов</i>"
+    elif page > 1:
+        text += "Больше рефералов нет.\n"
     else:
         text += "У вас еще нет рефералов.\n"
         text += "Пригласите друзей, чтобы они появились здесь!"
     
-    await safe_edit_message(call, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Получить реф. ссылку", callback_data="get_referral")],
-        [InlineKeyboardButton(text="Назад", callback_data="back_to_referral_menu")]
-    ]))
+    await safe_edit_message(call, text, reply_markup=my_referrals_kb(page, next_cursor))
     
     await call.answer()
 
@@ -1344,14 +1540,13 @@ async def admin_referral_stats(message: Message):
     
     try:
         # Общая статистика
-        total_referrals = supabase.table("referral_logs")\
-            .select("*", count="exact")\
-            .execute()
+        total_refs = count_rows(supabase, "referral_logs", column="referred_user_id")
         
-        total_users_with_ref = supabase.table("user_stats")\
-            .select("*", count="exact")\
-            .gt("referral_count", 0)\
-            .execute()
+        total_with_ref = count_rows(
+            supabase, "user_stats",
+            where=lambda q: q.gt("referral_count", 0),
+            column="user_id"
+        )
         
         # Топ приглашающих
         top_inviters = supabase.table("user_stats")\
@@ -1369,9 +1564,6 @@ async def admin_referral_stats(message: Message):
         
         text = "<b>СТАТИСТИКА РЕФЕРАЛЬНОЙ СИСТЕМЫ</b>\n\n"
         
-        total_refs = total_referrals.count if hasattr(total_referrals, 'count') else 0
-        total_with_ref = total_users_with_ref.count if hasattr(total_users_with_ref, 'count') else 0
-        
         text += f"<b>Общая статистика:</b>\n"
         text += f"• Всего рефералов: <b>{total_refs}</b>\n"
         text += f"• Пользователей с рефералами: <b>{total_with_ref}</b>\n"
@@ -1379,13 +1571,9 @@ async def admin_referral_stats(message: Message):
         
         if top_inviters.data:
             text += f"<b>ТОП-10 ПРИГЛАШАЮЩИХ:</b>\n"
+            profiles = await user_directory.resolve(bot, [inviter['user_id'] for inviter in top_inviters.data])
             for i, inviter in enumerate(top_inviters.data, 1):
-                try:
-                    user_info = await bot.get_chat(inviter['user_id'])
-                    username = user_info.username or user_info.id
-                except:
-                    username = inviter['user_id']
-                
+                username = user_directory.display_name(profiles.get(inviter['user_id']), inviter['user_id'])
                 text += f"{i}. @{username} — <b>{inviter['referral_count']}</b> рефералов\n"
         
         if recent_referrals.data:
@@ -1397,31 +1585,32 @@ async def admin_referral_stats(message: Message):
         await message.reply(text, parse_mode="HTML")
         
     except Exception as e:
-        logging.error(f"Ошибка в /referralstats: {e}")
+        logging.error("Ошибка в /referralstats: %s", e)
         await message.reply("Ошибка при получении статистики.")
 
 # --- ОБРАБОТЧИК ПАГИНАЦИИ ---
 @router.callback_query(F.data.startswith("more_"))
 async def handle_show_more(call: CallbackQuery):
     try:
-        callback_data = call.data
-        parts = callback_data.split("_")
+        # more_{категория}_{показано}_{курсор}
+        parts = call.data[len("more_"):].rsplit("_", 2)
         
-        if len(parts) >= 3:
-            category_key = "_".join(parts[1:-1])
-            offset_str = parts[-1]
+        if len(parts) == 3 and parts[0] in CATEGORIES:
+            category_key, shown_str, cursor = parts
             
             try:
-                offset = int(offset_str)
-                await show_projects_batch(category_key, offset, call, is_first_batch=False)
+                shown = int(shown_str)
+                decode_cursor(cursor)
+                await show_projects_batch(category_key, cursor, shown, call, is_first_batch=False)
                 await call.answer()
             except ValueError:
                 await call.answer("Ошибка: неверный формат данных", show_alert=True)
         else:
-            await call.answer("Ошибка: неверный формат callback данных", show_alert=True)
+            # Кнопки старого формата (со смещением) больше не поддерживаются
+            await call.answer("Список устарел. Откройте категорию заново.", show_alert=True)
             
     except Exception as e:
-        logging.error(f"Ошибка пагинации: {e}")
+        logging.error("Ошибка пагинации: %s", e)
         await call.answer("Ошибка загрузки проектов", show_alert=True)
 
 # --- ОБРАБОТЧИК КНОПКИ НАЗАД В МЕНЮ ---
@@ -1509,7 +1698,7 @@ async def search_project_execute(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        logging.error(f"Ошибка поиска: {e}")
+        logging.error("Ошибка поиска: %s", e)
         await message.answer(
             "Ошибка при выполнении поиска. Попробуйте позже."
         )
@@ -1519,7 +1708,7 @@ async def search_project_execute(message: Message, state: FSMContext):
 async def show_cat(message: Message):
     """Показать первую партию проектов категории"""
     cat_key = [k for k, v in CATEGORIES.items() if v == message.text][0]
-    await show_projects_batch(cat_key, 0, message, is_first_batch=True)
+    await show_projects_batch(cat_key, None, 0, message, is_first_batch=True)
 
 # --- ОСНОВНЫЕ ОБРАБОТЧИКИ ПРОЕКТОВ ---
 @router.callback_query(F.data.startswith("panel_"))
@@ -1846,6 +2035,8 @@ async def admin_add(message: Message, state: FSMContext):
         }).execute()
         
         if result.data:
+            category_counters.add_project(cat, 0)
+            
             # Добавляем запись в историю
             supabase.table("rating_history").insert({
                 "project_id": result.data[0]['id'],
@@ -1879,77 +2070,200 @@ async def admin_add(message: Message, state: FSMContext):
             await message.reply("Ошибка при добавлении проекта.")
             
     except Exception as e:
-        logging.error(f"Ошибка в /add: {e}")
+        logging.error("Ошибка в /add: %s", e)
         await message.reply("Ошибка при обработке команды.")
 
-@router.message(Command("del"))
-async def admin_delete(message: Message, state: FSMContext):
+IMPORT_MAX_FILE_SIZE = 5 * 1024 * 1024
+
+@router.message(Command("import"))
+async def admin_import(message: Message, state: FSMContext):
+    """Массовое добавление проектов из CSV/JSON документа"""
     if not await is_user_admin(message.from_user.id): 
         return
-        
+    
+    await state.clear()
+    
+    # Документ можно прислать сразу с подписью /import
+    if message.document:
+        await admin_import_document(message, state)
+        return
+    
+    await state.set_state(ImportState.waiting_for_document)
+    await message.reply(
+        "<b>Импорт проектов</b>\n\n"
+        "Отправьте CSV или JSON документ.\n"
+        "CSV: <code>категория,название,описание[,photo_file_id]</code> (заголовок необязателен)\n"
+        "JSON: <code>[{\"category\": ..., \"name\": ..., \"description\": ...}]</code>\n\n"
+        "Файл проверяется целиком: при любой ошибке в файле ничего не добавляется.",
+        parse_mode="HTML"
+    )
+
+@router.message(ImportState.waiting_for_document, F.document)
+async def admin_import_document(message: Message, state: FSMContext):
+    """Проверка и импорт присланного документа"""
     await state.clear()
+    # Состояние могло остаться с тех пор, как у пользователя были права админа
+    if not await is_user_admin(message.from_user.id):
+        return
+    document = message.document
+    
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.reply("Файл слишком большой (максимум 5 МБ).")
+        return
     
     try:
-        if len(message.text.split()) < 2:
-            await message.reply("Укажите название проекта для удаления.")
+        content = (await bot.download(document)).read()
+        rows = parse_import_document(content, document.file_name or "import.csv")
+    except Exception as e:
+        logging.error("Ошибка чтения файла импорта: %s", e)
+        await message.reply("Не удалось прочитать файл. Проверьте формат CSV/JSON.")
+        return
+    
+    if not rows:
+        await message.reply("В файле нет проектов.")
+        return
+    
+    try:
+        errors = validate_import_rows(supabase, rows, CATEGORIES)
+        if errors:
+            text = f"<b>Импорт отменен:</b> найдено ошибок: {len(errors)}\n\n"
+            text += "\n".join(escape(error) for error in errors[:20])
+            if len(errors) > 20:
+                text += f"\n... и еще {len(errors) - 20}"
+            await message.reply(text, parse_mode="HTML")
             return
         
-        name = message.text.split(maxsplit=1)[1].strip()
+        try:
+            created = import_projects(supabase, rows, message.from_user.id, message.from_user.username)
+            failure = None
+        except PartialImportError as e:
+            # Часть проектов уже добавлена: учитываем их в счетчиках и логе
+            created, failure = e.created, e.error
+            logging.error("Импорт прерван после %s из %s проектов: %s", len(created), len(rows), failure)
+        
+        by_category = {}
+        for p in created:
+            category_counters.add_project(p['category'], 0)
+            by_category[p['category']] = by_category.get(p['category'], 0) + 1
+        stats_snapshot.invalidate()
+        
+        categories_text = "\n".join(
+            f"• {escape(CATEGORIES.get(cat, cat))}: {count}" for cat, count in by_category.items()
+        )
+        status = f"Добавлено: <b>{len(created)}</b>"
+        if failure:
+            status = f"<b>Импорт прерван ошибкой.</b> Добавлено: <b>{len(created)}</b> из {len(rows)}"
+        
+        # Один сводный лог вместо лога на каждый проект
+        log_text = (f"<b>Импорт проектов:</b>\n\n"
+                   f"{status}\n"
+                   f"{categories_text}\n"
+                   f"Файл: {escape(document.file_name or '')}\n"
+                   f"Админ: @{message.from_user.username or message.from_user.id}")
         
-        # Ищем проект по названию
-        project = await find_project_by_name(name)
-        if not project:
-            name_escaped = escape(name)
-            await message.reply(f"Проект <b>{name_escaped}</b> не найден!", parse_mode="HTML")
+        await send_log_to_topics(log_text)
+        
+        if failure:
+            await message.reply(
+                f"{status}\n{categories_text}\n\n"
+                "Остальные проекты не добавлены. Уберите добавленные из файла и повторите импорт.",
+                parse_mode="HTML"
+            )
             return
         
-        project_id = project['id']
-        category = project['category']
-        score = project['score']
+        await message.reply(
+            f"Импорт завершен! Добавлено проектов: <b>{len(created)}</b>\n{categories_text}",
+            parse_mode="HTML"
+        )
         
-        # Считаем сколько отзывов удаляем
-        reviews_count = supabase.table("user_logs").select("*").eq("project_id", project_id).execute()
-        reviews_num = len(reviews_count.data) if reviews_count.data else 0
+    except Exception as e:
+        logging.error("Ошибка в /import: %s", e)
+        await message.reply("Ошибка при импорте проектов.")
+
+@router.message(ImportState.waiting_for_document)
+async def admin_import_wrong_input(message: Message, state: FSMContext):
+    """Ожидался документ"""
+    if message.text and message.text.startswith("/"):
+        await state.clear()
+        return
+    await message.reply("Пожалуйста, отправьте CSV или JSON документ.")
+
+def parse_names_list(raw: str) -> list:
+    """Названия проектов, разделенные переносом строки или ';'"""
+    names = []
+    for line in raw.replace(";", "\n").split("\n"):
+        name = line.strip()
+        if name and name not in names:
+            names.append(name)
+    return names
+
+@router.message(Command("del"))
+async def admin_delete(message: Message, state: FSMContext):
+    if not await is_user_admin(message.from_user.id): 
+        return
         
-        # Добавляем запись в историю
-        supabase.table("rating_history").insert({
-            "project_id": project_id,
-            "admin_id": message.from_user.id,
-            "admin_username": message.from_user.username,
-            "change_type": "delete",
-            "score_before": score,
-            "score_after": 0,
-            "change_amount": -score,
-            "reason": "Удаление проекта",
-            "is_admin_action": True
-        }).execute()
+    await state.clear()
+    
+    try:
+        if len(message.text.split()) < 2:
+            await message.reply(
+                "Укажите точное название проекта для удаления.\n"
+                "Несколько проектов — через <code>;</code> или с новой строки.",
+                parse_mode="HTML"
+            )
+            return
         
-        # Удаление проекта и связанных отзывов
-        supabase.table("projects").delete().eq("id", project_id).execute()
-        supabase.table("user_logs").delete().eq("project_id", project_id).execute()
-        supabase.table("rating_history").delete().eq("project_id", project_id).execute()
-        supabase.table("project_photos").delete().eq("project_id", project_id).execute()
+        names = parse_names_list(message.text.split(maxsplit=1)[1])
+        
+        # Только точные названия: поиск по части названия может задеть чужие проекты
+        projects = find_projects_by_exact_names(supabase, names)
+        not_found = [name for name in names if name not in projects]
+        
+        if not_found:
+            text = "<b>Ничего не удалено.</b> Нет проектов с точным названием:\n"
+            for name in not_found:
+                similar = await find_project_by_name(name)
+                text += f"• {escape(name)}"
+                if similar:
+                    text += f" (возможно, <b>{escape(str(similar['name']))}</b>)"
+                text += "\n"
+            text += "\nУкажите названия полностью и повторите команду."
+            await message.reply(text, parse_mode="HTML")
+            return
         
-        # Отправляем лог
-        project_name_escaped = escape(str(project['name']))
-        log_text = (f"<b>Проект удален:</b>\n\n"
-                   f"Название: <b>{project_name_escaped}</b>\n"
-                   f"Категория: <code>{category}</code>\n"
-                   f"Удалено отзывов: {reviews_num}\n"
-                   f"Финальный рейтинг: {score}\n"
-                   f"Админ: @{message.from_user.username or message.from_user.id}")
+        # Удаление проектов и связанных отзывов, истории и фото одной операцией
+        result = delete_projects_cascade(supabase, [p['id'] for p in projects.values()])
+        deleted = result['projects']
+        
+        for p in deleted:
+            category_counters.remove_project(p['category'], p['score'])
+        stats_snapshot.invalidate()
+        
+        # Отправляем лог (по одному на категорию)
+        by_category = {}
+        for p in deleted:
+            by_category.setdefault(p['category'], []).append(p)
+        
+        for category, items in by_category.items():
+            log_text = f"<b>{'Проект удален' if len(items) == 1 else 'Проекты удалены'}:</b>\n\n"
+            for p in items:
+                log_text += (f"Название: <b>{escape(str(p['name']))}</b>\n"
+                             f"Категория: <code>{category}</code>\n"
+                             f"Удалено отзывов: {p['reviews']}\n"
+                             f"Финальный рейтинг: {p['score']}\n\n")
+            log_text += f"Админ: @{message.from_user.username or message.from_user.id}"
+            
+            await send_log_to_topics(log_text, category)
         
-        await send_log_to_topics(log_text, category)
+        text = f"Удалено проектов: <b>{len(deleted)}</b>\n"
+        for p in deleted:
+            text += f"• <b>{escape(str(p['name']))}</b> — отзывов: {p['reviews']}, рейтинг: {p['score']}\n"
+        text += f"Удалено записей истории: {result['history']}"
         
-        await message.reply(
-            f"Проект <b>{project_name_escaped}</b> удален!\n"
-            f"Удалено отзывов: {reviews_num}\n"
-            f"Финальный рейтинг: {score}",
-            parse_mode="HTML"
-        )
+        await message.reply(text, parse_mode="HTML")
         
     except Exception as e:
-        logging.error(f"Ошибка в /del: {e}")
+        logging.error("Ошибка в /del: %s", e)
         await message.reply("Ошибка при удалении проекта.")
 
 @router.message(Command("score"))
@@ -2010,7 +2324,7 @@ async def admin_score(message: Message, state: FSMContext):
         )
             
     except Exception as e:
-        logging.error(f"Ошибка в /score: {e}")
+        logging.error("Ошибка в /score: %s", e)
         await message.reply("Ошибка при обработке команды.")
 
 @router.message(AdminScoreState.waiting_for_reason)
@@ -2037,6 +2351,7 @@ async def admin_score_reason(message: Message, state: FSMContext):
         
         # Обновляем рейтинг проекта
         supabase.table("projects").update({"score": new_score}).eq("id", project_id).execute()
+        category_counters.apply_score_change(category, change_amount)
         
         # Добавляем запись в историю
         supabase.table("rating_history").insert({
@@ -2076,11 +2391,106 @@ async def admin_score_reason(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        logging.error(f"Ошибка в обработке причины: {e}")
+        logging.error("Ошибка в обработке причины: %s", e)
         await message.reply("Ошибка при сохранении изменений.")
     
     await state.clear()
 
+@router.message(Command("scorebatch"))
+async def admin_score_batch(message: Message, state: FSMContext):
+    """Изменить рейтинг нескольких проектов с общей причиной"""
+    if not await is_user_admin(message.from_user.id): 
+        return
+    
+    await state.clear()
+    
+    usage = (
+        "Неверный формат. Используйте:\n"
+        "<code>/scorebatch Причина\n"
+        "Название проекта | число\n"
+        "Название проекта | число</code>\n\n"
+        "Пример:\n<code>/scorebatch Итоги сезона\nБот Помощи | +10\nКанал Лотов | -5</code>"
+    )
+    
+    lines = [line.strip() for line in message.text.split("\n")]
+    reason = lines[0].split(maxsplit=1)[1].strip() if len(lines[0].split(maxsplit=1)) > 1 else ""
+    
+    if not reason or len(lines) < 2:
+        await message.reply(usage, parse_mode="HTML")
+        return
+    
+    changes_by_name = {}
+    errors = []
+    for line in lines[1:]:
+        if not line:
+            continue
+        parts = line.rsplit("|", 1)
+        if len(parts) < 2:
+            errors.append(f"нет '|': {line}")
+            continue
+        name, val_str = parts[0].strip(), parts[1].strip()
+        try:
+            changes_by_name[name] = changes_by_name.get(name, 0) + int(val_str)
+        except ValueError:
+            errors.append(f"не число: {line}")
+    
+    if errors or not changes_by_name:
+        text = usage
+        if errors:
+            text = "<b>Ошибки в строках:</b>\n" + "\n".join(escape(e) for e in errors[:20])
+        await message.reply(text, parse_mode="HTML")
+        return
+    
+    try:
+        # Все названия — одним запросом (точное совпадение)
+        found = find_projects_by_exact_names(supabase, list(changes_by_name))
+        not_found = [name for name in changes_by_name if name not in found]
+        
+        if not_found:
+            await message.reply(
+                "<b>Изменения не применены.</b> Не найдены проекты:\n" +
+                "\n".join(f"• {escape(name)}" for name in not_found),
+                parse_mode="HTML"
+            )
+            return
+        
+        changes = {}
+        for name, amount in changes_by_name.items():
+            project_id = found[name]['id']
+            changes[project_id] = changes.get(project_id, 0) + amount
+        
+        results = apply_score_batch(
+            supabase, changes, reason, message.from_user.id, message.from_user.username
+        )
+        
+        for r in results:
+            category_counters.apply_score_change(r['category'], r['change_amount'])
+        stats_snapshot.invalidate()
+        
+        reason_escaped = escape(reason)
+        digest = ""
+        for r in results:
+            change_symbol = "↑" if r['change_amount'] > 0 else "↓" if r['change_amount'] < 0 else "→"
+            digest += (f"{change_symbol} <b>{escape(str(r['name']))}</b>: "
+                       f"{r['score_before']} → {r['score_after']} ({r['change_amount']:+d})\n")
+        
+        # Один сводный лог на всю пачку
+        log_text = (f"<b>Пакетное изменение рейтинга:</b>\n\n"
+                   f"{digest}\n"
+                   f"Причина: <i>{reason_escaped}</i>\n"
+                   f"Админ: @{message.from_user.username or message.from_user.id}")
+        
+        await send_log_to_topics(log_text)
+        
+        await message.reply(
+            f"<b>Рейтинг изменен у проектов: {len(results)}</b>\n\n{digest}\nПричина: <i>{reason_escaped}</i>",
+            parse_mode="HTML"
+        )
+        
+    except Exception as e:
+        logging.error("Ошибка в /scorebatch: %s", e)
+        await message.reply("Ошибка при изменении рейтинга.")
+
 @router.message(Command("delrev"))
 async def admin_delrev(message: Message, state: FSMContext):
     if not await is_user_admin(message.from_user.id): 
@@ -2135,6 +2545,7 @@ async def admin_delrev(message: Message, state: FSMContext):
         
         # Обновляем рейтинг проекта
         supabase.table("projects").update({"score": new_score}).eq("id", rev['project_id']).execute()
+        category_counters.apply_score_change(project['category'], -rating_change)
         
         # Удаляем отзыв
         supabase.table("user_logs").delete().eq("id", log_id).execute()
@@ -2162,7 +2573,7 @@ async def admin_delrev(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        logging.error(f"Ошибка в /delrev: {e}")
+        logging.error("Ошибка в /delrev: %s", e)
         await message.reply("Ошибка при удалении отзыва.")
 
 # --- ВОССТАНОВЛЕННЫЕ АДМИН КОМАНДЫ ---
@@ -2232,7 +2643,7 @@ async def admin_edit_desc(message: Message):
         )
         
     except Exception as e:
-        logging.error(f"Ошибка в /editdesc: {e}")
+        logging.error("Ошибка в /editdesc: %s", e)
         await message.reply("Ошибка при изменении описания.")
 
 @router.message(Command("addphoto"))
@@ -2282,7 +2693,7 @@ async def admin_add_photo(message: Message, state: FSMContext):
         )
         
     except Exception as e:
-        logging.error(f"Ошибка в /addphoto: {e}")
+        logging.error("Ошибка в /addphoto: %s", e)
         await message.reply("Ошибка при обработке команды.")
 
 @router.message(EditProjectState.waiting_for_photo, F.photo)
@@ -2362,33 +2773,9 @@ async def admin_stats(message: Message):
         project_name_escaped = escape(str(project['name']))
         category_escaped = escape(str(project['category']))
         
-        # Получаем статистику
-        reviews_result = supabase.table("user_logs")\
-            .select("*")\
-            .eq("project_id", project['id'])\
-            .eq("action_type", "review")\
-            .execute()
-        
-        likes_result = supabase.table("user_logs")\
-            .select("*")\
-            .eq("project_id", project['id'])\
-            .eq("action_type", "like")\
-            .execute()
-        
-        history_result = supabase.table("rating_history")\
-            .select("*")\
-            .eq("project_id", project['id'])\
-            .execute()
-        
-        reviews = reviews_result.data if reviews_result.data else []
-        likes = likes_result.data if likes_result.data else []
-        history = history_result.data if history_result.data else []
-        
-        # Считаем среднюю оценку
-        avg_rating = 0
-        if reviews:
-            total_rating = sum([r['rating_val'] for r in reviews])
-            avg_rating = total_rating / len(reviews)
+        # Получаем статистику одним агрегирующим запросом
+        stats = project_stats(supabase, project['id'])
+        reviews_count = stats['reviews']
         
         text = f"<b>СТАТИСТИКА ПРОЕКТА</b>\n\n"
         text += f"<b>{project_name_escaped}</b>\n"
@@ -2397,21 +2784,19 @@ async def admin_stats(message: Message):
         text += f"Текущий рейтинг: <b>{project['score']}</b>\n"
         text += "-" * 20 + "\n"
         text += f"<b>Общая статистика:</b>\n"
-        text += f"• Отзывов: {len(reviews)}\n"
-        text += f"• Лайков: {len(likes)}\n"
-        text += f"• Средняя оценка: {avg_rating:.1f}/5\n"
-        text += f"• Всего изменений рейтинга: {len(history)}\n\n"
+        text += f"• Отзывов: {reviews_count}\n"
+        text += f"• Лайков: {stats['likes']}\n"
+        text += f"• Средняя оценка: {stats['avg_rating']:.1f}/5\n"
+        text += f"• Всего изменений рейтинга: {stats['history']}\n\n"
         
-        if reviews:
+        if reviews_count:
             # Распределение оценок
-            rating_dist = {1:0, 2:0, 3:0, 4:0, 5:0}
-            for r in reviews:
-                rating_dist[r['rating_val']] += 1
+            rating_dist = stats['distribution']
             
             text += f"<b>Распределение оценок:</b>\n"
             for rating in range(5, 0, -1):
                 count = rating_dist[rating]
-                percent = (count / len(reviews)) * 100 if reviews else 0
+                percent = (count / reviews_count) * 100
                 text += f"{'⭐' * rating}: {count} ({percent:.1f}%)\n"
         
         # Получаем фото проекта
@@ -2430,7 +2815,7 @@ async def admin_stats(message: Message):
             await message.reply(text, parse_mode="HTML")
         
     except Exception as e:
-        logging.error(f"Ошибка в /stats: {e}")
+        logging.error("Ошибка в /stats: %s", e)
         await message.reply("Ошибка при получении статистики.")
 
 @router.message(Command("list"))
@@ -2443,32 +2828,21 @@ async def admin_list_projects(message: Message):
         # Отправляем сообщение о загрузке
         loading_msg = await message.reply("Загружаем список проектов...")
         
-        # Получаем все проекты
-        projects = supabase.table("projects").select("*").order("score", desc=True).execute().data
+        # Снимок статистики: итоги, проекты и счетчики отзывов
+        snapshot = stats_snapshot.get(supabase)
+        projects, review_counts = await asyncio.to_thread(stats_snapshot.project_list, supabase)
         
         if not projects:
             await loading_msg.delete()
             await message.reply("Список проектов пуст.")
             return
         
-        # Получаем все отзывы одним запросом
-        all_reviews = supabase.table("user_logs")\
-            .select("project_id")\
-            .eq("action_type", "review")\
-            .execute().data
-        
-        # Создаем словарь: project_id -> количество отзывов
-        review_counts = {}
-        for review in all_reviews:
-            project_id = review['project_id']
-            review_counts[project_id] = review_counts.get(project_id, 0) + 1
-        
         # Удаляем сообщение о загрузке
         await loading_msg.delete()
         
         # Отправляем общую статистику
         total_projects = len(projects)
-        total_reviews = len(all_reviews)
+        total_reviews = snapshot['total_reviews']
         
         stats_text = (
             f"<b>ОБЩАЯ СТАТИСТИКА</b>\n\n"
@@ -2519,11 +2893,72 @@ async def admin_list_projects(message: Message):
                 await asyncio.sleep(0.5)
         
     except Exception as e:
-        logging.error(f"Ошибка в /list: {e}")
+        logging.error("Ошибка в /list: %s", e)
         await message.reply(
             f"Ошибка при получении списка проектов: {str(e)[:100]}"
         )
 
+# Предел Bot API на отправку файла ботом
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024
+
+@router.message(Command("export"))
+async def admin_export(message: Message):
+    """Выгрузка таблицы документом (NDJSON или CSV, опционально gzip)"""
+    if not await is_user_admin(message.from_user.id): 
+        return
+    
+    args = message.text.split()[1:]
+    tables_list = ", ".join([f"<code>{t}</code>" for t in EXPORT_TABLES])
+    
+    if not args or args[0] not in EXPORT_TABLES:
+        await message.reply(
+            "Неверный формат. Используйте:\n"
+            "<code>/export таблица [ndjson|csv] [gz]</code>\n\n"
+            f"Доступные таблицы: {tables_list}\n"
+            "Пример: <code>/export rating_history csv gz</code>",
+            parse_mode="HTML"
+        )
+        return
+    
+    table = args[0]
+    fmt = next((a for a in args[1:] if a in EXPORT_FORMATS), "ndjson")
+    compress = "gz" in args[1:] or "gzip" in args[1:]
+    filename = export_filename(table, fmt, compress)
+    
+    loading_msg = await message.reply("Готовим выгрузку...")
+    fd, path = tempfile.mkstemp(suffix=f"_{filename}")
+    os.close(fd)
+    
+    try:
+        # Выгрузка пишется в файл в отдельном потоке, чтобы не блокировать бота
+        size = await asyncio.to_thread(write_export, supabase, path, table, fmt, compress)
+        
+        if size > EXPORT_MAX_FILE_SIZE:
+            text = (f"Выгрузка <code>{table}</code> занимает {size // 1024 // 1024} МБ — "
+                    f"Telegram принимает от бота файлы до {EXPORT_MAX_FILE_SIZE // 1024 // 1024} МБ.\n\n")
+            if not compress:
+                text += f"Попробуйте со сжатием: <code>/export {table} {fmt} gz</code>\n"
+            text += ("Полную выгрузку отдает API:\n"
+                     f"<code>GET /api/admin/export/{table}?format={fmt}&amp;gzip=true</code>")
+            await message.reply(text, parse_mode="HTML")
+            return
+        
+        await message.reply_document(
+            FSInputFile(path, filename=filename),
+            caption=f"Выгрузка <code>{table}</code> ({size // 1024} КБ)",
+            parse_mode="HTML"
+        )
+        
+    except Exception as e:
+        logging.error("Ошибка в /export: %s", e)
+        await message.reply("Ошибка при выгрузке данных.")
+    finally:
+        os.remove(path)
+        try:
+            await loading_msg.delete()
+        except:
+            pass
+
 # --- КОМАНДЫ УПРАВЛЕНИЯ БАНОМ ---
 
 @router.message(Command("ban"))
@@ -2583,8 +3018,10 @@ async def admin_ban(message: Message):
         if result.data:
             # Отправляем лог
             reason_escaped = escape(reason)
+            profile = user_directory.lookup_many([user_id]).get(user_id)
             log_text = (f"<b>Пользователь забанен:</b>\n\n"
                        f"ID: <code>{user_id}</code>\n"
+                       f"Username: @{escape(user_directory.display_name(profile, user_id))}\n"
                        f"Причина: <i>{reason_escaped}</i>\n"
                        f"Админ: @{message.from_user.username or message.from_user.id}")
             
@@ -2600,7 +3037,7 @@ async def admin_ban(message: Message):
             await message.reply("Ошибка при добавлении в бан-лист.")
             
     except Exception as e:
-        logging.error(f"Ошибка в /ban: {e}")
+        logging.error("Ошибка в /ban: %s", e)
         await message.reply("Ошибка при выполнении команды.")
 
 @router.message(Command("unban"))
@@ -2648,8 +3085,10 @@ async def admin_unban(message: Message):
             .execute()
         
         # Отправляем лог
+        profile = user_directory.lookup_many([user_id]).get(user_id)
         log_text = (f"<b>Пользователь разбанен:</b>\n\n"
                    f"ID: <code>{user_id}</code>\n"
+                   f"Username: @{escape(user_directory.display_name(profile, user_id))}\n"
                    f"Админ: @{message.from_user.username or message.from_user.id}")
         
         await send_log_to_topics(log_text)
@@ -2657,7 +3096,7 @@ async def admin_unban(message: Message):
         await message.reply(f"Пользователь <code>{user_id}</code> разбанен!", parse_mode="HTML")
             
     except Exception as e:
-        logging.error(f"Ошибка в /unban: {e}")
+        logging.error("Ошибка в /unban: %s", e)
         await message.reply("Ошибка при выполнении команды.")
 
 @router.message(Command("banlist"))
@@ -2701,7 +3140,7 @@ async def admin_banlist(message: Message):
             await message.reply(text, parse_mode="HTML")
     
     except Exception as e:
-        logging.error(f"Ошибка в /banlist: {e}")
+        logging.error("Ошибка в /banlist: %s", e)
         await message.reply("Ошибка при получении списка банов.")
 
 @router.message(Command("mystatus"))
@@ -2749,7 +3188,7 @@ async def admin_find_user(message: Message):
         if len(message.text.split()) < 2:
             await message.reply(
                 "Неверный формат. Используйте:\n"
-                "<code>/finduser ID_пользователя</code>\n\n"
+                "<code>/finduser ID_пользователя или @username</code>\n\n"
                 "Пример: <code>/finduser 123456789</code>",
                 parse_mode="HTML"
             )
@@ -2759,58 +3198,335 @@ async def admin_find_user(message: Message):
         
         try:
             user_id = int(query)
-            # Ищем по ID в banned_users
-            ban_result = supabase.table("banned_users")\
-                .select("*")\
-                .eq("user_id", user_id)\
-                .execute()
+            profile = user_directory.lookup_many([user_id]).get(user_id)
         except ValueError:
-            # Если не число, ищем в логах
-            user_logs = supabase.table("user_logs")\
-                .select("user_id")\
-                .execute()
-            
-            # Это упрощенный поиск
-            user_id = None
-            ban_result = None
+            # Если не число, ищем по username в справочнике пользователей
+            profile = user_directory.find_by_username(query)
+            user_id = profile['user_id'] if profile else None
         
         text = f"<b>ПОИСК ПОЛЬЗОВАТЕЛЯ</b>\n\n"
         query_escaped = escape(query)
         text += f"Запрос: <code>{query_escaped}</code>\n"
         text += "-" * 20 + "\n"
         
-        if ban_result and ban_result.data:
-            ban = ban_result.data[0]
+        if not user_id:
+            text += "Пользователь не найден."
+            await message.reply(text, parse_mode="HTML")
+            return
+        
+        summary = user_activity_summary(supabase, user_id)
+        ban = summary.get('ban')
+        
+        if ban:
+            text += f"<b>СТАТУС: ЗАБАНЕН</b>\n\n"
+        else:
+            text += f"<b>СТАТУС: НЕ ЗАБАНЕН</b>\n\n"
+        
+        text += f"ID: <code>{user_id}</code>\n"
+        if profile and profile.get('username'):
+            text += f"Username: @{escape(profile['username'])}\n"
+        if profile and (profile.get('first_name') or profile.get('last_name')):
+            text += f"Имя: {escape(profile.get('first_name') or '')} {escape(profile.get('last_name') or '')}\n"
+        
+        text += f"\n<b>АКТИВНОСТЬ:</b>\n"
+        text += f"• Отзывов: <b>{summary['reviews']}</b>\n"
+        text += f"• Лайков: <b>{summary['likes']}</b>\n"
+        text += f"• Влияние за неделю: <code>{summary['impact_7d']:+d}</code>\n"
+        text += f"• Влияние за месяц: <code>{summary['impact_30d']:+d}</code>\n"
+        
+        if summary['recent']:
+            text += f"\n<b>ПОСЛЕДНИЕ ДЕЙСТВИЯ:</b>\n"
+            for i, activity in enumerate(summary['recent'], 1):
+                date = activity['created_at'][:10] if activity['created_at'] else ""
+                project = escape(str(activity.get('project_name') or f"ID {activity['project_id']}"))
+                reason = escape(str(activity['reason']))
+                change = activity['change_amount'] or 0
+                text += f"{i}. <code>{change:+d}</code> {project} — {reason[:30]} ({date})\n"
+        
+        text += "\n"
+        if ban:
             reason_escaped = escape(str(ban.get('reason', 'Не указана')))
             banned_by_escaped = escape(str(ban.get('banned_by_username', ban.get('banned_by', 'Неизвестно'))))
             
-            text += f"<b>СТАТУС: ЗАБАНЕН</b>\n\n"
-            text += f"ID: <code>{ban['user_id']}</code>\n"
-            text += f"Причина: <i>{reason_escaped}</i>\n"
+            text += f"Причина бана: <i>{reason_escaped}</i>\n"
             if ban.get('banned_at'):
                 text += f"Дата: {ban['banned_at'][:10]}\n"
             text += f"Админ: {banned_by_escaped}\n\n"
-            text += f"<i>Используйте</i> <code>/unban {ban['user_id']}</code> <i>для разблокировки</i>"
-        elif user_id:
-            text += f"<b>СТАТУС: НЕ ЗАБАНЕН</b>\n\n"
-            text += f"ID: <code>{user_id}</code>\n\n"
-            text += f"<i>Используйте</i> <code>/ban {user_id} причина</code> <i>для блокировки</i>"
+            text += f"<i>Используйте</i> <code>/unban {user_id}</code> <i>для разблокировки</i>"
         else:
-            text += "Пользователь не найден."
+            text += f"<i>Используйте</i> <code>/ban {user_id} причина</code> <i>для блокировки</i>"
         
         await message.reply(text, parse_mode="HTML")
         
     except Exception as e:
-        logging.error(f"Ошибка в /finduser: {e}")
+        logging.error("Ошибка в /finduser: %s", e)
         await message.reply("Ошибка при поиске пользователя.")
 
+# --- ДИАГНОСТИКА ---
+@router.message(Command("looplag"))
+async def admin_loop_lag(message: Message):
+    """Задержка event loop и места, где его блокирует синхронный код"""
+    if not await is_user_admin(message.from_user.id):
+        return
+
+    if not loop_watchdog:
+        await message.reply("Сторож event loop выключен (LOOP_LAG_THRESHOLD_MS=0).")
+        return
+
+    if message.text.split()[1:] == ["reset"]:
+        loop_watchdog.reset()
+        await message.reply("Статистика блокировок сброшена.")
+        return
+
+    report = loop_watchdog.snapshot(top=10)
+    since = datetime.fromtimestamp(report['since']).strftime('%d.%m %H:%M')
+    text = f"<b>ЗАДЕРЖКА EVENT LOOP</b> (с {since})\n\n"
+    text += f"p50: <b>{report['lag_p50_ms']}</b> мс, p99: <b>{report['lag_p99_ms']}</b> мс, max: {report['lag_max_ms']} мс\n"
+    text += f"Блокировок дольше {report['threshold_ms']:g} мс: <b>{report['stalls']}</b>, "
+    text += f"самая долгая: {report['longest_stall_ms']} мс\n"
+    text += f"Всего заблокировано: {report['blocked_ms']} мс\n"
+
+    if report['sites']:
+        text += "\n<b>Места блокировок:</b>\n"
+        for i, site in enumerate(report['sites'], 1):
+            text += f"{i}. <code>{escape(site['site'])}</code>\n"
+            text += f"   {site['blocked_ms']} мс, замеров: {site['samples']}\n"
+    else:
+        text += "\nБлокировок не обнаружено."
+
+    text += "\n<code>/looplag reset</code> — сбросить статистику"
+    await message.reply(text, parse_mode="HTML")
+
+@router.message(Command("queryaudit"))
+async def admin_query_audit(message: Message):
+    """Запросы к базе по обработчикам: сколько на апдейт, повторы и N+1"""
+    if not await is_user_admin(message.from_user.id):
+        return
+
+    if not query_auditor:
+        await message.reply("Аудит запросов выключен (QUERY_AUDIT_SAMPLE=0).")
+        return
+
+    if message.text.split()[1:] == ["reset"]:
+        query_auditor.reset()
+        await message.reply("Статистика аудита запросов сброшена.")
+        return
+
+    rows = query_auditor.snapshot(top=2)
+    if not rows:
+        await message.reply("Пока нет проверенных апдейтов.")
+        return
+
+    text = f"<b>АУДИТ ЗАПРОСОВ</b> (доля апдейтов: {query_auditor.sample:g})\n\n"
+    for row in rows:
+        block = f"<b>{escape(row['handler'])}</b>: {row['round_trips']} запр./апд. (max {row['max_round_trips']}), "
+        block += f"повторов {row['duplicates']}, {row['db_ms']} мс, апдейтов {row['updates']}\n"
+        for finding in row['findings']:
+            block += f"   {finding['kind']}: <code>{escape(finding['query'][:150])}</code>\n"
+        # Одно сообщение: самые «тяжелые» обработчики идут первыми
+        if len(text) + len(block) > 3800:
+            break
+        text += block
+
+    text += "\n<code>/queryaudit reset</code> — сбросить статистику"
+    await message.reply(text, parse_mode="HTML")
+
+@router.message(Command("profile"))
+async def admin_profile(message: Message):
+    """Сэмплирующий профилировщик на N секунд: collapsed-стеки и сводка документами"""
+    if not await is_user_admin(message.from_user.id):
+        return
+
+    args = message.text.split()[1:]
+    if args and not args[0].isdigit():
+        await message.reply(
+            "Используйте: <code>/profile [секунд]</code> (по умолчанию 10, максимум "
+            f"{PROFILE_MAX_SECONDS})",
+            parse_mode="HTML"
+        )
+        return
+    seconds = min(max(int(args[0]) if args else 10, 1), PROFILE_MAX_SECONDS)
+
+    try:
+        loading_msg = await message.reply(f"Профилирование {seconds} с... Бот продолжает работать.")
+        result = await profiler.profile(seconds)
+    except ProfilerBusy:
+        await message.reply("Профилирование уже идет, дождитесь результата.")
+        return
+
+    try:
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        own, _ = result.top(limit=3)
+        top_lines = "\n".join(f"• <code>{escape(label)}</code>: {count}" for label, count in own)
+        await message.reply_document(
+            BufferedInputFile(result.collapsed().encode(), filename=f"profile-{stamp}.collapsed.txt"),
+            caption=(
+                f"Профиль за {result.duration:.0f} с, замеров: {result.samples}\n"
+                f"Flame graph: flamegraph.pl или speedscope.app\n\n{top_lines}"
+            )[:1000],
+            parse_mode="HTML"
+        )
+        await message.reply_document(
+            BufferedInputFile(result.summary().encode(), filename=f"profile-{stamp}.top.txt"),
+            caption="Самые затратные функции"
+        )
+    except Exception as e:
+        logging.error("Ошибка в /profile: %s", e)
+        await message.reply("Ошибка при отправке профиля.")
+    finally:
+        try:
+            await loading_msg.delete()
+        except:
+            pass
+
+def format_memory_report(report: dict) -> str:
+    since = datetime.fromtimestamp(report['since']).strftime('%d.%m %H:%M')
+    text = f"RSS: <b>{report['rss_mb']}</b> МБ ({report['rss_growth_mb']:+} МБ с {since})\n"
+    if memory_monitor.tracing:
+        text += f"tracemalloc: {report['traced_mb']} МБ, пик {report['traced_peak_mb']} МБ\n"
+    text += f"Незавершенных задач: <b>{report['tasks']}</b>\n"
+    if report['cleaned']:
+        text += f"Удалено пустых записей FSM: {report['cleaned']}\n"
+
+    text += "\n<b>Кеши и хранилища (записей):</b>\n"
+    for source in report['sources']:
+        text += f"• {source['name']}: {source['size']} ({source['growth']:+})\n"
+
+    if report['task_groups']:
+        text += "\n<b>Задачи:</b>\n"
+        for name, count in report['task_groups']:
+            text += f"• <code>{escape(name)}</code>: {count}\n"
+
+    if report['growth']:
+        text += "\n<b>Рост аллокаций по строкам:</b>\n"
+        for i, site in enumerate(report['growth'], 1):
+            text += f"{i}. <code>{escape(site['site'])}</code>: +{site['growth_kb']} КБ "
+            text += f"(+{site['count_growth']} объектов, всего {site['size_kb']} КБ)\n"
+    elif not memory_monitor.tracing:
+        text += "\ntracemalloc выключен (включается MEMORY_TRACE_FRAMES=1).\n"
+    return text
+
+async def alert_memory_growth(report: dict):
+    """Оповещение в топик логов о росте памяти сверх бюджета"""
+    text = "⚠️ <b>РОСТ ПАМЯТИ</b>\n\n"
+    text += "\n".join(f"• {escape(alert)}" for alert in report['alerts']) + "\n\n"
+    dispatch_log(text + format_memory_report(report)[:3000])
+
+@router.message(Command("memreport"))
+async def admin_memory_report(message: Message):
+    """Память: RSS, кеши, FSM, задачи и рост аллокаций с базовой точки"""
+    if not await is_user_admin(message.from_user.id):
+        return
+
+    if message.text.split()[1:] == ["reset"]:
+        await memory_monitor.reset()
+        await message.reply("Базовая точка памяти обновлена.")
+        return
+
+    try:
+        report = await memory_monitor.check()
+        text = "<b>ПАМЯТЬ</b>\n\n" + format_memory_report(report)
+        if report['alerts']:
+            text += "\n<b>Превышен бюджет:</b>\n" + "\n".join(f"• {escape(alert)}" for alert in report['alerts']) + "\n"
+        text += "\n<code>/memreport reset</code> — новая базовая точка"
+        await message.reply(text[:4000], parse_mode="HTML")
+    except Exception as e:
+        logging.error("Ошибка в /memreport: %s", e)
+        await message.reply("Ошибка при сборе отчета о памяти.")
+
 # --- ЗАПУСК БОТА ---
-async def main():
-    logging.basicConfig(level=logging.INFO)
+def setup_dispatcher():
+    """Подключить middleware и роутер к диспетчеру (повторный вызов ничего не делает)"""
+    global update_recorder
+    if router.parent_router is not None:
+        return
+    if tracer.enabled:
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+        router.message.middleware(TracingHandlerMiddleware(tracer))
+        router.callback_query.middleware(TracingHandlerMiddleware(tracer))
+        bot.session.middleware(TracingRequestMiddleware(tracer))
+    if RECORD_UPDATES_DIR:
+        # Кнопки меню пишутся как есть, остальной текст маскируется
+        update_recorder = UpdateRecorder(
+            RECORD_UPDATES_DIR,
+            keep_texts=[button.text for row in main_kb().keyboard + cancel_kb().keyboard + back_to_menu_kb().keyboard for button in row],
+            salt=os.getenv("RECORD_UPDATES_SALT"),
+            max_bytes=int(os.getenv("RECORD_UPDATES_MAX_MB", 20)) * 1024 * 1024,
+            backup_count=int(os.getenv("RECORD_UPDATES_FILES", 10))
+        )
+        dp.update.outer_middleware(UpdateRecorderMiddleware(update_recorder))
+    dp.update.outer_middleware(LogContextMiddleware())
+    if query_auditor:
+        dp.update.outer_middleware(QueryAuditMiddleware(query_auditor))
+        router.message.middleware(QueryAuditHandlerMiddleware())
+        router.callback_query.middleware(QueryAuditHandlerMiddleware())
+    dp.update.outer_middleware(UserProfileMiddleware(user_directory))
     dp.update.outer_middleware(AccessMiddleware())
     dp.include_router(router)
+
+async def on_startup():
+    """Загрузка счетчиков и справочников, запуск фоновых задач"""
+    if referral_codes is None:
+        message = "Не задан REFERRAL_SECRET — ключ для реферальных кодов (см. README.md)"
+        logging.critical(message)
+        raise SystemExit(message)
+    await asyncio.to_thread(category_counters.try_load, supabase)
+    # Без карты сохраненных кодов они расшифровывались бы как вычисленные — запуск прерывается
+    try:
+        referral_codes.load_legacy(supabase)
+    except Exception as e:
+        logging.critical("Ошибка загрузки реферальных кодов: %s", e)
+        raise
+    await get_bot_username()
+    asyncio.create_task(user_directory.run_flusher())
+    asyncio.create_task(category_counters.run_refresher(supabase))
+    if update_recorder:
+        asyncio.create_task(update_recorder.run_flusher())
+    if loop_watchdog:
+        loop_watchdog.start()
+    if tracer.enabled:
+        asyncio.create_task(tracer.exporter.run_flusher())
+    await start_memory_monitor()
+
+async def start_memory_monitor():
+    """Базовая точка памяти и проверка по расписанию"""
+    global memory_monitor
+    memory_monitor = MemoryMonitor(
+        {
+            "fsm": lambda: len(storage.storage),
+            "referral_summaries": lambda: len(referral_summaries),
+            "user_profiles": lambda: len(user_profiles),
+            "user_directory": lambda: len(user_directory),
+            "user_directory_usernames": lambda: user_directory.indexed_usernames,
+            "user_directory_pending": lambda: user_directory.pending,
+            "referral_codes": lambda: len(referral_codes),
+            "category_counters": lambda: len(category_counters),
+            "log_queue": log_queue.qsize
+        },
+        budget_mb=MEMORY_BUDGET_MB,
+        entries_budget=MEMORY_ENTRIES_BUDGET,
+        tasks_budget=MEMORY_TASKS_BUDGET,
+        trace_frames=MEMORY_TRACE_FRAMES,
+        alert=alert_memory_growth,
+        # MemoryStorage хранит запись каждого, кто хоть раз открыл FSM, — пустые удаляем
+        cleanup=lambda: prune_fsm(storage)
+    )
+    await memory_monitor.start()
+    if MEMORY_CHECK_INTERVAL > 0:
+        asyncio.create_task(memory_monitor.run(MEMORY_CHECK_INTERVAL))
+
+async def main():
+    setup_logging("bot")
+    setup_dispatcher()
+    await on_startup()
     await bot.delete_webhook(drop_pending_updates=True)
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(bot)
+    finally:
+        if update_recorder:
+            await update_recorder.flush()
+        if tracer.enabled:
+            await tracer.exporter.flush()
 
 if __name__ == "__main__":
     asyncio.run(main())
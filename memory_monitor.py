@@ -0,0 +1,206 @@
+import asyncio
+import logging
+import os
+import resource
+import time
+import tracemalloc
+from collections import Counter
+
+# Служебные аллокации, которые не относятся к боту
+TRACE_FILTERS = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>")
+)
+
+
+def rss_bytes() -> int:
+    """Текущий RSS процесса (на Linux — из /proc, иначе пиковый из getrusage)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS отдает байты, Linux — килобайты
+        return peak if peak > 1 << 32 else peak * 1024
+
+
+def _site(frame) -> str:
+    parts = frame.filename.replace("\\", "/").split("/")
+    return f"{'/'.join(parts[-2:])}:{frame.lineno}"
+
+
+def task_name(task) -> str:
+    """Имя корутины задачи (для группировки незавершенных задач)"""
+    coro = task.get_coro()
+    return getattr(coro, "__qualname__", None) or type(coro).__name__
+
+
+def prune_fsm(storage) -> int:
+    """Удалить пустые записи MemoryStorage (без состояния и данных)
+
+    get_state() у defaultdict создает запись для каждого пользователя, даже если
+    сценарий не начат, и записи не удаляются никогда. Пустую запись storage
+    создаст заново при следующем обращении, поэтому удалять ее безопасно.
+    """
+    records = storage.storage
+    empty = [key for key, record in records.items() if record.state is None and not record.data]
+    for key in empty:
+        records.pop(key, None)
+    return len(empty)
+
+
+class MemoryMonitor:
+    """Рост памяти: RSS, tracemalloc по строкам кода, размеры кешей и число задач
+
+    Источники — словарь «имя → функция, возвращающая число записей» (кеши,
+    FSM, очереди). Каждая проверка сравнивается с базовой точкой (запуск или
+    reset()): если RSS вырос больше budget_mb, источник — больше чем на
+    entries_budget записей, или незавершенных задач больше tasks_budget,
+    вызывается корутина alert(report). Повторное оповещение — только после роста еще на
+    один бюджет, чтобы не засыпать топик одним и тем же. cleanup — очистка
+    перед каждой проверкой (например, prune_fsm), возвращает число удаленных записей.
+    """
+
+    def __init__(self, sources: dict, budget_mb: float = 100, entries_budget: int = 50000,
+                 tasks_budget: int = 1000, trace_frames: int = 0, alert=None, cleanup=None):
+        self.sources = sources
+        self.budget_mb = budget_mb
+        self.entries_budget = entries_budget
+        self.tasks_budget = tasks_budget
+        self.trace_frames = trace_frames
+        self.alert = alert
+        self.cleanup = cleanup
+        self.cleaned = 0
+        self.checks = 0
+        self.last = None
+        self._baseline = None
+        self._alerted = {}
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    async def start(self):
+        """Включить tracemalloc (если trace_frames > 0) и запомнить базовую точку"""
+        if self.trace_frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(self.trace_frames)
+        await self.reset()
+
+    async def reset(self):
+        snapshot = await asyncio.to_thread(self._take_snapshot) if self.tracing else None
+        self._baseline = {
+            "time": time.time(),
+            "rss": rss_bytes(),
+            "sources": self._sizes(),
+            "snapshot": snapshot
+        }
+        self._alerted = {}
+
+    def _take_snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(TRACE_FILTERS)
+
+    def _sizes(self) -> dict:
+        sizes = {}
+        for name, size in self.sources.items():
+            try:
+                sizes[name] = size()
+            except Exception as e:
+                logging.error("Ошибка оценки размера %s: %s", name, e)
+        return sizes
+
+    def _growth(self, snapshot, top: int) -> list:
+        baseline = self._baseline["snapshot"]
+        if snapshot is None or baseline is None:
+            return []
+        stats = snapshot.compare_to(baseline, "lineno")
+        return [
+            {
+                "site": _site(stat.traceback[0]),
+                "size_kb": round(stat.size / 1024, 1),
+                "growth_kb": round(stat.size_diff / 1024, 1),
+                "count_growth": stat.count_diff
+            }
+            for stat in stats[:top] if stat.size_diff > 0
+        ]
+
+    async def check(self, top: int = 10) -> dict:
+        """Снять отчет, сравнить с базовой точкой и при превышении бюджета оповестить"""
+        if self._baseline is None:
+            await self.reset()
+        cleaned = 0
+        if self.cleanup:
+            try:
+                cleaned = self.cleanup()
+            except Exception as e:
+                logging.error("Ошибка очистки перед проверкой памяти: %s", e)
+        self.cleaned += cleaned
+        snapshot = await asyncio.to_thread(self._take_snapshot) if self.tracing else None
+        growth = await asyncio.to_thread(self._growth, snapshot, top)
+        snapshot = None
+
+        sizes = self._sizes()
+        baseline_sizes = self._baseline["sources"]
+        tasks = [task for task in asyncio.all_tasks() if not task.done()]
+        rss = rss_bytes()
+        traced, traced_peak = tracemalloc.get_traced_memory() if self.tracing else (0, 0)
+
+        report = {
+            "time": time.time(),
+            "since": self._baseline["time"],
+            "rss_mb": round(rss / 1024 / 1024, 1),
+            "rss_growth_mb": round((rss - self._baseline["rss"]) / 1024 / 1024, 1),
+            "traced_mb": round(traced / 1024 / 1024, 1),
+            "traced_peak_mb": round(traced_peak / 1024 / 1024, 1),
+            "sources": [
+                {"name": name, "size": size, "growth": size - baseline_sizes.get(name, 0)}
+                for name, size in sizes.items()
+            ],
+            "tasks": len(tasks),
+            "task_groups": Counter(task_name(task) for task in tasks).most_common(top),
+            "growth": growth,
+            "cleaned": cleaned
+        }
+        report["alerts"] = self._alerts(report)
+        self.checks += 1
+        self.last = report
+
+        if report["alerts"]:
+            logging.warning("Рост памяти: %s", "; ".join(report['alerts']))
+            if self.alert:
+                try:
+                    await self.alert(report)
+                except Exception as e:
+                    logging.error("Ошибка оповещения о памяти: %s", e)
+        return report
+
+    def _exceeded(self, key: str, value: float, budget: float) -> bool:
+        """Превышен ли бюджет с учетом уже отправленных оповещений (шагами по budget)"""
+        if budget <= 0 or value < budget:
+            return False
+        level = int(value // budget)
+        if level <= self._alerted.get(key, 0):
+            return False
+        self._alerted[key] = level
+        return True
+
+    def _alerts(self, report: dict) -> list:
+        alerts = []
+        if self._exceeded("rss", report["rss_growth_mb"], self.budget_mb):
+            alerts.append(f"RSS +{report['rss_growth_mb']} МБ (сейчас {report['rss_mb']} МБ)")
+        for source in report["sources"]:
+            if self._exceeded(f"source:{source['name']}", source["growth"], self.entries_budget):
+                alerts.append(f"{source['name']}: +{source['growth']} записей (всего {source['size']})")
+        if self._exceeded("tasks", report["tasks"], self.tasks_budget):
+            alerts.append(f"незавершенных задач: {report['tasks']}")
+        return alerts
+
+    async def run(self, interval: float):
+        """Проверка по расписанию (вызывать после start())"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check()
+            except Exception as e:
+                logging.error("Ошибка проверки памяти: %s", e)
@@ -0,0 +1,95 @@
+# Курсорная (keyset) пагинация
+
+from datetime import datetime, timedelta, timezone
+
+from db_utils import or_filter
+
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Повторный вызов order() в postgrest-py заменяет предыдущий, поэтому
+# порядок по двум колонкам передается одной строкой
+PROJECTS_ORDER = "score.desc,id"
+
+
+def _to_base36(value: int) -> str:
+    if value < 0:
+        return "-" + _to_base36(-value)
+    result = ""
+    while True:
+        value, rem = divmod(value, 36)
+        result = _DIGITS[rem] + result
+        if not value:
+            return result
+
+
+def encode_cursor(score: int, project_id: int) -> str:
+    """Компактный курсор вида '<score>.<id>' в base36 (без '_' для callback_data)"""
+    return f"{_to_base36(int(score))}.{_to_base36(int(project_id))}"
+
+
+def decode_cursor(cursor: str):
+    """Разобрать курсор, вернуть (score, id); ValueError при неверном формате"""
+    score, project_id = cursor.split(".")
+    return int(score, 36), int(project_id, 36)
+
+
+def after_cursor(query, cursor: str):
+    """Добавить к запросу условие «строго после курсора» в порядке score desc, id asc"""
+    score, project_id = decode_cursor(cursor)
+    return or_filter(query, f"score.lt.{score},and(score.eq.{score},id.gt.{project_id})")
+
+
+def fetch_projects_page(query, cursor: str = None, limit: int = 5):
+    """Страница проектов после курсора; возвращает (rows, next_cursor)
+
+    Берется limit + 1 строка, чтобы узнать о следующей странице без count.
+    Стоимость не зависит от глубины страницы.
+    """
+    if cursor:
+        query = after_cursor(query, cursor)
+
+    rows = query.order(PROJECTS_ORDER).limit(limit + 1).execute().data or []
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['score'], rows[-1]['id'])
+
+    return rows, next_cursor
+
+
+def encode_time_cursor(timestamp: str, row_id: int) -> str:
+    """Курсор по (время, id): микросекунды от эпохи и id в base36"""
+    moment = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    micros = (moment - _EPOCH) // timedelta(microseconds=1)
+    return f"{_to_base36(micros)}.{_to_base36(int(row_id))}"
+
+
+def decode_time_cursor(cursor: str):
+    """Разобрать курсор, вернуть (ISO-время в UTC, id); ValueError при неверном формате"""
+    micros, row_id = cursor.split(".")
+    moment = _EPOCH + timedelta(microseconds=int(micros, 36))
+    return moment.isoformat(timespec="microseconds"), int(row_id, 36)
+
+
+def fetch_newest_page(query, time_column: str, id_column: str, cursor: str = None, limit: int = 10):
+    """Страница «сначала новые» по (time_column desc, id_column desc); возвращает (rows, next_cursor)"""
+    if cursor:
+        timestamp, row_id = decode_time_cursor(cursor)
+        query = or_filter(
+            query,
+            f'{time_column}.lt."{timestamp}",'
+            f'and({time_column}.eq."{timestamp}",{id_column}.lt.{row_id})'
+        )
+
+    rows = query.order(f"{time_column}.desc,{id_column}.desc").limit(limit + 1).execute().data or []
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_time_cursor(rows[-1][time_column], rows[-1][id_column])
+
+    return rows, next_cursor
@@ -0,0 +1,230 @@
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+
+# Разбор фильтров PostgREST (col=op.value, or=(...), and=(...)) в дерево условий
+
+OPERATORS = ("eq", "neq", "gt", "gte", "lt", "lte", "like", "ilike", "in", "is")
+RESERVED_PARAMS = ("select", "order", "limit", "offset", "on_conflict", "columns")
+
+_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+
+
+class Condition:
+    """Условие на одну колонку: column op value (с отрицанием not.)"""
+
+    __slots__ = ("column", "op", "value", "negate")
+
+    def __init__(self, column: str, op: str, value, negate: bool = False):
+        if op not in OPERATORS:
+            raise ValueError(f"Неподдерживаемый оператор фильтра: {op}")
+        self.column = column
+        self.op = op
+        self.value = value
+        self.negate = negate
+
+    def matches(self, row: dict) -> bool:
+        return _compare(self.op, row.get(self.column), self.value) != self.negate
+
+    def __repr__(self):
+        return f"{'not.' if self.negate else ''}{self.column}.{self.op}.{self.value}"
+
+
+class Logic:
+    """Группа условий and(...) / or(...)"""
+
+    __slots__ = ("kind", "items", "negate")
+
+    def __init__(self, kind: str, items: list, negate: bool = False):
+        self.kind = kind
+        self.items = items
+        self.negate = negate
+
+    def matches(self, row: dict) -> bool:
+        check = all if self.kind == "and" else any
+        return check(item.matches(row) for item in self.items) != self.negate
+
+    def __repr__(self):
+        return f"{'not.' if self.negate else ''}{self.kind}({','.join(map(repr, self.items))})"
+
+
+def parse_params(params) -> list:
+    """Фильтры из пар (ключ, значение) строки запроса, служебные параметры пропускаются"""
+    filters = []
+    for key, value in params:
+        if key in RESERVED_PARAMS:
+            continue
+        if key in ("or", "and", "not.or", "not.and"):
+            negate = key.startswith("not.")
+            filters.append(_parse_group(key.rsplit(".", 1)[-1], value, negate))
+        else:
+            filters.append(parse_filter(key, value))
+    return filters
+
+
+def parse_filter(column: str, expr: str) -> Condition:
+    """column + "op.value" или "not.op.value" """
+    negate = False
+    if expr.startswith("not."):
+        negate = True
+        expr = expr[len("not."):]
+    op, _, raw = expr.partition(".")
+    if op == "in":
+        value = [unquote(item) for item in split_top(raw.strip()[1:-1])]
+    else:
+        value = unquote(raw)
+    return Condition(column, op, value, negate)
+
+
+def parse_logic(expr: str, kind: str = "or") -> Logic:
+    """Тело or_(...): "a.eq.1,and(b.gt.2,c.is.null)" """
+    return Logic(kind, [_parse_item(item) for item in split_top(expr)])
+
+
+def _parse_group(kind: str, value: str, negate: bool) -> Logic:
+    value = value.strip()
+    if not (value.startswith("(") and value.endswith(")")):
+        raise ValueError(f"Ожидалась группа в скобках: {value}")
+    group = parse_logic(value[1:-1], kind)
+    group.negate = negate
+    return group
+
+
+def _parse_item(item: str):
+    item = item.strip()
+    for kind in ("and", "or", "not.and", "not.or"):
+        if item.startswith(kind + "("):
+            return _parse_group(kind.rsplit(".", 1)[-1], item[len(kind):], kind.startswith("not."))
+    column, _, expr = item.partition(".")
+    if not expr:
+        raise ValueError(f"Некорректное условие: {item}")
+    return parse_filter(column, expr)
+
+
+def split_top(expr: str) -> list:
+    """Разбить по запятым верхнего уровня (без учета скобок и кавычек)"""
+    items, depth, quoted, current = [], 0, False, []
+    escaped = False
+    for char in expr:
+        if escaped:
+            current.append(char)
+            escaped = False
+            continue
+        if char == "\\" and quoted:
+            current.append(char)
+            escaped = True
+            continue
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            items.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    if current or items:
+        items.append("".join(current))
+    return [item for item in items if item.strip()]
+
+
+def unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == '"' and value[-1] == '"':
+        return value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return value
+
+
+def is_time_column(column: str) -> bool:
+    """Колонки времени называются *_at (created_at, activated_at, ...)"""
+    return column.endswith("_at")
+
+
+def normalize_timestamp(value):
+    """Время в едином виде: UTC, микросекунды, +00:00 — такие строки сравниваются как время
+
+    Время без часового пояса считается UTC (как timestamptz в PostgreSQL с
+    часовым поясом UTC). Значения, не похожие на время, возвращаются как есть.
+    """
+    if isinstance(value, str) and _TIMESTAMP.match(value):
+        try:
+            value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return value
+    if not isinstance(value, datetime):
+        return value
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat(timespec="microseconds")
+
+
+def utc_now() -> str:
+    """Текущее время для now() в том же виде, что и normalize_timestamp"""
+    return normalize_timestamp(datetime.now(timezone.utc))
+
+
+def coerce(raw, sample):
+    """Привести строковое значение фильтра к типу значения в строке"""
+    if raw is None or not isinstance(raw, str):
+        return raw
+    if raw == "null":
+        return None
+    if isinstance(sample, str) and _TIMESTAMP.match(sample):
+        return normalize_timestamp(raw)
+    if isinstance(sample, bool):
+        return raw.lower() in ("true", "t", "1")
+    if isinstance(sample, int):
+        try:
+            return int(raw)
+        except ValueError:
+            return float(raw)
+    if isinstance(sample, float):
+        return float(raw)
+    return raw
+
+
+@lru_cache(maxsize=256)
+def like_pattern(pattern: str, ignore_case: bool = False):
+    regex = "".join(
+        ".*" if char in "%*" else "." if char == "_" else re.escape(char)
+        for char in pattern
+    )
+    flags = re.DOTALL | (re.IGNORECASE if ignore_case else 0)
+    return re.compile(f"^{regex}$", flags)
+
+
+def _compare(op: str, stored, raw) -> bool:
+    if op == "is":
+        expected = {"null": None, "true": True, "false": False}.get(str(raw).lower(), raw)
+        return stored is expected if expected is None or isinstance(expected, bool) else False
+    if stored is None:
+        return False
+    if op == "in":
+        return any(_equals(stored, item) for item in raw)
+    if op in ("like", "ilike"):
+        return bool(like_pattern(raw, op == "ilike").match(str(stored)))
+
+    if op == "eq":
+        return _equals(stored, raw)
+    if op == "neq":
+        return not _equals(stored, raw)
+    try:
+        value = coerce(raw, stored)
+        if op == "gt":
+            return stored > value
+        if op == "gte":
+            return stored >= value
+        if op == "lt":
+            return stored < value
+        return stored <= value
+    except (TypeError, ValueError):
+        return False
+
+
+def _equals(stored, raw) -> bool:
+    try:
+        return stored == coerce(raw, stored)
+    except ValueError:
+        return str(stored) == raw
@@ -0,0 +1,352 @@
+import csv
+import io
+import json
+
+from db_utils import call_rpc, count_rows
+
+# Сколько проектов обрабатывать за один запрос в локальной замене
+PROJECT_BATCH_SIZE = 100
+
+
+def _chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def _local_transaction(client, name: str):
+    """Транзакция для локальной замены изменяющей серверной функции
+
+    Встроенная SQLite выполняет замену одной транзакцией. Через PostgREST
+    несколько запросов атомарно не выполнить, поэтому без серверной функции
+    изменение не применяется вовсе.
+    """
+    transaction = getattr(client, "transaction", None)
+    if transaction is None:
+        raise RuntimeError(f"Функция {name} не найдена в базе: примените sql/{name}.sql")
+    return transaction()
+
+
+def delete_projects_cascade(client, project_ids) -> dict:
+    """Удалить проекты вместе с отзывами, историей и фото
+
+    Возвращает {"projects": [{id, name, category, score, reviews, likes}], "history": N}.
+    """
+    project_ids = list(dict.fromkeys(int(p_id) for p_id in project_ids))
+    if not project_ids:
+        return {"projects": [], "history": 0}
+
+    return call_rpc(
+        client,
+        "delete_projects_cascade",
+        {"p_project_ids": project_ids},
+        fallback=lambda: _delete_projects_cascade_local(client, project_ids)
+    )
+
+
+def _delete_projects_cascade_local(client, project_ids) -> dict:
+    """Локальная замена delete_projects_cascade: все пачки — одной транзакцией"""
+    with _local_transaction(client, "delete_projects_cascade"):
+        return _delete_projects_batches(client, project_ids)
+
+
+def _delete_projects_batches(client, project_ids) -> dict:
+    deleted = []
+    history = 0
+
+    for chunk in _chunks(project_ids, PROJECT_BATCH_SIZE):
+        projects = client.table("projects")\
+            .select("id, name, category, score")\
+            .in_("id", chunk)\
+            .execute().data or []
+        if not projects:
+            continue
+
+        ids = [p['id'] for p in projects]
+        for p in projects:
+            p['reviews'] = count_rows(
+                client, "user_logs",
+                where=lambda q, p_id=p['id']: q.eq("project_id", p_id).eq("action_type", "review"),
+                column="id"
+            )
+            p['likes'] = count_rows(
+                client, "user_logs",
+                where=lambda q, p_id=p['id']: q.eq("project_id", p_id).eq("action_type", "like"),
+                column="id"
+            )
+        history += count_rows(client, "rating_history", where=lambda q: q.in_("project_id", ids), column="id")
+
+        client.table("rating_history").delete().in_("project_id", ids).execute()
+        client.table("user_logs").delete().in_("project_id", ids).execute()
+        client.table("project_photos").delete().in_("project_id", ids).execute()
+        client.table("projects").delete().in_("id", ids).execute()
+
+        deleted.extend(projects)
+
+    return {"projects": deleted, "history": history}
+
+
+# Символы, которые ломают фильтр in.(...) в PostgREST без экранирования
+_IN_RESERVED = set(',()"\\')
+
+
+def find_projects_by_exact_names(client, names) -> dict:
+    """Проекты по точным названиям: {название: проект}; обычные названия — одним запросом"""
+    names = list(dict.fromkeys(names))
+    plain = [name for name in names if not _IN_RESERVED & set(name)]
+    special = [name for name in names if _IN_RESERVED & set(name)]
+
+    rows = []
+    for chunk in _chunks(plain, PROJECT_BATCH_SIZE):
+        rows += client.table("projects").select("*").in_("name", chunk).execute().data or []
+    for name in special:
+        rows += client.table("projects").select("*").eq("name", name).execute().data or []
+
+    return {row['name']: row for row in rows}
+
+
+IMPORT_FIELDS = ("category", "name", "description", "photo_file_id")
+
+
+def parse_import_document(content: bytes, filename: str) -> list:
+    """Разобрать CSV или JSON со строками category, name, description[, photo_file_id]"""
+    text = content.decode("utf-8-sig")
+
+    if filename.lower().endswith(".json"):
+        data = json.loads(text)
+        if isinstance(data, dict):
+            data = data.get("projects", [])
+        if not isinstance(data, list):
+            raise ValueError("JSON must be a list of projects")
+        rows = data
+    else:
+        sample = text[:4096]
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;|\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(io.StringIO(text), dialect)
+        rows = []
+        header = None
+        for values in reader:
+            if not any(v.strip() for v in values):
+                continue
+            values = [v.strip() for v in values]
+            if header is None and [v.lower() for v in values[:3]] == list(IMPORT_FIELDS[:3]):
+                header = [v.lower() for v in values]
+                continue
+            rows.append(dict(zip(header or IMPORT_FIELDS, values)))
+
+    return [
+        {field: str(row.get(field) or "").strip() for field in IMPORT_FIELDS}
+        for row in rows if isinstance(row, dict)
+    ]
+
+
+def validate_import_rows(client, rows: list, categories) -> list:
+    """Проверить все строки; вернуть список ошибок (пустой, если все в порядке)"""
+    errors = []
+    seen = set()
+
+    for i, row in enumerate(rows, 1):
+        if row['category'] not in categories:
+            errors.append(f"{i}: неизвестная категория '{row['category']}'")
+        if not row['name']:
+            errors.append(f"{i}: пустое название")
+        elif row['name'] in seen:
+            errors.append(f"{i}: название '{row['name']}' повторяется в файле")
+        if not row['description']:
+            errors.append(f"{i}: пустое описание")
+        seen.add(row['name'])
+
+    # Дубликаты в базе — одним запросом на пачку названий
+    existing = find_projects_by_exact_names(client, [row['name'] for row in rows if row['name']])
+    for i, row in enumerate(rows, 1):
+        if row['name'] in existing:
+            errors.append(f"{i}: проект '{row['name']}' уже существует")
+
+    return errors
+
+
+class PartialImportError(Exception):
+    """Импорт прерван ошибкой; created — проекты, которые уже добавлены"""
+
+    def __init__(self, created: list, error: Exception):
+        super().__init__(str(error))
+        self.created = created
+        self.error = error
+
+
+def import_projects(client, rows: list, admin_id: int, admin_username: str) -> list:
+    """Добавить проекты пачками вместе с записями истории «create» и фото
+
+    Пачки — отдельные запросы, общей транзакции нет: при ошибке посередине
+    выбрасывается PartialImportError со списком уже добавленных проектов.
+    """
+    created = []
+
+    try:
+        for chunk in _chunks(rows, PROJECT_BATCH_SIZE):
+            _import_chunk(client, chunk, admin_id, admin_username, created)
+    except Exception as e:
+        raise PartialImportError(created, e) from e
+
+    return created
+
+
+def _import_chunk(client, chunk: list, admin_id: int, admin_username: str, created: list):
+    projects = client.table("projects").insert([
+        {"name": row['name'], "category": row['category'], "description": row['description'], "score": 0}
+        for row in chunk
+    ]).execute().data or []
+    # Проекты уже в базе, даже если история или фото дальше не запишутся
+    created.extend(projects)
+
+    client.table("rating_history").insert([
+        {
+            "project_id": p['id'],
+            "admin_id": admin_id,
+            "admin_username": admin_username,
+            "change_type": "create",
+            "score_before": 0,
+            "score_after": 0,
+            "change_amount": 0,
+            "reason": "Создание проекта (импорт)",
+            "is_admin_action": True
+        }
+        for p in projects
+    ]).execute()
+
+    photos_by_name = {row['name']: row['photo_file_id'] for row in chunk if row['photo_file_id']}
+    photos = [
+        {
+            "project_id": p['id'],
+            "photo_file_id": photos_by_name[p['name']],
+            "updated_by": admin_id,
+            "updated_at": "now()"
+        }
+        for p in projects if p['name'] in photos_by_name
+    ]
+    if photos:
+        client.table("project_photos").upsert(photos).execute()
+
+
+def apply_score_batch(client, changes: dict, reason: str, admin_id: int, admin_username: str) -> list:
+    """Изменить рейтинг нескольких проектов: {project_id: изменение}
+
+    Возвращает [{id, name, category, score_before, score_after, change_amount}].
+    """
+    if not changes:
+        return []
+
+    return call_rpc(
+        client,
+        "apply_score_batch",
+        {
+            "p_changes": [
+                {"project_id": project_id, "change_amount": amount}
+                for project_id, amount in changes.items()
+            ],
+            "p_reason": reason,
+            "p_admin_id": admin_id,
+            "p_admin_username": admin_username
+        },
+        fallback=lambda: _apply_score_batch_local(client, changes, reason, admin_id, admin_username)
+    )
+
+
+def _apply_score_batch_local(client, changes: dict, reason: str, admin_id: int, admin_username: str) -> list:
+    """Локальная замена apply_score_batch: чтение, обновления и история — одной транзакцией"""
+    with _local_transaction(client, "apply_score_batch"):
+        return _apply_score_batches(client, changes, reason, admin_id, admin_username)
+
+
+def _apply_score_batches(client, changes: dict, reason: str, admin_id: int, admin_username: str) -> list:
+    results = []
+
+    for chunk in _chunks(list(changes), PROJECT_BATCH_SIZE):
+        projects = client.table("projects")\
+            .select("id, name, category, score")\
+            .in_("id", chunk)\
+            .execute().data or []
+
+        for p in projects:
+            amount = changes[p['id']]
+            client.table("projects").update({"score": p['score'] + amount}).eq("id", p['id']).execute()
+            results.append({
+                "id": p['id'],
+                "name": p['name'],
+                "category": p['category'],
+                "score_before": p['score'],
+                "score_after": p['score'] + amount,
+                "change_amount": amount
+            })
+
+    if results:
+        client.table("rating_history").insert([
+            {
+                "project_id": r['id'],
+                "admin_id": admin_id,
+                "admin_username": admin_username,
+                "change_type": "admin_change",
+                "score_before": r['score_before'],
+                "score_after": r['score_after'],
+                "change_amount": r['change_amount'],
+                "reason": reason,
+                "is_admin_action": True
+            }
+            for r in results
+        ]).execute()
+
+    return sorted(results, key=lambda r: r['id'])
+
+
+def project_stats(client, project_id: int) -> dict:
+    """Отзывы, лайки, число изменений рейтинга, распределение оценок 1–5 и средняя оценка"""
+    data = call_rpc(
+        client,
+        "project_stats",
+        {"p_project_id": project_id},
+        fallback=lambda: _project_stats_local(client, project_id),
+        fallback_on_error=True
+    )
+
+    distribution = {rating: 0 for rating in range(1, 6)}
+    for rating, count in (data.get('distribution') or {}).items():
+        if int(rating) in distribution:
+            distribution[int(rating)] = int(count)
+
+    return {
+        "reviews": int(data.get('reviews') or 0),
+        "likes": int(data.get('likes') or 0),
+        "history": int(data.get('history') or 0),
+        "distribution": distribution,
+        "avg_rating": float(data.get('avg_rating') or 0)
+    }
+
+
+def _project_stats_local(client, project_id: int) -> dict:
+    """Локальная замена project_stats: только запросы количества, без выгрузки строк"""
+    def reviews_with(rating):
+        return lambda q: q.eq("project_id", project_id).eq("action_type", "review").eq("rating_val", rating)
+
+    distribution = {
+        rating: count_rows(client, "user_logs", where=reviews_with(rating), column="id")
+        for rating in range(1, 6)
+    }
+    reviews = sum(distribution.values())
+
+    return {
+        "reviews": reviews,
+        "likes": count_rows(
+            client, "user_logs",
+            where=lambda q: q.eq("project_id", project_id).eq("action_type", "like"),
+            column="id"
+        ),
+        "history": count_rows(
+            client, "rating_history",
+            where=lambda q: q.eq("project_id", project_id),
+            column="id"
+        ),
+        "distribution": distribution,
+        "avg_rating": sum(r * c for r, c in distribution.items()) / reviews if reviews else 0
+    }
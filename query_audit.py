@@ -0,0 +1,290 @@
+import contextvars
+import functools
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from aiogram import BaseMiddleware
+
+# Фильтры: первый аргумент — колонка (часть формы запроса), остальные — значения
+FILTER_METHODS = {
+    "eq", "neq", "gt", "gte", "lt", "lte", "like", "ilike", "is_", "in_",
+    "contains", "contained_by", "filter", "text_search", "or_"
+}
+# Запись: в форму попадают только имена колонок из json
+PAYLOAD_METHODS = {"insert", "upsert", "update"}
+
+# Аудит текущего апдейта (копируется и в asyncio.to_thread)
+_current = contextvars.ContextVar("query_audit", default=None)
+
+
+def _columns(payload) -> str:
+    rows = payload if isinstance(payload, list) else [payload]
+    keys = sorted({key for row in rows if isinstance(row, dict) for key in row})
+    return ", ".join(keys) + (f"; {len(rows)} строк" if isinstance(payload, list) else "")
+
+
+def describe_step(name: str, args: tuple, kwargs: dict) -> tuple:
+    """Шаг построения запроса: (форма без значений, полный вид со значениями)"""
+    full = ", ".join([repr(arg) for arg in args] + [f"{key}={value!r}" for key, value in kwargs.items()])
+    if name in FILTER_METHODS and args:
+        if name == "or_":
+            return f"or({len(str(args[0]).split(','))})", f"or({full})"
+        return f"{name}({args[0]})", f"{name}({full})"
+    if name in PAYLOAD_METHODS and args:
+        options = "".join(f", {key}={value!r}" for key, value in kwargs.items())
+        return f"{name}({_columns(args[0])}{options})", f"{name}({full})"
+    if name == "select":
+        return f"select({', '.join(map(str, args))})", f"select({full})"
+    if name == "match" and args and isinstance(args[0], dict):
+        return f"match({', '.join(sorted(args[0]))})", f"match({full})"
+    return f"{name}({full})", f"{name}({full})"
+
+
+class QueryAuditState:
+    """Запросы одного апдейта: форма (таблица, колонки, фильтры) и полный вид"""
+
+    def __init__(self, kind: str = None):
+        self.kind = kind
+        self.handler = None
+        self.calls = []
+        # Задачи, запущенные из апдейта (воркер логов), наследуют состояние и после его конца
+        self.closed = False
+
+    def record(self, shape: str, key: str, elapsed: float):
+        if not self.closed:
+            self.calls.append((shape, key, elapsed))
+
+    @property
+    def round_trips(self) -> int:
+        return len(self.calls)
+
+    def duplicates(self) -> dict:
+        """Одинаковые запросы (с теми же значениями): форма → сколько раз повторен худший"""
+        counts = Counter((shape, key) for shape, key, _ in self.calls)
+        repeated = {}
+        for (shape, _), count in counts.items():
+            if count > 1:
+                repeated[shape] = max(repeated.get(shape, 0), count)
+        return repeated
+
+    def loops(self, threshold: int = 3) -> dict:
+        """Одна форма с разными значениями threshold и более раз (запрос на строку): форма → раз"""
+        keys = defaultdict(set)
+        for shape, key, _ in self.calls:
+            keys[shape].add(key)
+        return {shape: len(values) for shape, values in keys.items() if len(values) >= threshold}
+
+
+class QueryAuditor:
+    """Аудит запросов к базе по апдейтам: повторы и N+1 с отчетом по обработчикам
+
+    Клиент базы оборачивается в AuditedClient; для выбранной доли апдейтов (sample)
+    каждый execute() записывается в состояние текущего апдейта. Для остальных
+    апдейтов обертка возвращает обычные построители запросов без накладных
+    расходов. В тестах и бенчмарках — capture() без middleware.
+    """
+
+    def __init__(self, sample: float = 1.0, loop_threshold: int = 3):
+        self.sample = sample
+        self.loop_threshold = loop_threshold
+        self.stats = {}
+        self._reported = set()
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample > 0
+
+    def observing(self) -> bool:
+        state = _current.get()
+        return state is not None and not state.closed
+
+    def observe_query(self, table: str, shape: str, key: str, run):
+        started = time.perf_counter()
+        try:
+            return run()
+        finally:
+            state = _current.get()
+            if state is not None:
+                state.record(shape, key, time.perf_counter() - started)
+
+    def should_sample(self) -> bool:
+        return self.sample >= 1 or random.random() < self.sample
+
+    @staticmethod
+    @contextmanager
+    def capture(kind: str = None):
+        """Записать запросы блока (без учета в отчете): with auditor.capture() as audit"""
+        state = QueryAuditState(kind)
+        token = _current.set(state)
+        try:
+            yield state
+        finally:
+            _current.reset(token)
+            state.closed = True
+
+    def finish(self, state: QueryAuditState):
+        handler = state.handler or f"({state.kind or 'без обработчика'})"
+        stats = self.stats.get(handler)
+        if stats is None:
+            stats = self.stats[handler] = {
+                "updates": 0, "round_trips": 0, "max_round_trips": 0, "duplicates": 0, "db_ms": 0.0,
+                "findings": Counter()
+            }
+        duplicates = state.duplicates()
+        loops = state.loops(self.loop_threshold)
+        stats["updates"] += 1
+        stats["round_trips"] += state.round_trips
+        stats["max_round_trips"] = max(stats["max_round_trips"], state.round_trips)
+        counts = Counter(key for _, key, _ in state.calls)
+        stats["duplicates"] += sum(count - 1 for count in counts.values())
+        stats["db_ms"] += sum(elapsed for _, _, elapsed in state.calls) * 1000
+
+        findings = [("повтор", shape, count) for shape, count in duplicates.items()]
+        findings += [("на строку", shape, count) for shape, count in loops.items()]
+        for kind, query, count in findings:
+            stats["findings"][(kind, query)] += 1
+            if (handler, kind, query) not in self._reported:
+                self._reported.add((handler, kind, query))
+                logging.warning("Аудит запросов: %s — %s ×%s: %s", handler, kind, count, query)
+
+    def snapshot(self, top: int = 3) -> list:
+        """Обработчики по числу запросов на апдейт, с главными находками"""
+        rows = []
+        for handler, stats in self.stats.items():
+            updates = stats["updates"]
+            rows.append({
+                "handler": handler,
+                "updates": updates,
+                "round_trips": round(stats["round_trips"] / updates, 1),
+                "max_round_trips": stats["max_round_trips"],
+                "duplicates": round(stats["duplicates"] / updates, 1),
+                "db_ms": round(stats["db_ms"] / updates, 1),
+                "findings": [
+                    {"kind": kind, "query": query, "updates": count}
+                    for (kind, query), count in stats["findings"].most_common(top)
+                ]
+            })
+        rows.sort(key=lambda row: -row["round_trips"])
+        return rows
+
+    def reset(self):
+        # Уже записанные в лог находки не повторяются и после сброса
+        self.stats = {}
+
+
+class AuditedClient:
+    """Клиент базы с наблюдателями запросов (аудит, трассировка)
+
+    Наблюдатель — объект с observing() и observe_query(table, shape, key, run).
+    Пока ни один не наблюдает (вне аудируемого апдейта и вне трассы),
+    table() и rpc() отдают обычные построители.
+    """
+
+    def __init__(self, client, observers):
+        self._client = client
+        self._observers = list(observers)
+
+    def _active(self) -> tuple:
+        return tuple(observer for observer in self._observers if observer.observing())
+
+    def table(self, name: str):
+        query = self._client.table(name)
+        observers = self._active()
+        if not observers:
+            return query
+        return AuditedQuery(query, name, (), (), observers)
+
+    from_ = table
+
+    def rpc(self, name: str, params: dict = None):
+        query = self._client.rpc(name, params)
+        observers = self._active()
+        if not observers:
+            return query
+        params = params or {}
+        shape = f"({', '.join(sorted(params))})"
+        return AuditedQuery(query, f"rpc {name}", (shape,), (f"({params!r})",), observers)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+class AuditedQuery:
+    """Обертка построителя: копит шаги запроса, execute() проходит через наблюдателей"""
+
+    __slots__ = ("_query", "_table", "_shape", "_key", "_observers")
+
+    def __init__(self, query, table: str, shape: tuple, key: tuple, observers: tuple):
+        object.__setattr__(self, "_query", query)
+        object.__setattr__(self, "_table", table)
+        object.__setattr__(self, "_shape", shape)
+        object.__setattr__(self, "_key", key)
+        object.__setattr__(self, "_observers", observers)
+
+    def _step(self, result, shape: str, key: str):
+        if result is self._query:
+            object.__setattr__(self, "_shape", self._shape + (shape,))
+            object.__setattr__(self, "_key", self._key + (key,))
+            return self
+        if hasattr(result, "execute"):
+            return AuditedQuery(result, self._table, self._shape + (shape,), self._key + (key,), self._observers)
+        return result
+
+    def __getattr__(self, name):
+        value = getattr(self._query, name)
+        if not callable(value):
+            # Свойства-построители, например not_
+            return self._step(value, name, name) if hasattr(value, "execute") else value
+
+        def step(*args, **kwargs):
+            shape, key = describe_step(name, args, kwargs)
+            return self._step(value(*args, **kwargs), shape, key)
+
+        return step
+
+    def __setattr__(self, name, value):
+        # db_utils.or_filter добавляет условие напрямую в params
+        setattr(self._query, name, value)
+        object.__setattr__(self, "_shape", self._shape + (f"{name}=",))
+        object.__setattr__(self, "_key", self._key + (f"{name}={value}",))
+
+    def execute(self):
+        shape = f"{self._table}: {'.'.join(self._shape)}"
+        key = f"{self._table}: {'.'.join(self._key)}"
+        run = self._query.execute
+        for observer in self._observers:
+            run = functools.partial(observer.observe_query, self._table, shape, key, run)
+        return run()
+
+
+class QueryAuditMiddleware(BaseMiddleware):
+    """Начинает аудит для доли апдейтов и сводит его в отчет по обработчикам"""
+
+    def __init__(self, auditor: QueryAuditor):
+        self.auditor = auditor
+
+    async def __call__(self, handler, event, data):
+        if not self.auditor.should_sample():
+            return await handler(event, data)
+        state = QueryAuditState(getattr(event, "event_type", None))
+        token = _current.set(state)
+        try:
+            return await handler(event, data)
+        finally:
+            _current.reset(token)
+            state.closed = True
+            self.auditor.finish(state)
+
+
+class QueryAuditHandlerMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: подписывает аудит именем обработчика"""
+
+    async def __call__(self, handler, event, data):
+        state = _current.get()
+        handler_object = data.get("handler")
+        if state is not None and handler_object is not None:
+            state.handler = getattr(handler_object.callback, "__name__", str(handler_object.callback))
+        return await handler(event, data)
@@ -0,0 +1,139 @@
+import hashlib
+import hmac
+import logging
+import secrets
+
+from db_utils import iter_rows
+
+# Crockford base32: 8 символов = 40 бит, без похожих друг на друга I, L, O, U
+CODE_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+CODE_LENGTH = 8
+CODE_BITS = 40
+# Из 40 бит 6 — ключевая контрольная сумма user_id: выдуманный или опечатанный
+# код проходит проверку с вероятностью 1/64. user_id до 2^34 кодируются
+# без базы, для остальных сохраняется случайный код
+CHECK_BITS = 6
+ID_BITS = CODE_BITS - CHECK_BITS
+_CHECK_MASK = (1 << CHECK_BITS) - 1
+_HALF_BITS = CODE_BITS // 2
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+_CONFUSABLE = str.maketrans({"I": "1", "L": "1", "O": "0"})
+
+
+class ReferralCodes:
+    """Реферальные коды, однозначно вычисляемые из user_id
+
+    Код — это user_id с контрольными битами, пропущенный через ключевую сеть
+    Фейстеля на 40 битах (биекция) и записанный в base32. Коды уникальны по
+    построению, а обратное преобразование не требует запросов к базе.
+    Старые случайные коды из таблицы referrals продолжают работать через
+    карту совместимости, которая имеет приоритет при расшифровке.
+    """
+
+    def __init__(self, secret: str):
+        # От ключа зависят все выданные коды: случайная замена ключа сломала бы ссылки
+        if not secret:
+            raise ValueError("Не задан ключ реферальных кодов (REFERRAL_SECRET)")
+        self._check_key = hmac.new(secret.encode(), b"check", hashlib.sha256).digest()
+        self._round_keys = [
+            hmac.new(secret.encode(), f"round-{i}".encode(), hashlib.sha256).digest()
+            for i in range(_ROUNDS)
+        ]
+        self._legacy = {}
+        self._legacy_by_user = {}
+
+    def _round(self, i: int, half: int) -> int:
+        digest = hmac.new(self._round_keys[i], half.to_bytes(3, "big"), hashlib.sha256).digest()
+        return int.from_bytes(digest[:3], "big") & _HALF_MASK
+
+    def _check(self, user_id: int) -> int:
+        digest = hmac.new(self._check_key, user_id.to_bytes(5, "big"), hashlib.sha256).digest()
+        return digest[0] & _CHECK_MASK
+
+    def _permute(self, value: int) -> int:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for i in range(_ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << _HALF_BITS) | right
+
+    def _unpermute(self, value: int) -> int:
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for i in reversed(range(_ROUNDS)):
+            left, right = right ^ self._round(i, left), left
+        return (left << _HALF_BITS) | right
+
+    def encode(self, user_id: int) -> str:
+        if not 0 < user_id < (1 << ID_BITS):
+            raise ValueError(f"user_id {user_id} does not fit into a referral code")
+        value = self._permute((user_id << CHECK_BITS) | self._check(user_id))
+        chars = []
+        for _ in range(CODE_LENGTH):
+            value, rem = divmod(value, 32)
+            chars.append(CODE_ALPHABET[rem])
+        return "".join(reversed(chars))
+
+    @staticmethod
+    def normalize(code: str) -> str:
+        return code.strip().upper().translate(_CONFUSABLE)
+
+    def decode(self, code: str):
+        """Вернуть user_id владельца кода или None, если код некорректен"""
+        code = self.normalize(code)
+        if code in self._legacy:
+            return self._legacy[code]
+        if len(code) != CODE_LENGTH or any(c not in CODE_ALPHABET for c in code):
+            return None
+
+        value = 0
+        for c in code:
+            value = value * 32 + CODE_ALPHABET.index(c)
+        payload = self._unpermute(value)
+        user_id = payload >> CHECK_BITS
+        if not user_id or payload & _CHECK_MASK != self._check(user_id):
+            return None
+        return user_id
+
+    def is_legacy(self, code: str) -> bool:
+        """Код сохранен в таблице referrals (а не вычислен из user_id)"""
+        return self.normalize(code) in self._legacy
+
+    def code_for(self, user_id: int):
+        """Код пользователя без запросов к базе; None, если нужен сохраняемый код"""
+        if user_id in self._legacy_by_user:
+            return self._legacy_by_user[user_id]
+        try:
+            code = self.encode(user_id)
+        except ValueError:
+            return None
+        # Вычисленный код занят старым кодом другого пользователя
+        if code in self._legacy:
+            return None
+        return code
+
+    def new_legacy_code(self) -> str:
+        """Случайный код, не совпадающий с уже известными сохраненными кодами"""
+        while True:
+            code = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+            if code not in self._legacy:
+                return code
+
+    def add_legacy(self, code: str, user_id: int):
+        code = self.normalize(code)
+        self._legacy[code] = user_id
+        self._legacy_by_user.setdefault(user_id, code)
+
+    def load_legacy(self, client):
+        """Загрузить карту совместимости из таблицы referrals"""
+        legacy = {}
+        legacy_by_user = {}
+        for row in iter_rows(client, "referrals", "code, user_id", key="code"):
+            code = self.normalize(row['code'])
+            legacy[code] = row['user_id']
+            legacy_by_user.setdefault(row['user_id'], code)
+        self._legacy = legacy
+        self._legacy_by_user = legacy_by_user
+        logging.info("Загружено старых реферальных кодов: %s", len(legacy))
+
+    def __len__(self):
+        return len(self._legacy)
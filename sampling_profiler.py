@@ -0,0 +1,133 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Листовые функции ожидания: поток простаивает, а не работает
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("socket.py", "accept")
+}
+
+
+class ProfilerBusy(Exception):
+    """Профилирование уже идет"""
+
+
+def _frame_label(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class ProfileResult:
+    """Стеки по потокам: collapsed-формат для flame graph и сводка по функциям"""
+
+    def __init__(self, stacks: Counter, samples: int, duration: float, interval: float):
+        self.stacks = stacks
+        self.samples = samples
+        self.duration = duration
+        self.interval = interval
+
+    def collapsed(self) -> str:
+        """Формат Brendan Gregg (flamegraph.pl, speedscope): «поток;f1;f2 N» на строку"""
+        return "".join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.most_common())
+
+    def busy_stacks(self) -> Counter:
+        return Counter({stack: count for stack, count in self.stacks.items() if not stack[-1].startswith("(idle)")})
+
+    def top(self, limit: int = 25) -> tuple:
+        """(по собственному времени, по времени с вложенными вызовами) без простоя"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.busy_stacks().items():
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                total[label] += count
+        return own.most_common(limit), total.most_common(limit)
+
+    def summary(self, limit: int = 25) -> str:
+        busy = sum(self.busy_stacks().values())
+        threads = Counter()
+        for stack, count in self.stacks.items():
+            threads[stack[0]] += count
+        own, total = self.top(limit)
+
+        def percent(count):
+            return f"{count / busy * 100:5.1f}%" if busy else "  0.0%"
+
+        lines = [
+            f"Длительность {self.duration:.1f} с, интервал {self.interval * 1000:g} мс, замеров {self.samples}",
+            f"Стеков в работе: {busy} (простой не учитывается в процентах)",
+            "",
+            "Потоки (замеров):"
+        ]
+        lines += [f"  {thread}: {count}" for thread, count in threads.most_common()]
+        lines += ["", "Собственное время:"]
+        lines += [f"  {percent(count)}  {count:6}  {label}" for label, count in own]
+        lines += ["", "С вложенными вызовами:"]
+        lines += [f"  {percent(count)}  {count:6}  {label}" for label, count in total]
+        return "\n".join(lines) + "\n"
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик: поток раз в interval снимает стеки всех потоков
+
+    Ничего не подменяет в интерпретаторе (sys._current_frames), поэтому его
+    можно включать в работающем боте: loop продолжает обслуживать апдейты,
+    а накладные расходы — один обход стеков за интервал.
+    """
+
+    def __init__(self, interval: float = 0.005, max_depth: int = 64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._lock.locked()
+
+    async def profile(self, duration: float) -> ProfileResult:
+        """Профилировать duration секунд, не блокируя loop"""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            loop_thread = threading.get_ident()
+            return await asyncio.to_thread(self._run, duration, loop_thread)
+        finally:
+            self._lock.release()
+
+    def _run(self, duration: float, loop_thread: int) -> ProfileResult:
+        me = threading.get_ident()
+        stacks = Counter()
+        samples = 0
+        started = time.perf_counter()
+        deadline = started + duration
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            for thread_id, frame in frames.items():
+                if thread_id == me:
+                    continue
+                thread = "event-loop" if thread_id == loop_thread else names.get(thread_id, f"thread-{thread_id}")
+                stacks[self._stack(thread, frame)] += 1
+            frames = frame = None
+            samples += 1
+            time.sleep(self.interval)
+        return ProfileResult(stacks, samples, time.perf_counter() - started, self.interval)
+
+    def _stack(self, thread: str, frame) -> tuple:
+        labels = []
+        leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+        while frame is not None and len(labels) < self.max_depth:
+            labels.append(_frame_label(frame.f_code))
+            frame = frame.f_back
+        labels.reverse()
+        if leaf in IDLE_LEAVES:
+            labels.append("(idle)")
+        return (thread, *labels)
@@ -0,0 +1,62 @@
+-- Активация реферального кода одной транзакцией (после user_directory.sql)
+
+create unique index if not exists referral_logs_referred_user_idx
+    on referral_logs (referred_user_id);
+
+create unique index if not exists user_stats_user_idx
+    on user_stats (user_id);
+
+-- Владелец кода (p_inviter_id) вычисляется ботом из самого кода
+drop function if exists activate_referral(bigint, text);
+
+create or replace function activate_referral(p_inviter_id bigint, p_referred_id bigint, p_code text)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_inviter_id bigint := p_inviter_id;
+    v_referral_count integer;
+begin
+    if exists (select 1 from referral_logs where referred_user_id = p_referred_id) then
+        return jsonb_build_object('ok', false, 'error', 'already_activated');
+    end if;
+
+    if v_inviter_id = p_referred_id then
+        return jsonb_build_object('ok', false, 'error', 'self_referral');
+    end if;
+
+    -- Код с верной контрольной суммой может быть подобран: пригласивший должен быть известен боту
+    if not exists (select 1 from user_stats where user_id = v_inviter_id)
+        and not exists (select 1 from referrals where code = p_code and user_id = v_inviter_id)
+        and not exists (select 1 from user_directory where user_id = v_inviter_id) then
+        return jsonb_build_object('ok', false, 'error', 'invalid_code');
+    end if;
+
+    insert into referral_logs (inviter_id, referred_user_id, referral_code, activated_at)
+    values (v_inviter_id, p_referred_id, p_code, now())
+    on conflict (referred_user_id) do nothing;
+
+    -- Параллельная активация тем же пользователем
+    if not found then
+        return jsonb_build_object('ok', false, 'error', 'already_activated');
+    end if;
+
+    insert into user_stats (user_id, referral_count, reviews_count, likes_count)
+    values (v_inviter_id, 1, 0, 0)
+    on conflict (user_id) do update
+        set referral_count = user_stats.referral_count + 1
+    returning referral_count into v_referral_count;
+
+    insert into user_stats (user_id, referral_count, reviews_count, likes_count)
+    values (p_referred_id, 0, 0, 0)
+    on conflict (user_id) do nothing;
+
+    return jsonb_build_object(
+        'ok', true,
+        'inviter_id', v_inviter_id,
+        'referred_id', p_referred_id,
+        'referral_code', p_code,
+        'referral_count', v_referral_count
+    );
+end;
+$$;
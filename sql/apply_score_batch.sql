@@ -0,0 +1,43 @@
+-- Пакетное изменение рейтинга проектов одной транзакцией
+
+create or replace function apply_score_batch(
+    p_changes jsonb,
+    p_reason text,
+    p_admin_id bigint,
+    p_admin_username text
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_result jsonb;
+begin
+    with changes as (
+        select project_id, sum(change_amount)::integer as change_amount
+        from jsonb_to_recordset(p_changes) as c(project_id bigint, change_amount integer)
+        group by project_id
+    ),
+    updated as (
+        update projects p
+           set score = p.score + c.change_amount
+          from changes c
+         where p.id = c.project_id
+        returning p.id, p.name, p.category, p.score - c.change_amount as score_before,
+                  p.score as score_after, c.change_amount
+    ),
+    history as (
+        insert into rating_history (
+            project_id, admin_id, admin_username, change_type,
+            score_before, score_after, change_amount, reason, is_admin_action
+        )
+        select id, p_admin_id, p_admin_username, 'admin_change',
+               score_before, score_after, change_amount, p_reason, true
+        from updated
+    )
+    select coalesce(jsonb_agg(to_jsonb(u) order by u.id), '[]'::jsonb)
+      into v_result
+      from updated u;
+
+    return v_result;
+end;
+$$;
@@ -0,0 +1,49 @@
+-- Каскадное удаление проектов одной транзакцией
+
+create index if not exists rating_history_project_idx
+    on rating_history (project_id);
+
+create index if not exists project_photos_project_idx
+    on project_photos (project_id);
+
+create or replace function delete_projects_cascade(p_project_ids bigint[], p_batch_size integer default 10000)
+returns jsonb
+language plpgsql
+as $$
+declare
+    v_result jsonb;
+    v_history bigint := 0;
+    v_deleted integer;
+begin
+    -- Блокируем проекты и считаем, что будет удалено
+    select coalesce(jsonb_agg(jsonb_build_object(
+               'id', p.id,
+               'name', p.name,
+               'category', p.category,
+               'score', p.score,
+               'reviews', (select count(*) from user_logs l where l.project_id = p.id and l.action_type = 'review'),
+               'likes', (select count(*) from user_logs l where l.project_id = p.id and l.action_type = 'like')
+           ) order by p.id), '[]'::jsonb)
+      into v_result
+      from (select * from projects where id = any(p_project_ids) for update) p;
+
+    -- История может быть очень большой: удаляем пачками внутри той же транзакции
+    loop
+        delete from rating_history
+         where ctid in (
+             select ctid from rating_history
+              where project_id = any(p_project_ids)
+              limit p_batch_size
+         );
+        get diagnostics v_deleted = row_count;
+        v_history := v_history + v_deleted;
+        exit when v_deleted < p_batch_size;
+    end loop;
+
+    delete from user_logs where project_id = any(p_project_ids);
+    delete from project_photos where project_id = any(p_project_ids);
+    delete from projects where id = any(p_project_ids);
+
+    return jsonb_build_object('projects', v_result, 'history', v_history);
+end;
+$$;
@@ -0,0 +1,26 @@
+-- Статистика проекта для /stats одним запросом
+
+create or replace function project_stats(p_project_id bigint)
+returns jsonb
+language sql
+stable
+as $$
+    -- Отзывы без оценки не попадают ни в распределение (ключ jsonb не может быть null),
+    -- ни в общее число — как в локальной замене project_ops._project_stats_local
+    with reviews as (
+        select rating_val, count(*) as cnt
+        from user_logs
+        where project_id = p_project_id and action_type = 'review' and rating_val is not null
+        group by rating_val
+    )
+    select jsonb_build_object(
+        'reviews', coalesce((select sum(cnt) from reviews), 0),
+        'likes', (
+            select count(*) from user_logs
+            where project_id = p_project_id and action_type = 'like'
+        ),
+        'history', (select count(*) from rating_history where project_id = p_project_id),
+        'distribution', coalesce((select jsonb_object_agg(rating_val, cnt) from reviews), '{}'::jsonb),
+        'avg_rating', coalesce((select sum(rating_val * cnt)::numeric / nullif(sum(cnt), 0) from reviews), 0)
+    );
+$$;
@@ -0,0 +1,109 @@
+-- Схема встроенной базы SQLite (DB_BACKEND=sqlite): те же таблицы и колонки, что в Supabase.
+-- Время хранится строкой ISO 8601 (как его отдает PostgREST), логические значения — 0/1.
+
+create table if not exists projects (
+    id integer primary key,
+    name text not null,
+    category text not null,
+    description text,
+    score integer not null default 0,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create index if not exists projects_category_score_idx on projects (category, score desc, id);
+create index if not exists projects_score_idx on projects (score desc, id);
+create index if not exists projects_name_idx on projects (name);
+
+create table if not exists project_photos (
+    project_id integer primary key,
+    photo_file_id text,
+    updated_by integer,
+    updated_at text default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create table if not exists user_logs (
+    id integer primary key,
+    user_id integer not null,
+    project_id integer not null,
+    action_type text not null,
+    review_text text,
+    rating_val integer,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create index if not exists user_logs_user_project_idx on user_logs (user_id, project_id, action_type);
+create index if not exists user_logs_project_idx on user_logs (project_id, action_type, created_at);
+
+create table if not exists rating_history (
+    id integer primary key,
+    project_id integer,
+    user_id integer,
+    username text,
+    admin_id integer,
+    admin_username text,
+    change_type text,
+    score_before integer,
+    score_after integer,
+    change_amount integer,
+    reason text,
+    is_admin_action boolean not null default 0,
+    related_review_id integer,
+    created_at text not null default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create index if not exists rating_history_project_idx on rating_history (project_id, created_at);
+create index if not exists rating_history_created_idx on rating_history (created_at);
+create index if not exists rating_history_user_idx on rating_history (user_id, created_at);
+
+create table if not exists user_stats (
+    user_id integer primary key,
+    referral_count integer not null default 0,
+    reviews_count integer not null default 0,
+    likes_count integer not null default 0
+);
+
+create table if not exists banned_users (
+    id integer primary key,
+    user_id integer not null unique,
+    banned_by integer,
+    banned_by_username text,
+    reason text,
+    banned_at text default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create table if not exists referrals (
+    id integer primary key,
+    user_id integer not null,
+    code text not null unique,
+    created_at text default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create index if not exists referrals_user_idx on referrals (user_id);
+
+create table if not exists referral_logs (
+    id integer primary key,
+    inviter_id integer not null,
+    referred_user_id integer not null unique,
+    referral_code text,
+    activated_at text default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create index if not exists referral_logs_inviter_idx on referral_logs (inviter_id, activated_at);
+
+create table if not exists user_directory (
+    user_id integer primary key,
+    username text,
+    username_lower text,
+    first_name text,
+    last_name text,
+    updated_at text not null default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
+
+create index if not exists user_directory_username_lower_idx on user_directory (username_lower);
+
+create table if not exists site_sessions (
+    user_id integer primary key,
+    session_token text not null unique,
+    expires_at text,
+    created_at text default (strftime('%Y-%m-%dT%H:%M:%f000+00:00', 'now'))
+);
@@ -0,0 +1,39 @@
+-- Сводная статистика для /api/stats и /list одним запросом
+
+create index if not exists user_logs_project_action_idx
+    on user_logs (project_id, action_type);
+
+create or replace function stats_snapshot(p_top_limit integer default 5)
+returns jsonb
+language sql
+stable
+as $$
+    with counts as (
+        select project_id,
+               count(*) filter (where action_type = 'review') as reviews,
+               count(*) filter (where action_type = 'like') as likes
+        from user_logs
+        group by project_id
+    )
+    select jsonb_build_object(
+        'total_projects', (select count(*) from projects),
+        'total_reviews', coalesce((select sum(reviews) from counts), 0),
+        'total_likes', coalesce((select sum(likes) from counts), 0),
+        'projects', coalesce((
+            select jsonb_agg(jsonb_build_object(
+                       'id', p.id,
+                       'name', p.name,
+                       'category', p.category,
+                       'score', p.score,
+                       'reviews', coalesce(c.reviews, 0),
+                       'likes', coalesce(c.likes, 0)
+                   ) order by p.score desc, p.id)
+            from projects p
+            left join counts c on c.project_id = p.id
+        ), '[]'::jsonb),
+        'top_projects', coalesce((
+            select jsonb_agg(to_jsonb(t) order by t.score desc, t.id)
+            from (select * from projects order by score desc, id limit p_top_limit) t
+        ), '[]'::jsonb)
+    );
+$$;
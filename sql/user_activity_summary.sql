@@ -0,0 +1,49 @@
+-- Сводка активности пользователя для /finduser одним запросом
+
+create index if not exists user_logs_user_action_idx
+    on user_logs (user_id, action_type);
+
+create index if not exists rating_history_user_created_idx
+    on rating_history (user_id, created_at desc);
+
+create or replace function user_activity_summary(p_user_id bigint, p_recent_limit integer default 5)
+returns jsonb
+language sql
+stable
+as $$
+    select jsonb_build_object(
+        'user_id', p_user_id,
+        'reviews', (
+            select count(*) from user_logs
+            where user_id = p_user_id and action_type = 'review'
+        ),
+        'likes', (
+            select count(*) from user_logs
+            where user_id = p_user_id and action_type = 'like'
+        ),
+        'impact_7d', (
+            select coalesce(sum(change_amount), 0) from rating_history
+            where user_id = p_user_id and created_at >= now() - interval '7 days'
+        ),
+        'impact_30d', (
+            select coalesce(sum(change_amount), 0) from rating_history
+            where user_id = p_user_id and created_at >= now() - interval '30 days'
+        ),
+        'recent', coalesce((
+            select jsonb_agg(to_jsonb(h) order by h.created_at desc)
+            from (
+                select rh.project_id, p.name as project_name, rh.change_amount, rh.reason, rh.created_at
+                from rating_history rh
+                left join projects p on p.id = rh.project_id
+                where rh.user_id = p_user_id
+                order by rh.created_at desc
+                limit p_recent_limit
+            ) h
+        ), '[]'::jsonb),
+        'ban', (
+            select to_jsonb(b) from banned_users b
+            where b.user_id = p_user_id
+            limit 1
+        )
+    );
+$$;
@@ -0,0 +1,13 @@
+-- Справочник пользователей, собираемый из входящих апдейтов
+
+create table if not exists user_directory (
+    user_id bigint primary key,
+    username text,
+    username_lower text,
+    first_name text,
+    last_name text,
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists user_directory_username_lower_idx
+    on user_directory (username_lower);
@@ -0,0 +1,517 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from postgrest_filters import (
+    Condition, Logic, is_time_column, normalize_timestamp, parse_filter, parse_logic, utc_now
+)
+
+# Встроенная база SQLite с подмножеством API клиента Supabase:
+# table(...).select/insert/update/upsert/delete + фильтры, order, range, single, count
+
+SCHEMA_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sql", "sqlite_schema.sql")
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+_COMPARISONS = {"eq": "=", "neq": "<>", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+_HTTP_METHODS = {"select": "GET", "insert": "POST", "upsert": "POST", "update": "PATCH", "delete": "DELETE"}
+
+sqlite3.register_converter("boolean", lambda value: value not in (b"0", b""))
+
+
+class SQLiteAPIError(Exception):
+    """Ошибка с полями как у postgrest APIError (message, code)"""
+
+    def __init__(self, message: str, code: str = None):
+        super().__init__(message)
+        self.message = message
+        self.code = code
+
+    def __str__(self):
+        return f"{self.code}: {self.message}" if self.code else self.message
+
+
+class SQLiteResponse:
+    def __init__(self, data, count: int = None):
+        self.data = data
+        self.count = count
+
+
+class SQLiteRPC:
+    """Серверных функций нет: вызов отвечает как PostgREST на неизвестную функцию"""
+
+    def __init__(self, client, name: str):
+        self.client = client
+        self.name = name
+
+    def execute(self):
+        self.client.calls[f"RPC {self.name}"] += 1
+        raise SQLiteAPIError(f"Could not find the function public.{self.name} in the schema cache", "PGRST202")
+
+
+class SQLiteClient:
+    """Клиент встроенной базы SQLite, совместимый с используемой частью supabase-py"""
+
+    def __init__(self, path: str = ":memory:", schema_path: str = SCHEMA_PATH):
+        self.path = path
+        self.lock = threading.RLock()
+        self.calls = Counter()
+        self._tables = {}
+
+        self.conn = sqlite3.connect(
+            path,
+            check_same_thread=False,
+            isolation_level=None,
+            detect_types=sqlite3.PARSE_DECLTYPES
+        )
+        self.conn.row_factory = sqlite3.Row
+        self.conn.create_function("casefold", 1, _casefold, deterministic=True)
+        self.conn.execute("pragma case_sensitive_like = on")
+        if path != ":memory:":
+            self.conn.execute("pragma journal_mode = wal")
+            self.conn.execute("pragma synchronous = normal")
+
+        with open(schema_path, encoding="utf-8") as f:
+            self.conn.executescript(f.read())
+
+    def table(self, name: str) -> "SQLiteQueryBuilder":
+        return SQLiteQueryBuilder(self, name)
+
+    from_ = table
+
+    def rpc(self, name: str, params: dict = None) -> SQLiteRPC:
+        return SQLiteRPC(self, name)
+
+    def columns(self, table: str) -> dict:
+        """Колонки таблицы: имя → объявленный тип (кешируется)"""
+        if table not in self._tables:
+            with self.lock:
+                info = self.conn.execute(f'pragma table_info("{_identifier(table)}")').fetchall()
+            if not info:
+                raise SQLiteAPIError(f'relation "public.{table}" does not exist', "42P01")
+            self._tables[table] = {
+                "types": {row["name"]: (row["type"] or "").lower() for row in info},
+                "key": [row["name"] for row in sorted(info, key=lambda r: r["pk"]) if row["pk"]]
+            }
+        return self._tables[table]["types"]
+
+    def primary_key(self, table: str) -> list:
+        self.columns(table)
+        return self._tables[table]["key"]
+
+    def query(self, sql: str, params=()) -> list:
+        with self.lock:
+            try:
+                return [dict(row) for row in self.conn.execute(sql, params).fetchall()]
+            except sqlite3.Error as e:
+                raise _api_error(e) from e
+
+    def bulk_insert(self, table: str, rows, batch_size: int = 10000) -> int:
+        """Быстрая загрузка строк (сид-данные): executemany пачками в транзакциях"""
+        total = 0
+        batch = []
+        columns = None
+        for row in rows:
+            if columns is None:
+                columns = list(row)
+            batch.append(tuple(_value(row.get(column), column) for column in columns))
+            if len(batch) >= batch_size:
+                total += self._insert_batch(table, columns, batch)
+                batch = []
+        if batch:
+            total += self._insert_batch(table, columns, batch)
+        return total
+
+    @contextmanager
+    def transaction(self):
+        """Несколько запросов одной транзакцией: при исключении откатываются все
+
+        Вложенные вызовы — точки сохранения внутри внешней транзакции.
+        Соединение занято на все время блока, другие потоки ждут.
+        """
+        with self.lock:
+            self.conn.execute("savepoint tx")
+            try:
+                yield self
+            except BaseException:
+                self.conn.execute("rollback to tx")
+                self.conn.execute("release tx")
+                raise
+            self.conn.execute("release tx")
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def _insert_batch(self, table: str, columns: list, batch: list) -> int:
+        names = ", ".join(f'"{_identifier(column)}"' for column in columns)
+        marks = ", ".join("?" for _ in columns)
+        try:
+            with self.transaction():
+                self.conn.executemany(f'insert into "{_identifier(table)}" ({names}) values ({marks})', batch)
+        except sqlite3.Error as e:
+            raise _api_error(e) from e
+        return len(batch)
+
+
+class SQLiteQueryBuilder:
+    """Построитель запроса в стиле postgrest-py поверх SQLite"""
+
+    def __init__(self, client: SQLiteClient, table: str):
+        self.client = client
+        self.table = table
+        self._operation = "select"
+        self._columns = "*"
+        self._count = None
+        self._head = False
+        self._payload = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._filters = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+        self._single = None
+        self._negate_next = False
+
+    # --- ОПЕРАЦИИ ---
+    def select(self, *columns: str, count: str = None, head: bool = False):
+        self._operation = "select"
+        self._columns = ",".join(columns) or "*"
+        self._count = count
+        self._head = head
+        return self
+
+    def insert(self, json, count: str = None, returning: str = None, upsert: bool = False):
+        self._operation = "upsert" if upsert else "insert"
+        self._payload = json
+        self._count = count
+        return self
+
+    def upsert(self, json, count: str = None, returning: str = None, ignore_duplicates: bool = False, on_conflict: str = ""):
+        self._operation = "upsert"
+        self._payload = json
+        self._count = count
+        self._ignore_duplicates = ignore_duplicates
+        self._on_conflict = on_conflict
+        return self
+
+    def update(self, json, count: str = None, returning: str = None):
+        self._operation = "update"
+        self._payload = json
+        self._count = count
+        return self
+
+    def delete(self, count: str = None, returning: str = None):
+        self._operation = "delete"
+        self._count = count
+        return self
+
+    # --- ФИЛЬТРЫ ---
+    @property
+    def not_(self):
+        self._negate_next = True
+        return self
+
+    def _add(self, column: str, op: str, value):
+        self._filters.append(Condition(column, op, value, self._negate_next))
+        self._negate_next = False
+        return self
+
+    def eq(self, column: str, value):
+        return self._add(column, "eq", value)
+
+    def neq(self, column: str, value):
+        return self._add(column, "neq", value)
+
+    def gt(self, column: str, value):
+        return self._add(column, "gt", value)
+
+    def gte(self, column: str, value):
+        return self._add(column, "gte", value)
+
+    def lt(self, column: str, value):
+        return self._add(column, "lt", value)
+
+    def lte(self, column: str, value):
+        return self._add(column, "lte", value)
+
+    def like(self, column: str, pattern: str):
+        return self._add(column, "like", pattern)
+
+    def ilike(self, column: str, pattern: str):
+        return self._add(column, "ilike", pattern)
+
+    def is_(self, column: str, value):
+        return self._add(column, "is", value)
+
+    def in_(self, column: str, values):
+        return self._add(column, "in", list(values))
+
+    def match(self, query: dict):
+        for column, value in query.items():
+            self.eq(column, value)
+        return self
+
+    def filter(self, column: str, operator: str, criteria: str):
+        condition = parse_filter(column, f"{operator}.{criteria}")
+        condition.negate = condition.negate != self._negate_next
+        self._negate_next = False
+        self._filters.append(condition)
+        return self
+
+    def or_(self, filters: str, reference_table: str = None):
+        group = parse_logic(filters, "or")
+        group.negate = self._negate_next
+        self._negate_next = False
+        self._filters.append(group)
+        return self
+
+    # --- ПОРЯДОК И СТРАНИЦЫ ---
+    def order(self, column: str, desc: bool = False, nullsfirst: bool = False, foreign_table: str = None):
+        parts = [part.strip() for part in column.split(",") if part.strip()]
+        for part in parts:
+            name, *modifiers = part.split(".")
+            descending = "desc" in modifiers or (desc and len(parts) == 1)
+            if "nullsfirst" in modifiers or nullsfirst:
+                nulls = "first"
+            elif "nullslast" in modifiers:
+                nulls = "last"
+            else:
+                nulls = "first" if descending else "last"
+            self._order.append(f'"{_identifier(name)}" {"desc" if descending else "asc"} nulls {nulls}')
+        return self
+
+    def limit(self, size: int, foreign_table: str = None):
+        self._limit = int(size)
+        return self
+
+    def offset(self, size: int):
+        self._offset = int(size)
+        return self
+
+    def range(self, start: int, end: int, foreign_table: str = None):
+        """Строки с start по end включительно (как Range в PostgREST)"""
+        self._offset = int(start)
+        self._limit = int(end) - int(start) + 1
+        return self
+
+    def single(self):
+        self._single = "single"
+        return self
+
+    def maybe_single(self):
+        self._single = "maybe"
+        return self
+
+    # --- ВЫПОЛНЕНИЕ ---
+    def execute(self) -> SQLiteResponse:
+        self.client.calls[f"{_HTTP_METHODS[self._operation]} {self.table}"] += 1
+        self.client.columns(self.table)
+
+        if self._operation == "select":
+            return self._execute_select()
+        if self._operation in ("insert", "upsert"):
+            return self._execute_insert()
+        if self._operation == "update":
+            return self._execute_update()
+        return self._execute_delete()
+
+    def _execute_select(self) -> SQLiteResponse:
+        where, params = self._where()
+        table = _identifier(self.table)
+
+        count = None
+        if self._count:
+            count = self.client.query(f'select count(*) as n from "{table}"{where}', params)[0]["n"]
+
+        data = []
+        if not self._head:
+            sql = f'select {self._select_list()} from "{table}"{where}'
+            if self._order:
+                sql += " order by " + ", ".join(self._order)
+            if self._limit is not None or self._offset:
+                sql += f" limit {self._limit if self._limit is not None else -1}"
+                if self._offset:
+                    sql += f" offset {self._offset}"
+            data = self.client.query(sql, params)
+
+        if self._single == "single":
+            if len(data) != 1:
+                raise SQLiteAPIError(f"JSON object requested, multiple (or no) rows returned ({len(data)})", "PGRST116")
+            data = data[0]
+        elif self._single == "maybe":
+            if len(data) > 1:
+                raise SQLiteAPIError(f"JSON object requested, multiple rows returned ({len(data)})", "PGRST116")
+            data = data[0] if data else None
+        return SQLiteResponse(data, count)
+
+    def _execute_insert(self) -> SQLiteResponse:
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        table = _identifier(self.table)
+        data = []
+
+        try:
+            with self.client.transaction():
+                for row in rows:
+                    row = {column: _value(value, column) for column, value in row.items()}
+                    columns = [f'"{_identifier(column)}"' for column in row]
+                    sql = f'insert into "{table}" ({", ".join(columns)}) values ({", ".join("?" for _ in row)})'
+                    if self._operation == "upsert":
+                        sql += self._conflict_clause(row)
+                    data += [dict(r) for r in self.client.conn.execute(sql + " returning *", list(row.values())).fetchall()]
+        except sqlite3.Error as e:
+            raise _api_error(e) from e
+        return self._respond(data)
+
+    def _execute_update(self) -> SQLiteResponse:
+        values = {column: _value(value, column) for column, value in (self._payload or {}).items()}
+        if not values:
+            return SQLiteResponse([], 0 if self._count else None)
+        where, params = self._where()
+        assignments = ", ".join(f'"{_identifier(column)}" = ?' for column in values)
+        data = self.client.query(
+            f'update "{_identifier(self.table)}" set {assignments}{where} returning *',
+            list(values.values()) + params
+        )
+        return self._respond(data)
+
+    def _execute_delete(self) -> SQLiteResponse:
+        where, params = self._where()
+        data = self.client.query(f'delete from "{_identifier(self.table)}"{where} returning *', params)
+        return self._respond(data)
+
+    def _respond(self, data: list) -> SQLiteResponse:
+        if self._single and data:
+            data = data[0]
+        return SQLiteResponse(data, len(data) if self._count else None)
+
+    def _conflict_clause(self, row: dict) -> str:
+        if self._on_conflict:
+            target = [column.strip() for column in self._on_conflict.split(",")]
+        else:
+            target = self.client.primary_key(self.table)
+        updates = [column for column in row if column not in target]
+        conflict = ", ".join(f'"{_identifier(column)}"' for column in target)
+        if self._ignore_duplicates or not updates:
+            return f" on conflict ({conflict}) do nothing"
+        assignments = ", ".join(f'"{column}" = excluded."{column}"' for column in map(_identifier, updates))
+        return f" on conflict ({conflict}) do update set {assignments}"
+
+    def _select_list(self) -> str:
+        fields = []
+        for column in (part.strip() for part in self._columns.split(",")):
+            if not column:
+                continue
+            if column == "*":
+                return "*"
+            if "(" in column:
+                raise SQLiteAPIError(f"Вложенные ресурсы не поддерживаются: {column}", "PGRST100")
+            alias, _, source = column.partition(":")
+            source = source or alias
+            if source not in self.client.columns(self.table):
+                raise SQLiteAPIError(f"column {self.table}.{source} does not exist", "42703")
+            fields.append(f'"{_identifier(source)}"' + (f' as "{_identifier(alias)}"' if source != alias else ""))
+        return ", ".join(fields) or "*"
+
+    def _where(self):
+        if not self._filters:
+            return "", []
+        parts, params = [], []
+        for node in self._filters:
+            sql, values = self._compile(node)
+            parts.append(sql)
+            params += values
+        return " where " + " and ".join(parts), params
+
+    def _compile(self, node):
+        if isinstance(node, Logic):
+            compiled = [self._compile(item) for item in node.items]
+            joiner = " and " if node.kind == "and" else " or "
+            sql = "(" + joiner.join(sql for sql, _ in compiled) + ")" if compiled else "1"
+            params = [value for _, values in compiled for value in values]
+        else:
+            sql, params = self._compile_condition(node)
+        if node.negate:
+            sql = f"not ({sql})"
+        return sql, params
+
+    def _compile_condition(self, condition: Condition):
+        types = self.client.columns(self.table)
+        if condition.column not in types:
+            raise SQLiteAPIError(f"column {self.table}.{condition.column} does not exist", "42703")
+        column = f'"{condition.column}"'
+        is_bool = types[condition.column] == "boolean"
+        is_time = is_time_column(condition.column)
+        op, value = condition.op, condition.value
+
+        if op == "is":
+            value = {"null": None, "true": True, "false": False}.get(str(value).lower(), value)
+            if value is None:
+                return f"{column} is null", []
+            return f"{column} = ?", [1 if value else 0]
+        if op == "in":
+            values = [_param(item, is_bool, is_time) for item in value]
+            if not values:
+                return "0", []
+            return f"{column} in ({', '.join('?' for _ in values)})", values
+        if op == "like":
+            return f"{column} like ?", [_pattern(value)]
+        if op == "ilike":
+            return f"casefold({column}) like casefold(?)", [_pattern(value)]
+        return f"{column} {_COMPARISONS[op]} ?", [_param(value, is_bool, is_time)]
+
+
+def _identifier(name: str) -> str:
+    if not _IDENTIFIER.match(name or ""):
+        raise SQLiteAPIError(f"Некорректное имя: {name}", "PGRST100")
+    return name
+
+
+def _value(value, column: str = ""):
+    """Значения для записи: now() как в PostgreSQL, время — в UTC, словари и списки — JSON-строкой"""
+    if value == "now()":
+        return utc_now()
+    if isinstance(value, datetime) or is_time_column(column):
+        return normalize_timestamp(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    return value
+
+
+def _param(value, is_bool: bool = False, is_time: bool = False):
+    """Значение фильтра; время приводится к виду, в котором оно хранится"""
+    if is_bool and isinstance(value, str) and value.lower() in ("true", "false"):
+        return 1 if value.lower() == "true" else 0
+    if isinstance(value, datetime) or is_time:
+        return normalize_timestamp(value)
+    return value
+
+
+def _pattern(value: str) -> str:
+    return str(value).replace("*", "%")
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _api_error(error: sqlite3.Error) -> SQLiteAPIError:
+    message = str(error)
+    if "UNIQUE constraint failed" in message:
+        code = "23505"
+    elif "NOT NULL constraint failed" in message:
+        code = "23502"
+    elif "no such column" in message or "has no column named" in message:
+        code = "42703"
+    elif "no such table" in message:
+        code = "42P01"
+    else:
+        code = "XX000"
+    logging.debug("SQLite: %s", message)
+    return SQLiteAPIError(message, code)
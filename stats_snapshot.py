@@ -0,0 +1,97 @@
+import logging
+import time
+
+from db_utils import call_rpc, count_rows, iter_rows
+from pagination import PROJECTS_ORDER
+
+
+class StatsSnapshot:
+    """Кешируемый снимок общей статистики: итоги, счетчики по проектам и топ"""
+
+    def __init__(self, ttl: float = 5, top_limit: int = 5):
+        self.ttl = ttl
+        self.top_limit = top_limit
+        self._snapshot = None
+        self._created_at = 0
+
+    def get(self, client) -> dict:
+        """Вернуть снимок из кеша или пересчитать его, если он устарел
+
+        Если пересчет не удался, отдается последний удачный снимок (следующая
+        попытка — через ttl); без него ошибка передается вызывающему.
+        """
+        if self._snapshot is None or time.monotonic() - self._created_at > self.ttl:
+            try:
+                self._snapshot = self.compute(client)
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                logging.error("Ошибка пересчета статистики, отдается прежний снимок: %s", e)
+            self._created_at = time.monotonic()
+        return self._snapshot
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def compute(self, client) -> dict:
+        # Без функции в базе — только запросы количества и топ, без прохода по user_logs
+        data = call_rpc(
+            client,
+            "stats_snapshot",
+            {"p_top_limit": self.top_limit},
+            fallback=lambda: self._compute_local(client)
+        )
+        return self._normalize(data)
+
+    def _compute_local(self, client) -> dict:
+        """Локальная замена stats_snapshot: итоги запросами количества, топ — одним запросом
+
+        Счетчиков по проектам здесь нет (projects = None), их отдает project_list.
+        """
+        return {
+            "total_projects": count_rows(client, "projects", column="id"),
+            "total_reviews": count_rows(client, "user_logs", where=lambda q: q.eq("action_type", "review"), column="id"),
+            "total_likes": count_rows(client, "user_logs", where=lambda q: q.eq("action_type", "like"), column="id"),
+            "projects": None,
+            "top_projects": client.table("projects")
+                .select("*")
+                .order(PROJECTS_ORDER)
+                .limit(self.top_limit)
+                .execute().data or []
+        }
+
+    def project_list(self, client):
+        """Все проекты по рейтингу и число отзывов у каждого: (projects, review_counts)
+
+        Со функцией stats_snapshot — из снимка. Без нее отзывы считаются
+        запросом количества на проект; это только для /list, вызывать в потоке.
+        """
+        snapshot = self.get(client)
+        if snapshot["projects"] is not None:
+            return snapshot["projects"], snapshot["review_counts"]
+
+        projects = sorted(iter_rows(client, "projects"), key=lambda p: (-p['score'], p['id']))
+        review_counts = {
+            p['id']: count_rows(
+                client, "user_logs",
+                where=lambda q, p_id=p['id']: q.eq("project_id", p_id).eq("action_type", "review"),
+                column="id"
+            )
+            for p in projects
+        }
+        return projects, review_counts
+
+    @staticmethod
+    def _normalize(data: dict) -> dict:
+        projects = data.get('projects')
+        if projects is not None:
+            projects = list(projects)
+        return {
+            "total_projects": int(data.get('total_projects') or 0),
+            "total_reviews": int(data.get('total_reviews') or 0),
+            "total_likes": int(data.get('total_likes') or 0),
+            "projects": projects,
+            "top_projects": data.get('top_projects') or [],
+            "review_counts": {p['id']: p['reviews'] for p in projects or []},
+            "like_counts": {p['id']: p['likes'] for p in projects or []}
+        }
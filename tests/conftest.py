@@ -0,0 +1,61 @@
+import importlib
+import os
+
+import pytest
+
+import db_utils
+from cache import TTLCache
+from category_counters import CategoryCounters
+from referral_codes import ReferralCodes
+from sqlite_backend import SQLiteClient
+from user_profiles import UserDirectory
+
+
+@pytest.fixture
+def db():
+    client = SQLiteClient(":memory:")
+    yield client
+    client.close()
+
+
+@pytest.fixture(autouse=True)
+def missing_rpcs(monkeypatch):
+    # Каждый тест заново узнает, каких серверных функций нет в базе
+    monkeypatch.setattr(db_utils, "_missing_rpcs", set())
+
+
+@pytest.fixture(scope="session")
+def bot_module():
+    """main.py на встроенной SQLite, без сторожа event loop"""
+    os.environ.update({
+        "BOT_TOKEN": "123456:TEST-token",
+        "REFERRAL_SECRET": "test-referral-secret",
+        "DB_BACKEND": "sqlite",
+        "SQLITE_PATH": ":memory:",
+        "LOOP_LAG_THRESHOLD_MS": "0"
+    })
+    return importlib.import_module("main")
+
+
+@pytest.fixture
+def bot(bot_module, db, monkeypatch):
+    """main.py с чистой базой и без отправки логов в Telegram"""
+    monkeypatch.setattr(bot_module, "supabase", db)
+    monkeypatch.setattr(bot_module, "user_directory", UserDirectory(db))
+    monkeypatch.setattr(bot_module, "referral_codes", ReferralCodes("test-referral-secret"))
+    monkeypatch.setattr(bot_module, "referral_summaries", TTLCache())
+    monkeypatch.setattr(bot_module, "category_counters", CategoryCounters())
+    logs = []
+    monkeypatch.setattr(bot_module, "dispatch_log", lambda admin_text=None, category=None, build=None: logs.append(admin_text))
+    bot_module.sent_logs = logs
+    return bot_module
+
+
+@pytest.fixture
+def admin_bot(bot, monkeypatch):
+    """bot, в котором любой пользователь — админ"""
+    async def is_admin(user_id):
+        return True
+
+    monkeypatch.setattr(bot, "is_user_admin", is_admin)
+    return bot
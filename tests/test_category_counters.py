@@ -0,0 +1,23 @@
+import asyncio
+
+from category_counters import CategoryCounters
+
+
+def test_requests_read_snapshot_and_refresh_runs_in_background(db):
+    db.table("projects").insert({"name": "Первый", "category": "bots", "score": 3}).execute()
+    counters = CategoryCounters(ttl=0.01)
+    assert not counters.ensure_loaded()
+    assert counters.try_load(db)
+
+    db.table("projects").insert({"name": "Второй", "category": "bots", "score": 4}).execute()
+    calls = sum(db.calls.values())
+    assert counters.ensure_loaded() and counters.count("bots") == 1
+    assert sum(db.calls.values()) == calls
+
+    async def refresh():
+        task = asyncio.create_task(counters.run_refresher(db))
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(refresh())
+    assert counters.get("bots") == {"category": "bots", "count": 2, "score_sum": 7, "avg_score": 3.5}
@@ -0,0 +1,36 @@
+import asyncio
+from types import SimpleNamespace
+
+
+def run_export(bot, text):
+    replies, documents = [], []
+
+    async def reply(text, **kwargs):
+        replies.append(text)
+        return SimpleNamespace(delete=lambda: asyncio.sleep(0))
+
+    async def reply_document(document, **kwargs):
+        documents.append(document)
+
+    message = SimpleNamespace(
+        text=text, from_user=SimpleNamespace(id=1, username="admin"), reply=reply, reply_document=reply_document
+    )
+    asyncio.run(bot.admin_export(message))
+    return replies, documents
+
+
+def test_export_too_large_for_telegram_points_to_api(admin_bot, db, monkeypatch):
+    db.table("projects").insert({"name": "Первый", "category": "bots"}).execute()
+    monkeypatch.setattr(admin_bot, "EXPORT_MAX_FILE_SIZE", 10)
+
+    replies, documents = run_export(admin_bot, "/export projects csv")
+
+    assert documents == []
+    assert "/export projects csv gz" in replies[-1]
+    assert "/api/admin/export/projects?format=csv" in replies[-1]
+
+
+def test_export_sends_document(admin_bot, db):
+    db.table("projects").insert({"name": "Первый", "category": "bots"}).execute()
+    replies, documents = run_export(admin_bot, "/export projects")
+    assert len(documents) == 1
@@ -0,0 +1,24 @@
+import logging
+import threading
+
+from log_setup import RateLimitFilter
+
+
+def test_rate_limit_is_exact_across_threads():
+    limiter = RateLimitFilter(burst=5, window=60)
+    passed = []
+
+    def worker():
+        for _ in range(500):
+            record = logging.LogRecord("bot", logging.ERROR, __file__, 1, "Ошибка базы: %s", ("timeout",), None)
+            if limiter.filter(record):
+                passed.append(record)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(passed) == 5
+    assert limiter._seen[("bot", logging.ERROR, "Ошибка базы: timeout")][2] == 8 * 500 - 5
@@ -0,0 +1,92 @@
+from postgrest import SyncPostgrestClient
+
+from db_utils import or_filter
+from pagination import (
+    after_cursor, decode_cursor, decode_time_cursor, encode_cursor, encode_time_cursor, fetch_newest_page
+)
+
+
+def projects_query():
+    return SyncPostgrestClient("http://localhost").from_("projects").select("*")
+
+
+def test_or_filter_adds_or_parameter():
+    query = or_filter(projects_query(), "score.lt.5,id.gt.3")
+    assert ("or", "(score.lt.5,id.gt.3)") in query.params.multi_items()
+
+
+def test_or_filter_uses_builder_method_when_available():
+    class Builder:
+        def or_(self, filters):
+            self.filters = filters
+            return self
+
+    assert or_filter(Builder(), "a.eq.1").filters == "a.eq.1"
+
+
+def test_cursor_round_trip():
+    for score, project_id in [(0, 1), (-17, 42), (123456, 987654321)]:
+        cursor = encode_cursor(score, project_id)
+        assert "_" not in cursor
+        assert decode_cursor(cursor) == (score, project_id)
+
+
+def test_after_cursor_filters_strictly_after_position():
+    query = after_cursor(projects_query(), encode_cursor(-3, 10))
+    assert ("or", "(score.lt.-3,and(score.eq.-3,id.gt.10))") in query.params.multi_items()
+
+
+def test_time_cursor_round_trip():
+    cursor = encode_time_cursor("2024-03-01T10:20:30.123456+00:00", 107)
+    assert decode_time_cursor(cursor) == ("2024-03-01T10:20:30.123456+00:00", 107)
+
+
+def test_fetch_newest_page_filters_strictly_before_cursor():
+    class Query:
+        def __init__(self):
+            self.params = SyncPostgrestClient("http://localhost").from_("referral_logs").select("*").params
+            self.order_by = None
+
+        def order(self, order_by):
+            self.order_by = order_by
+            return self
+
+        def limit(self, size):
+            return self
+
+        def execute(self):
+            return type("Response", (), {"data": []})()
+
+    query = Query()
+    cursor = encode_time_cursor("2024-03-01T10:20:30.123456+00:00", 107)
+    assert fetch_newest_page(query, "activated_at", "referred_user_id", cursor) == ([], None)
+    assert ("or", '(activated_at.lt."2024-03-01T10:20:30.123456+00:00",'
+                  'and(activated_at.eq."2024-03-01T10:20:30.123456+00:00",referred_user_id.lt.107))') \
+        in query.params.multi_items()
+    assert query.order_by == "activated_at.desc,referred_user_id.desc"
+
+
+def test_newest_pages_on_sqlite_cover_every_row_once(db):
+    stamps = [
+        "2024-03-01T10:20:30",
+        "2024-03-01T10:20:30+00:00",
+        "2024-03-01T13:20:30+03:00",
+        "2024-03-01T10:20:30.5Z",
+        "2024-03-02T08:00:00.000001+00:00",
+        "2024-02-29T23:59:59.999999"
+    ]
+    for user_id, stamp in enumerate(stamps, 1):
+        db.table("referral_logs").insert({"inviter_id": 1, "referred_user_id": user_id, "activated_at": stamp}).execute()
+    for user_id in range(len(stamps) + 1, len(stamps) + 4):
+        db.table("referral_logs").insert({"inviter_id": 1, "referred_user_id": user_id}).execute()
+
+    seen, cursor = [], None
+    for _ in range(10):
+        query = db.table("referral_logs").select("referred_user_id, activated_at").eq("inviter_id", 1)
+        rows, cursor = fetch_newest_page(query, "activated_at", "referred_user_id", cursor, limit=2)
+        seen += [row['referred_user_id'] for row in rows]
+        if not cursor:
+            break
+
+    # Сначала добавленные сейчас, затем по убыванию времени; одинаковое время — по id
+    assert seen == [9, 8, 7, 5, 4, 3, 2, 1, 6]
@@ -0,0 +1,195 @@
+import asyncio
+import io
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import project_ops
+from project_ops import apply_score_batch, delete_projects_cascade
+from sqlite_backend import SQLiteQueryBuilder
+
+
+class PostgrestLike:
+    """Клиент без транзакций, как supabase-py"""
+
+    def __init__(self, db):
+        self._db = db
+
+    def table(self, name):
+        return self._db.table(name)
+
+    def rpc(self, name, params=None):
+        return self._db.rpc(name, params)
+
+
+def add_project(db, name, category="bots", score=0):
+    project = db.table("projects").insert({"name": name, "category": category, "score": score}).execute().data[0]
+    db.table("user_logs").insert({
+        "user_id": 1, "project_id": project['id'], "action_type": "review", "rating_val": 5, "review_text": "ok"
+    }).execute()
+    return project
+
+
+def project_names(db):
+    return sorted(p['name'] for p in db.table("projects").select("name").execute().data)
+
+
+def admin_message(text):
+    replies = []
+
+    async def reply(text, **kwargs):
+        replies.append(text)
+
+    user = SimpleNamespace(id=1, username="admin")
+    return SimpleNamespace(text=text, from_user=user, reply=reply), replies
+
+
+def run_delete(bot, text):
+    message, replies = admin_message(text)
+    state = SimpleNamespace(clear=lambda: asyncio.sleep(0))
+    asyncio.run(bot.admin_delete(message, state))
+    return replies[-1]
+
+
+def test_delete_uses_exact_names_only(admin_bot, db):
+    add_project(db, "Бот")
+    add_project(db, "Бот Помощи")
+
+    reply = run_delete(admin_bot, "/del Бот\nКаталог\nПомощи")
+    assert "Ничего не удалено" in reply
+    assert "Каталог" in reply and "возможно, <b>Бот Помощи</b>" in reply
+    assert project_names(db) == ["Бот", "Бот Помощи"]
+
+    reply = run_delete(admin_bot, "/del Бот")
+    assert "Удалено проектов: <b>1</b>" in reply
+    assert project_names(db) == ["Бот Помощи"]
+
+
+def test_local_cascade_is_atomic(db, monkeypatch):
+    first = add_project(db, "Первый")
+    second = add_project(db, "Второй")
+    execute_delete = SQLiteQueryBuilder._execute_delete
+
+    def failing_delete(self):
+        if self.table == "projects":
+            raise RuntimeError("connection lost")
+        return execute_delete(self)
+
+    monkeypatch.setattr(SQLiteQueryBuilder, "_execute_delete", failing_delete)
+    with pytest.raises(RuntimeError):
+        delete_projects_cascade(db, [first['id'], second['id']])
+
+    assert project_names(db) == ["Второй", "Первый"]
+    assert len(db.table("user_logs").select("id").execute().data) == 2
+
+
+def test_local_cascade_requires_transactions(db):
+    project = add_project(db, "Первый")
+
+    with pytest.raises(RuntimeError, match="delete_projects_cascade"):
+        delete_projects_cascade(PostgrestLike(db), [project['id']])
+    assert project_names(db) == ["Первый"]
+    assert delete_projects_cascade(db, [project['id']])['projects'][0]['reviews'] == 1
+    assert project_names(db) == []
+
+
+def test_partial_import_is_counted_and_reported(admin_bot, db, monkeypatch):
+    rows = [{"category": "support_bots", "name": f"Бот {i}", "description": "описание"} for i in range(5)]
+    content = json.dumps(rows).encode()
+
+    async def download(document):
+        return io.BytesIO(content)
+
+    logs = []
+
+    async def send_log(text, category=None):
+        logs.append(text)
+
+    monkeypatch.setattr(admin_bot, "bot", SimpleNamespace(download=download))
+    monkeypatch.setattr(admin_bot, "send_log_to_topics", send_log)
+    monkeypatch.setattr(project_ops, "PROJECT_BATCH_SIZE", 2)
+
+    # Вторая пачка: проекты добавлены, запись истории падает
+    execute_insert = SQLiteQueryBuilder._execute_insert
+    history_inserts = []
+
+    def failing_insert(self):
+        if self.table == "rating_history":
+            history_inserts.append(self)
+            if len(history_inserts) == 2:
+                raise RuntimeError("connection lost")
+        return execute_insert(self)
+
+    monkeypatch.setattr(SQLiteQueryBuilder, "_execute_insert", failing_insert)
+
+    message, replies = admin_message("")
+    message.document = SimpleNamespace(file_size=len(content), file_name="import.json")
+    state = SimpleNamespace(clear=lambda: asyncio.sleep(0))
+    asyncio.run(admin_bot.admin_import_document(message, state))
+
+    assert len(project_names(db)) == 4
+    assert admin_bot.category_counters.count("support_bots") == 4
+    assert "Добавлено: <b>4</b> из 5" in replies[-1]
+    assert "Импорт прерван" in logs[-1] and "Добавлено: <b>4</b> из 5" in logs[-1]
+
+
+def test_score_batch_applies_all_changes(db):
+    first = add_project(db, "Первый", score=10)
+    second = add_project(db, "Второй", score=-2)
+
+    results = apply_score_batch(db, {first['id']: 5, second['id']: -3}, "сезон", 1, "admin")
+
+    assert [(r['score_before'], r['score_after']) for r in results] == [(10, 15), (-2, -5)]
+    scores = {p['name']: p['score'] for p in db.table("projects").select("name, score").execute().data}
+    assert scores == {"Первый": 15, "Второй": -5}
+    history = db.table("rating_history").select("project_id, change_amount, reason").order("project_id").execute().data
+    assert history == [
+        {"project_id": first['id'], "change_amount": 5, "reason": "сезон"},
+        {"project_id": second['id'], "change_amount": -3, "reason": "сезон"}
+    ]
+
+
+def test_score_batch_rolls_back_on_failure(db, monkeypatch):
+    project = add_project(db, "Первый", score=10)
+    execute_insert = SQLiteQueryBuilder._execute_insert
+
+    def failing_insert(self):
+        if self.table == "rating_history":
+            raise RuntimeError("connection lost")
+        return execute_insert(self)
+
+    monkeypatch.setattr(SQLiteQueryBuilder, "_execute_insert", failing_insert)
+    with pytest.raises(RuntimeError):
+        apply_score_batch(db, {project['id']: 5}, "сезон", 1, "admin")
+
+    assert db.table("projects").select("score").execute().data == [{"score": 10}]
+
+
+def test_score_batch_requires_transactions(db):
+    project = add_project(db, "Первый", score=10)
+
+    with pytest.raises(RuntimeError, match="apply_score_batch"):
+        apply_score_batch(PostgrestLike(db), {project['id']: 5}, "сезон", 1, "admin")
+    assert db.table("projects").select("score").execute().data == [{"score": 10}]
+
+
+def test_import_document_requires_admin(bot, monkeypatch):
+    downloads = []
+
+    async def download(document):
+        downloads.append(document)
+        return io.BytesIO(b"[]")
+
+    async def is_admin(user_id):
+        return False
+
+    monkeypatch.setattr(bot, "bot", SimpleNamespace(download=download))
+    monkeypatch.setattr(bot, "is_user_admin", is_admin)
+
+    message, replies = admin_message("")
+    message.document = SimpleNamespace(file_size=2, file_name="import.json")
+    state = SimpleNamespace(clear=lambda: asyncio.sleep(0))
+    asyncio.run(bot.admin_import_document(message, state))
+
+    assert downloads == [] and replies == []
@@ -0,0 +1,111 @@
+import asyncio
+import random
+from types import SimpleNamespace
+
+import pytest
+
+from referral_codes import CODE_ALPHABET, ReferralCodes
+from user_profiles import UserDirectory
+
+
+def test_code_round_trip():
+    codes = ReferralCodes("secret")
+    for user_id in (1, 777000, 5_123_456_789, (1 << 34) - 1):
+        assert codes.decode(codes.encode(user_id)) == user_id
+
+
+def test_random_codes_are_mostly_rejected():
+    codes = ReferralCodes("secret")
+    rnd = random.Random(1)
+    samples = ["".join(rnd.choice(CODE_ALPHABET) for _ in range(8)) for _ in range(2000)]
+    accepted = sum(codes.decode(code) is not None for code in samples)
+    # 6 контрольных бит: в среднем 1 из 64
+    assert accepted < 2000 / 64 * 2
+
+
+def test_codes_depend_on_secret():
+    assert ReferralCodes("one").encode(42) != ReferralCodes("two").encode(42)
+    with pytest.raises(ValueError):
+        ReferralCodes("")
+
+
+def test_legacy_code_takes_precedence():
+    codes = ReferralCodes("secret")
+    codes.add_legacy("abcd1234", 99)
+    assert codes.decode("ABCD1234") == 99
+    assert codes.is_legacy("abcd1234")
+    assert codes.code_for(99) == "ABCD1234"
+
+
+def activate(bot, code: str, referred_id: int = 2000):
+    return asyncio.run(bot.process_referral(0, referred_id, code))
+
+
+def test_unknown_inviter_is_rejected(bot):
+    # Код вычислен верно, но такого пользователя бот не видел
+    code = bot.referral_codes.encode(486940034187 % (1 << 34))
+
+    assert activate(bot, code) == (False, bot.REFERRAL_ERRORS["invalid_code"])
+    assert bot.supabase.table("referral_logs").select("*").execute().data == []
+    assert bot.supabase.table("user_stats").select("*").execute().data == []
+
+    # Активация не израсходована: настоящий код принимается
+    bot.supabase.table("user_stats").insert({"user_id": 1001, "referral_count": 0}).execute()
+    assert activate(bot, bot.referral_codes.encode(1001))[0]
+
+
+def test_malformed_code_is_rejected(bot):
+    codes = bot.referral_codes
+    bad = next(code for code in ("ZZZZZZZZ", "ZZZZZZZY", "ZZZZZZZX") if codes.decode(code) is None)
+    assert activate(bot, bad) == (False, bot.REFERRAL_ERRORS["invalid_code"])
+
+
+def test_known_inviter_is_credited(bot):
+    bot.supabase.table("user_directory").upsert({"user_id": 1001, "username": "inviter"}).execute()
+
+    ok, _ = activate(bot, bot.referral_codes.encode(1001))
+
+    assert ok
+    stats = {row["user_id"]: row["referral_count"] for row in bot.supabase.table("user_stats").select("*").execute().data}
+    assert stats == {1001: 1, 2000: 0}
+    assert activate(bot, bot.referral_codes.encode(1001)) == (False, bot.REFERRAL_ERRORS["already_activated"])
+
+
+def test_legacy_code_owner_is_accepted(bot):
+    bot.referral_codes.add_legacy("ABCD1234", 1002)
+    assert activate(bot, "abcd1234")[0]
+
+
+def test_code_from_issued_link_is_accepted_at_once(bot, monkeypatch):
+    # Профиль попадает в буфер справочника, пачка еще не сохранена
+    inviter = SimpleNamespace(id=1003, username="new_inviter", first_name="Новый", last_name=None)
+    bot.user_directory.remember(inviter)
+    assert bot.user_directory.pending == 1
+
+    async def bot_username():
+        return "rating_bot"
+
+    shown = []
+
+    async def edit(call, text, **kwargs):
+        shown.append(text)
+
+    async def answer(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(bot, "get_bot_username", bot_username)
+    monkeypatch.setattr(bot, "safe_edit_message", edit)
+    asyncio.run(bot.get_referral_link(SimpleNamespace(from_user=inviter, answer=answer)))
+
+    code = bot.referral_codes.encode(1003)
+    assert f"ref_{code}" in shown[-1]
+    assert bot.user_directory.pending == 0
+    # Другой процесс (API, перезапуск) видит пригласившего только через таблицу
+    monkeypatch.setattr(bot, "user_directory", UserDirectory(bot.supabase))
+    assert activate(bot, code)[0]
+
+
+def test_startup_requires_referral_secret(bot, monkeypatch):
+    monkeypatch.setattr(bot, "referral_codes", None)
+    with pytest.raises(SystemExit, match="REFERRAL_SECRET"):
+        asyncio.run(bot.on_startup())
@@ -0,0 +1,75 @@
+import pytest
+
+import stats_snapshot
+from stats_snapshot import StatsSnapshot
+
+
+class FlakyRPC:
+    def __init__(self, client):
+        self.client = client
+
+    def execute(self):
+        self.client.rpc_calls += 1
+        if self.client.error:
+            raise self.client.error
+        return type("Response", (), {"data": {"total_projects": 3, "projects": []}})()
+
+
+class FlakyClient:
+    def __init__(self):
+        self.error = None
+        self.rpc_calls = 0
+        self.table_calls = 0
+
+    def rpc(self, name, params):
+        return FlakyRPC(self)
+
+    def table(self, name):
+        self.table_calls += 1
+        raise AssertionError("локальный пересчет при временной ошибке")
+
+
+def test_missing_function_uses_count_queries(db, monkeypatch):
+    for name, score in (("A", 2), ("B", 7), ("C", -1)):
+        db.table("projects").insert({"name": name, "category": "c", "score": score}).execute()
+    for project_id, action in ((1, "review"), (1, "like"), (2, "review"), (2, "review")):
+        db.table("user_logs").insert({"user_id": 1, "project_id": project_id, "action_type": action}).execute()
+
+    paged = []
+    monkeypatch.setattr(stats_snapshot, "iter_rows", lambda client, table, *args, **kwargs: paged.append(table))
+    stats = StatsSnapshot(ttl=0, top_limit=2)
+    snapshot = stats.get(db)
+
+    assert (snapshot["total_projects"], snapshot["total_reviews"], snapshot["total_likes"]) == (3, 3, 1)
+    assert [p["name"] for p in snapshot["top_projects"]] == ["B", "A"]
+    assert snapshot["projects"] is None
+    assert paged == []
+
+
+def test_project_list_without_function(db):
+    for name, score in (("A", 2), ("B", 7)):
+        db.table("projects").insert({"name": name, "category": "c", "score": score}).execute()
+    db.table("user_logs").insert({"user_id": 1, "project_id": 1, "action_type": "review"}).execute()
+
+    projects, review_counts = StatsSnapshot(ttl=0).project_list(db)
+
+    assert [p["name"] for p in projects] == ["B", "A"]
+    assert review_counts == {1: 1, 2: 0}
+
+
+def test_temporary_error_serves_last_snapshot():
+    client = FlakyClient()
+    stats = StatsSnapshot(ttl=0)
+    assert stats.get(client)["total_projects"] == 3
+
+    client.error = RuntimeError("connection reset")
+    assert stats.get(client)["total_projects"] == 3
+    assert client.rpc_calls == 2
+    assert client.table_calls == 0
+
+
+def test_temporary_error_without_snapshot_is_raised():
+    client = FlakyClient()
+    client.error = RuntimeError("connection reset")
+    with pytest.raises(RuntimeError):
+        StatsSnapshot().get(client)
@@ -0,0 +1,30 @@
+from aiogram.types import CallbackQuery, Update, User
+
+from pagination import decode_time_cursor, encode_time_cursor
+from update_recorder import UpdateRecorder
+
+
+def callback_update(data: str) -> Update:
+    user = User(id=123456789, is_bot=False, first_name="Тест")
+    return Update(update_id=1, callback_query=CallbackQuery(id="1", from_user=user, chat_instance="1", data=data))
+
+
+def test_referral_cursor_id_is_pseudonymised(tmp_path):
+    recorder = UpdateRecorder(str(tmp_path), salt="salt")
+    cursor = encode_time_cursor("2024-03-01T10:20:30.123456+00:00", 7_654_321_987)
+
+    record = recorder.describe(callback_update(f"myref_2_{cursor}"), 0)
+
+    prefix, page, masked = record["d"].split("_")
+    assert (prefix, page) == ("myref", "2")
+    assert decode_time_cursor(masked) == (
+        "2024-03-01T10:20:30.123456+00:00", recorder.pseudonym(7_654_321_987)
+    )
+    assert record["u"] == recorder.pseudonym(123456789)
+
+
+def test_other_callbacks_keep_project_ids(tmp_path):
+    recorder = UpdateRecorder(str(tmp_path), salt="salt")
+    assert recorder.describe(callback_update("panel_42"), 0)["d"] == "panel_42"
+    assert recorder.mask_callback("ban_5123456789") == f"ban_{recorder.pseudonym(5123456789)}"
+    assert recorder.mask_callback("myref_1_broken") == "myref_1_x"
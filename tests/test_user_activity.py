@@ -0,0 +1,19 @@
+from datetime import datetime, timedelta, timezone
+
+from user_activity import user_activity_summary
+
+
+def test_impact_windows_use_utc(db):
+    now = datetime.now(timezone.utc)
+    moscow = timezone(timedelta(hours=3))
+    for days, amount in ((6, 1), (8, 10), (40, 100)):
+        # Время с другим часовым поясом: сравнивается как время, а не как строка
+        created_at = (now - timedelta(days=days)).astimezone(moscow).isoformat()
+        db.table("rating_history").insert({
+            "project_id": 1, "user_id": 7, "change_amount": amount, "reason": "лайк", "created_at": created_at
+        }).execute()
+
+    summary = user_activity_summary(db, 7)
+
+    assert summary["impact_7d"] == 1
+    assert summary["impact_30d"] == 11
@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+
+from user_profiles import UserDirectory, UserProfileCache
+
+
+def user(user_id: int, username: str = None):
+    return SimpleNamespace(id=user_id, username=username, first_name="Имя", last_name=None, is_bot=False)
+
+
+class BrokenClient:
+    def __init__(self):
+        self.calls = 0
+
+    def table(self, name):
+        self.calls += 1
+        raise RuntimeError('relation "public.user_directory" does not exist')
+
+
+def test_username_index_is_bounded_like_profiles(db):
+    directory = UserDirectory(db, UserProfileCache(maxsize=3))
+    for user_id in range(10):
+        directory.remember(user(user_id, f"user{user_id}"))
+    assert len(directory) == 3
+    assert directory.indexed_usernames == 3
+    assert directory.find_by_username("@USER9")["user_id"] == 9
+
+
+def test_flush_saves_batch(db):
+    directory = UserDirectory(db)
+    directory.remember(user(1, "Alice"))
+    asyncio.run(directory.flush())
+    assert directory.pending == 0
+    assert db.table("user_directory").select("user_id, username_lower").execute().data == [
+        {"user_id": 1, "username_lower": "alice"}
+    ]
+
+
+def test_failed_flush_backs_off_and_drops_after_attempts():
+    client = BrokenClient()
+    directory = UserDirectory(client, max_attempts=2, flush_interval=0)
+    directory.remember(user(1))
+    directory.remember(user(2))
+
+    async def failing_flushes():
+        await directory.flush()
+        assert directory.pending == 2
+        directory.flush_interval = 60
+        directory._retry_at = 0
+        await directory.flush()
+        # После второй неудачи профили отброшены, новые попытки ждут паузы
+        assert directory.pending == 0
+        assert directory.dropped == 2
+        directory.remember(user(3))
+        await directory.flush()
+
+    asyncio.run(failing_flushes())
+    assert client.calls == 2
+    assert directory.pending == 1
+
+
+def test_pending_buffer_is_capped():
+    directory = UserDirectory(BrokenClient(), max_pending=5, batch_size=100)
+    for user_id in range(20):
+        directory.remember(user(user_id))
+    assert directory.pending == 5
+    assert directory.dropped == 15
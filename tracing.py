@@ -0,0 +1,268 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager, nullcontext
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Виды спанов OTLP
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+_current_span = contextvars.ContextVar("trace_span", default=None)
+
+
+def current_trace_id():
+    """trace_id текущей трассы (для логов) или None"""
+    span = _current_span.get()
+    return span.trace_id if span is not None else None
+
+
+class Span:
+    """Участок трассы: имя, время начала и конца, атрибуты, родитель"""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+                 "attributes", "error", "root", "children", "exported")
+
+    def __init__(self, name: str, kind: int, parent, attributes: dict):
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+        self.root = parent.root if parent else self
+        # Спаны трассы копятся в корне до его завершения
+        self.children = [] if parent is None else None
+        self.exported = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """Трассировка апдейтов: спаны через contextvars, экспорт в OTLP/JSON
+
+    Корневой спан открывает middleware апдейта (доля sample), остальные спаны
+    создаются только внутри трассы — вне апдейтов трассировка ничего не стоит.
+    Трасса выгружается целиком после завершения корня, если он длился не
+    меньше min_duration_ms (так в файл попадают только медленные апдейты).
+    """
+
+    def __init__(self, exporter=None, sample: float = 1.0, min_duration_ms: float = 0):
+        self.exporter = exporter
+        self.sample = sample
+        self.min_duration_ms = min_duration_ms
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None and self.sample > 0
+
+    def current(self):
+        return _current_span.get()
+
+    def span(self, name: str, kind: int = KIND_INTERNAL, root: bool = False, **attributes):
+        """with tracer.span(...) as span — span равен None, если трасса не ведется"""
+        if not self.enabled:
+            return nullcontext()
+        parent = _current_span.get()
+        if parent is None and not (root and (self.sample >= 1 or random.random() < self.sample)):
+            return nullcontext()
+        return self._span(name, kind, None if root else parent, attributes)
+
+    @contextmanager
+    def _span(self, name: str, kind: int, parent, attributes: dict):
+        span = Span(name, kind, parent, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    @contextmanager
+    def activate(self, span):
+        """Продолжить трассу span в другой задаче (например, в фоновом воркере логов)"""
+        token = _current_span.set(span)
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+
+    def _finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        root = span.root
+        if span is not root:
+            if root.end_ns is None:
+                root.children.append(span)
+            elif root.exported:
+                # Фоновая работа, начатая апдейтом, закончилась позже него
+                self.exporter.add([span])
+            return
+        root.exported = root.duration_ms >= self.min_duration_ms
+        if root.exported:
+            self.exporter.add(root.children + [root])
+        root.children = []
+
+    # Наблюдатель запросов к базе (см. query_audit.AuditedClient)
+    def observing(self) -> bool:
+        return self.enabled and _current_span.get() is not None
+
+    def observe_query(self, table: str, shape: str, key: str, run):
+        with self.span(f"db {table}", KIND_CLIENT, **{"db.table": table, "db.statement": shape}):
+            return run()
+
+
+class OTLPFileExporter:
+    """Спаны в файл строками OTLP/JSON (ExportTraceServiceRequest на строку)
+
+    Формат читают OpenTelemetry Collector (filelog/otlpjsonfile), Jaeger и
+    Grafana Tempo при импорте. Запись из потока, пачками; файл ротируется
+    по размеру: traces.jsonl → traces.jsonl.1 → ... → traces.jsonl.N.
+    """
+
+    def __init__(self, path: str, service_name: str = "rating-bot", max_bytes: int = 20 * 1024 * 1024,
+                 backup_count: int = 5, flush_interval: float = 2, batch_size: int = 2000):
+        self.path = path
+        self.service_name = service_name
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.exported = 0
+        self._pending = []
+        self._flush_task = None
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def add(self, spans: list):
+        self._pending.extend(spans)
+        if len(self._pending) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # Спан завершился в потоке (asyncio.to_thread) — запишет плановый сброс
+                return
+            self._flush_task = loop.create_task(self.flush())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "rating_bot.tracing"}, "spans": [span.to_otlp() for span in batch]}]
+            }]
+        }
+        line = json.dumps(request, ensure_ascii=False, separators=(",", ":")) + "\n"
+        try:
+            await asyncio.to_thread(self._write, line)
+            self.exported += len(batch)
+        except Exception as e:
+            logging.error("Ошибка записи трасс: %s", e)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _write(self, line: str):
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+            for i in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"):
+                    os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def update_route(update) -> str:
+    """Короткое имя апдейта для трассы: команда, префикс callback_data или тип"""
+    if update.callback_query:
+        return f"callback {(update.callback_query.data or '').split('_')[0]}_"
+    if update.message and update.message.text and update.message.text.startswith("/"):
+        return f"command {update.message.text.split()[0]}"
+    return update.event_type
+
+
+class TracingMiddleware(BaseMiddleware):
+    """Корневой спан апдейта (подключается первым)"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event, data):
+        with self.tracer.span(
+            f"update {update_route(event)}", KIND_SERVER, root=True,
+            **{"telegram.update_id": event.update_id, "telegram.update_type": event.event_type}
+        ):
+            return await handler(event, data)
+
+
+class TracingHandlerMiddleware(BaseMiddleware):
+    """Внутренний middleware роутера: спан обработчика с его именем"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = getattr(handler_object.callback, "__name__", "handler") if handler_object else "handler"
+        current = self.tracer.current()
+        if current is not None:
+            current.root.set("handler", name)
+        with self.tracer.span(f"handler {name}", **{"code.function": name}):
+            return await handler(event, data)
+
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Спан каждого запроса к Bot API (bot.session.middleware)"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(self, make_request, bot, method):
+        name = getattr(method, "__api_method__", type(method).__name__)
+        with self.tracer.span(f"telegram {name}", KIND_CLIENT, **{"telegram.method": name}):
+            return await make_request(bot, method)
@@ -0,0 +1,189 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import secrets
+import time
+from datetime import datetime
+
+from aiogram import BaseMiddleware
+
+from pagination import decode_time_cursor, encode_time_cursor
+
+# Псевдонимы пользователей: отдельный диапазон, чтобы не пересекаться с настоящими id
+PSEUDONYM_BASE = 9_000_000_000
+PSEUDONYM_SPAN = 2 ** 32
+
+# Числа такой длины в тексте считаются user_id и тоже заменяются псевдонимами
+USER_ID_RE = re.compile(r"\b\d{7,}\b")
+NON_DIGIT_RE = re.compile(r"[^\s\d]")
+# «Мои рефералы»: myref_{страница}_{курсор}, в курсоре id приглашенного в base36
+REFERRALS_PAGE_RE = re.compile(r"^myref_(\d+)_(.+)$")
+FILE_PREFIX = "updates-"
+FILE_SUFFIX = ".jsonl"
+
+
+class UpdateRecorder:
+    """Запись входящих апдейтов для воспроизведения (bench/replay.py)
+
+    Одна строка JSON на апдейт: время, тип, псевдоним пользователя,
+    текст или callback_data и время обработки. id пользователей (в том числе
+    внутри callback_data) заменяются HMAC-псевдонимами, имена не пишутся,
+    произвольный текст (отзывы, поиск) маскируется с сохранением длины —
+    остаются только кнопки меню и команды.
+    Записи копятся в памяти и дописываются в файл из потока; при превышении
+    max_bytes начинается новый файл, старше backup_count файлов удаляются.
+    """
+
+    def __init__(self, directory: str, keep_texts=(), salt: str = None, max_bytes: int = 20 * 1024 * 1024,
+                 backup_count: int = 10, flush_interval: float = 2, batch_size: int = 500):
+        self.directory = directory
+        self.keep_texts = set(keep_texts)
+        self._salt = (salt or secrets.token_hex(16)).encode()
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.recorded = 0
+        self._pending = []
+        self._path = None
+        self._flush_task = None
+        os.makedirs(directory, exist_ok=True)
+
+    def pseudonym(self, user_id: int) -> int:
+        digest = hmac.new(self._salt, str(user_id).encode(), hashlib.sha256).digest()
+        return PSEUDONYM_BASE + int.from_bytes(digest[:4], "big") % PSEUDONYM_SPAN
+
+    def mask_text(self, text: str) -> str:
+        """Кнопки меню как есть; у команд — имя и аргументы без личных данных"""
+        if text in self.keep_texts:
+            return text
+        if text.startswith("/"):
+            command, _, args = text.partition(" ")
+            if not args:
+                return command
+            args = USER_ID_RE.sub(lambda m: str(self.pseudonym(int(m.group()))), args)
+            return f"{command} {NON_DIGIT_RE.sub('x', args)}"
+        return re.sub(r"\S", "x", text)
+
+    def mask_callback(self, data: str) -> str:
+        """callback_data с псевдонимами вместо id пользователей; формат кнопки сохраняется"""
+        match = REFERRALS_PAGE_RE.match(data)
+        if match:
+            try:
+                activated_at, user_id = decode_time_cursor(match.group(2))
+            except ValueError:
+                return f"myref_{match.group(1)}_x"
+            return f"myref_{match.group(1)}_{encode_time_cursor(activated_at, self.pseudonym(user_id))}"
+        return "_".join(
+            str(self.pseudonym(int(part))) if USER_ID_RE.fullmatch(part) else part
+            for part in data.split("_")
+        )
+
+    def describe(self, update, received_at: float) -> dict:
+        """Компактная запись апдейта (ключи короткие: файлов за день много)"""
+        record = {"t": round(received_at, 3), "k": update.event_type}
+        event = update.event
+        user = getattr(event, "from_user", None)
+        if user:
+            record["u"] = self.pseudonym(user.id)
+
+        if update.message:
+            message = update.message
+            if message.chat.id != (user.id if user else None):
+                record["ch"] = message.chat.id if message.chat.id < 0 else self.pseudonym(message.chat.id)
+            text = message.text or message.caption
+            if text:
+                record["x"] = self.mask_text(text)
+            if message.content_type != "text":
+                record["m"] = message.content_type
+        elif update.callback_query:
+            call = update.callback_query
+            record["d"] = self.mask_callback(call.data) if call.data else call.data
+            if call.message and getattr(call.message, "photo", None):
+                record["p"] = 1
+        return record
+
+    def add(self, record: dict):
+        self._pending.append(record)
+        self.recorded += 1
+        if len(self._pending) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        lines = "".join(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n" for record in batch)
+        try:
+            await asyncio.to_thread(self._write, lines)
+        except Exception as e:
+            logging.error("Ошибка записи апдейтов: %s", e)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def _write(self, lines: str):
+        if self._path is None or os.path.getsize(self._path) >= self.max_bytes:
+            self._rotate()
+        with open(self._path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _rotate(self):
+        name = f"{FILE_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}{FILE_SUFFIX}"
+        self._path = os.path.join(self.directory, name)
+        open(self._path, "a").close()
+        files = recorded_files(self.directory)
+        for path in files[:max(len(files) - self.backup_count, 0)]:
+            os.remove(path)
+
+
+def recorded_files(path: str) -> list:
+    """Файлы записи по порядку (имя файла — время его создания)"""
+    if os.path.isfile(path):
+        return [path]
+    return [
+        os.path.join(path, name) for name in sorted(os.listdir(path))
+        if name.startswith(FILE_PREFIX) and name.endswith(FILE_SUFFIX)
+    ]
+
+
+def read_records(paths) -> list:
+    records = []
+    for path in paths:
+        for file_path in recorded_files(path):
+            with open(file_path, encoding="utf-8") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: record["t"])
+    return records
+
+
+class UpdateRecorderMiddleware(BaseMiddleware):
+    """Пишет каждый апдейт вместе со временем его обработки (подключается первым)"""
+
+    def __init__(self, recorder: UpdateRecorder):
+        self.recorder = recorder
+
+    async def __call__(self, handler, event, data):
+        received_at = time.time()
+        started = time.perf_counter()
+        error = None
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            try:
+                record = self.recorder.describe(event, received_at)
+                record["ms"] = round((time.perf_counter() - started) * 1000, 1)
+                if error:
+                    record["e"] = error
+                self.recorder.add(record)
+            except Exception as e:
+                logging.error("Ошибка записи апдейта: %s", e)
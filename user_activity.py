@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+from db_utils import call_rpc, count_rows
+from postgrest_filters import normalize_timestamp
+
+
+def user_activity_summary(client, user_id: int, recent_limit: int = 5) -> dict:
+    """Отзывы, лайки, влияние на рейтинг за 7/30 дней, последние действия и бан пользователя"""
+    return call_rpc(
+        client,
+        "user_activity_summary",
+        {"p_user_id": user_id, "p_recent_limit": recent_limit},
+        fallback=lambda: _user_activity_summary_local(client, user_id, recent_limit),
+        fallback_on_error=True
+    )
+
+
+def _user_activity_summary_local(client, user_id: int, recent_limit: int) -> dict:
+    """Локальная замена user_activity_summary: только запросы по индексу user_id"""
+    def by_action(action_type):
+        return lambda q: q.eq("user_id", user_id).eq("action_type", action_type)
+
+    # Границы в UTC, как created_at в базе
+    now = datetime.now(timezone.utc)
+    month_ago = normalize_timestamp(now - timedelta(days=30))
+    week_ago = normalize_timestamp(now - timedelta(days=7))
+
+    month_changes = client.table("rating_history")\
+        .select("change_amount, created_at")\
+        .eq("user_id", user_id)\
+        .gte("created_at", month_ago)\
+        .execute().data or []
+
+    recent = client.table("rating_history")\
+        .select("project_id, change_amount, reason, created_at")\
+        .eq("user_id", user_id)\
+        .order("created_at", desc=True)\
+        .limit(recent_limit)\
+        .execute().data or []
+
+    ban = client.table("banned_users")\
+        .select("*")\
+        .eq("user_id", user_id)\
+        .limit(1)\
+        .execute().data
+
+    return {
+        "user_id": user_id,
+        "reviews": count_rows(client, "user_logs", where=by_action("review"), column="id"),
+        "likes": count_rows(client, "user_logs", where=by_action("like"), column="id"),
+        "impact_7d": sum(row['change_amount'] or 0 for row in month_changes if normalize_timestamp(row['created_at']) >= week_ago),
+        "impact_30d": sum(row['change_amount'] or 0 for row in month_changes),
+        "recent": recent,
+        "ban": ban[0] if ban else None
+    }
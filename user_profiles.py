@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import time
+
+from aiogram import BaseMiddleware
+
+from cache import TTLCache
+
+
+class UserProfileCache:
+    """Профили пользователей (user_id → username, имя), собранные из входящих апдейтов"""
+
+    def __init__(self, maxsize: int = 50000, ttl: float = 86400, concurrency: int = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._profiles = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.concurrency = concurrency
+
+    def remember(self, user):
+        self.put({
+            "user_id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name
+        })
+
+    def put(self, profile: dict):
+        self._profiles.set(profile["user_id"], profile)
+
+    def get(self, user_id: int):
+        return self._profiles.get(user_id)
+
+    async def resolve(self, bot, user_ids) -> dict:
+        """Профили для списка user_id; промахи запрашиваются у Telegram параллельно"""
+        profiles = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            profile = self.get(user_id)
+            if profile:
+                profiles[user_id] = profile
+            else:
+                missing.append(user_id)
+
+        if missing:
+            semaphore = asyncio.Semaphore(self.concurrency)
+
+            async def fetch(user_id):
+                async with semaphore:
+                    try:
+                        chat = await bot.get_chat(user_id)
+                    except Exception as e:
+                        logging.warning("Не удалось получить профиль %s: %s", user_id, e)
+                        return
+                    profile = {
+                        "user_id": user_id,
+                        "username": chat.username,
+                        "first_name": chat.first_name,
+                        "last_name": chat.last_name
+                    }
+                    self.put(profile)
+                    profiles[user_id] = profile
+
+            await asyncio.gather(*(fetch(user_id) for user_id in missing))
+
+        return profiles
+
+    @staticmethod
+    def display_name(profile, user_id: int) -> str:
+        """username или id — как в логах бота"""
+        if profile and profile.get("username"):
+            return profile["username"]
+        return str(user_id)
+
+    def __len__(self):
+        return len(self._profiles)
+
+
+class UserDirectory:
+    """Справочник пользователей: индекс по id и по username в нижнем регистре
+
+    Профили из апдейтов копятся в буфере и сохраняются в таблицу
+    user_directory пачками (повторные апдейты одного пользователя
+    склеиваются в одну запись). Поиск идет сначала по памяти, затем
+    одним запросом по индексу таблицы — без обращений к Telegram.
+
+    Если таблица недоступна, буфер не растет без предела: в нем не больше
+    max_pending профилей, профиль отбрасывается после max_attempts неудачных
+    сохранений, а повторы идут с нарастающей паузой (до max_backoff секунд).
+    """
+
+    COLUMNS = "user_id, username, first_name, last_name"
+
+    def __init__(self, client, profiles: UserProfileCache = None, batch_size: int = 200, flush_interval: float = 5,
+                 max_pending: int = 10000, max_attempts: int = 5, max_backoff: float = 300):
+        self.client = client
+        self.profiles = profiles if profiles is not None else UserProfileCache()
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.max_backoff = max_backoff
+        self.dropped = 0
+        # Индекс по username ограничен так же, как кеш профилей
+        self._by_username = TTLCache(maxsize=self.profiles.maxsize, ttl=self.profiles.ttl)
+        self._pending = {}
+        self._attempts = {}
+        self._failures = 0
+        self._retry_at = 0
+        self._flush_task = None
+
+    def _index(self, profile: dict):
+        self.profiles.put(profile)
+        if profile.get("username"):
+            self._by_username.set(profile["username"].lower(), profile["user_id"])
+
+    def _queue(self, profile: dict):
+        self._pending.pop(profile["user_id"], None)
+        self._pending[profile["user_id"]] = profile
+        while len(self._pending) > self.max_pending:
+            user_id = next(iter(self._pending))
+            del self._pending[user_id]
+            self._attempts.pop(user_id, None)
+            self.dropped += 1
+
+    def remember(self, user):
+        profile = {
+            "user_id": user.id,
+            "username": user.username,
+            "first_name": user.first_name,
+            "last_name": user.last_name
+        }
+        if self.profiles.get(user.id) == profile:
+            return
+
+        old = self.profiles.get(user.id)
+        if old and old.get("username") and old["username"] != user.username:
+            self._by_username.pop(old["username"].lower(), None)
+
+        self._index(profile)
+        self._queue(profile)
+
+        if len(self._pending) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.create_task(self.flush())
+
+    @staticmethod
+    def _row(profile: dict) -> dict:
+        return {**profile, "username_lower": profile["username"].lower() if profile["username"] else None}
+
+    async def _upsert(self, rows):
+        await asyncio.to_thread(
+            lambda: self.client.table("user_directory").upsert(rows, on_conflict="user_id").execute()
+        )
+
+    async def save(self, user) -> bool:
+        """Сохранить профиль сразу, не дожидаясь пачки
+
+        При ошибке профиль остается в буфере и уйдет со следующей пачкой.
+        """
+        self.remember(user)
+        profile = self._pending.pop(user.id, None) or self.profiles.get(user.id)
+        try:
+            await self._upsert([self._row(profile)])
+        except Exception as e:
+            logging.error("Ошибка сохранения профиля %s в справочник: %s", user.id, e)
+            if user.id not in self._pending:
+                self._queue(profile)
+            return False
+        self._attempts.pop(user.id, None)
+        return True
+
+    async def flush(self):
+        """Сохранить накопленные профили одним upsert"""
+        if not self._pending or time.monotonic() < self._retry_at:
+            return
+        batch, self._pending = self._pending, {}
+        rows = [self._row(profile) for profile in batch.values()]
+        try:
+            await self._upsert(rows)
+        except Exception as e:
+            self._failures += 1
+            backoff = min(self.flush_interval * 2 ** self._failures, self.max_backoff)
+            self._retry_at = time.monotonic() + backoff
+            logging.error("Ошибка сохранения справочника пользователей (повтор через %g с): %s", backoff, e)
+            # Вернем в буфер то, что не было перезаписано более свежими данными
+            for user_id, profile in batch.items():
+                attempts = self._attempts.get(user_id, 0) + 1
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(user_id, None)
+                    self.dropped += 1
+                elif user_id not in self._pending:
+                    self._attempts[user_id] = attempts
+                    self._queue(profile)
+            return
+        self._failures = 0
+        self._retry_at = 0
+        for user_id in batch:
+            self._attempts.pop(user_id, None)
+
+    async def run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    def get(self, user_id: int):
+        return self.profiles.get(user_id)
+
+    def find_by_username(self, username: str):
+        """Профиль по username (с @ или без, без учета регистра)"""
+        key = username.lstrip("@").lower()
+        user_id = self._by_username.get(key)
+        if user_id is not None:
+            profile = self.get(user_id)
+            if profile and (profile.get("username") or "").lower() == key:
+                return profile
+            self._by_username.pop(key, None)
+
+        rows = self.client.table("user_directory")\
+            .select(self.COLUMNS)\
+            .eq("username_lower", key)\
+            .limit(1)\
+            .execute().data
+        if rows:
+            self._index(rows[0])
+            return rows[0]
+        return None
+
+    def lookup_many(self, user_ids) -> dict:
+        """Профили из памяти, промахи — одним запросом к user_directory"""
+        profiles = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            profile = self.get(user_id)
+            if profile:
+                profiles[user_id] = profile
+            else:
+                missing.append(user_id)
+
+        if missing:
+            try:
+                rows = self.client.table("user_directory")\
+                    .select(self.COLUMNS)\
+                    .in_("user_id", missing)\
+                    .execute().data or []
+            except Exception as e:
+                logging.error("Ошибка чтения справочника пользователей: %s", e)
+                rows = []
+            for row in rows:
+                self._index(row)
+                profiles[row["user_id"]] = row
+
+        return profiles
+
+    async def resolve(self, bot, user_ids) -> dict:
+        """Как lookup_many, но тех, кого нет в справочнике, спрашиваем у Telegram"""
+        user_ids = list(dict.fromkeys(user_ids))
+        profiles = self.lookup_many(user_ids)
+        missing = [user_id for user_id in user_ids if user_id not in profiles]
+        if missing:
+            fetched = await self.profiles.resolve(bot, missing)
+            for user_id, profile in fetched.items():
+                self._index(profile)
+                self._queue(profile)
+            profiles.update(fetched)
+        return profiles
+
+    @staticmethod
+    def display_name(profile, user_id: int) -> str:
+        return UserProfileCache.display_name(profile, user_id)
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    @property
+    def indexed_usernames(self) -> int:
+        return len(self._by_username)
+
+    def __len__(self):
+        return len(self.profiles)
+
+
+class UserProfileMiddleware(BaseMiddleware):
+    """Запоминает from_user каждого апдейта, чтобы не спрашивать Telegram повторно"""
+
+    def __init__(self, profiles):
+        # UserProfileCache или UserDirectory
+        self.profiles = profiles
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user and not user.is_bot:
+            self.profiles.remember(user)
+        return await handler(event, data)